@@ -1,5 +1,5 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
-from models import db, User, Video, Favorite, Technique, Category, Paint, PaintBackup, PaintImage, PriceSource, PriceHistory
+from models import db, User, Video, Favorite, Technique, Category, Paint, PaintBackup, PaintImage, PaintEquivalent, NotificationOutbox, NotificationDeviceCursor, PriceSource, PriceHistory, DeletedPaint, normalize_paint_code, PAINT_CHANGE_TRACKING_SQL
 from functools import wraps
 import os
 from datetime import datetime, timedelta
@@ -67,48 +67,194 @@ db.init_app(app)
 from functools import wraps
 import time
 
-paint_cache = {}
+from shared_state import get_shared_state, SharedTTLCache
+
+# Estado compartido entre workers (Redis, fichero SQLite local o memoria; ver shared_state.py)
+shared_state = get_shared_state()
+print(f"🔗 Shared state backend: {shared_state.name}")
+
 CACHE_TIMEOUT = 300  # 5 minutos
+PAINT_CACHE_MAX_ENTRIES = 1000  # Se purgan las más antiguas al superar el límite
+
+# Guarda payloads (dict), nunca objetos Response. Se invalida al confirmar escrituras de Paint
+paint_cache = SharedTTLCache(shared_state, 'paint_cache', max_entries=PAINT_CACHE_MAX_ENTRIES, ttl=CACHE_TIMEOUT)
 
 def clear_paint_cache(paint_id=None):
     """Limpiar caché de pintura específica o todo el caché"""
     if paint_id:
-        cache_key = f"paint_{paint_id}"
-        if cache_key in paint_cache:
-            del paint_cache[cache_key]
+        if paint_cache.delete(f"paint_{paint_id}"):
             print(f"🗑️ Cache cleared para paint_id: {paint_id}")
     else:
         paint_cache.clear()
         print("🗑️ Cache completamente limpiado")
 
 def cache_paint_result(timeout=CACHE_TIMEOUT):
+    """
+    Cachear el payload (dict) devuelto por una vista de pintura.
+    Debe ir DEBAJO de @admin_required para que los aciertos de caché también pasen por autenticación.
+    """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             # Generar clave de cache - obtener paint_id de kwargs si está disponible
             paint_id = kwargs.get('paint_id') or (args[0] if args else 'all')
             cache_key = f"paint_{paint_id}"
-            current_time = time.time()
             
-            print(f"🔍 Cache check para paint_id: {paint_id}, cache_key: {cache_key}")
+            cached_data = paint_cache.get(cache_key)
+            if cached_data is not None:
+                print(f"📦 Cache HIT para {cache_key}")
+                return cached_data
             
-            # Verificar si existe en cache y no ha expirado
-            if cache_key in paint_cache:
-                cached_data, cached_time = paint_cache[cache_key]
-                if current_time - cached_time < timeout:
-                    print(f"📦 Cache HIT para {cache_key}")
-                    return cached_data
-            
-            # Ejecutar función y cachear resultado
+            # Ejecutar función y cachear solo respuestas correctas (dict), no errores
             print(f"💾 Cache MISS para {cache_key} - ejecutando función")
             result = f(*args, **kwargs)
-            paint_cache[cache_key] = (result, current_time)
-            print(f"💾 Resultado cacheado para {cache_key}")
+            if isinstance(result, dict):
+                paint_cache.set(cache_key, result, ttl=timeout)
             
             return result
         return decorated_function
     return decorator
 
+# Versión del catálogo: contador monótono que se incrementa con cada escritura
+# de pinturas, videos, técnicas o categorías. Los listados lo usan como ETag.
+# Vive en el estado compartido para que todos los workers den el mismo ETag.
+import threading
+import zlib
+from sqlalchemy import event
+from sqlalchemy.orm import selectinload
+
+CATALOG_MODELS = (Paint, Video, Technique, Category)
+
+# Índice de colores en memoria del worker para /api/paints/similar (ver color_matching.py)
+from color_matching import PaintColorIndex, parse_hex_color
+paint_color_index = PaintColorIndex()
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_EPOCH_KEY = 'catalog:epoch'
+
+def get_catalog_epoch():
+    """
+    Identificador del contador actual. Si el estado compartido se pierde (y el contador
+    vuelve a 0) cambia el epoch, así un ETag antiguo nunca coincide con datos nuevos.
+    """
+    epoch = shared_state.get(CATALOG_EPOCH_KEY)
+    if epoch is None:
+        shared_state.add(CATALOG_EPOCH_KEY, f"{int(time.time()):x}{os.getpid():x}".encode('ascii'))
+        epoch = shared_state.get(CATALOG_EPOCH_KEY)
+    return epoch.decode('ascii') if isinstance(epoch, bytes) else epoch
+
+def get_catalog_version():
+    return shared_state.get_int(CATALOG_VERSION_KEY)
+
+def bump_catalog_version(reason=None):
+    """Incrementar la versión del catálogo (invalida los ETag de los listados)"""
+    version = shared_state.incr(CATALOG_VERSION_KEY)
+    print(f"🔖 Catalog version -> {version}" + (f" ({reason})" if reason else ""))
+    return version
+
+def invalidate_catalog(reason=None, paint_ids=None):
+    """
+    Invalidar todo lo derivado del catálogo tras una escritura confirmada:
+    versión/ETag (y con ella el snapshot de /api/paints) y caché de pinturas.
+    Se llama automáticamente al hacer commit de cambios del ORM; las rutas que
+    escriben con SQL directo deben llamarla explícitamente (paint_ids=None limpia todo).
+    """
+    try:
+        version = bump_catalog_version(reason)
+    except Exception as e:
+        # La escritura ya está confirmada: registrar el error en vez de responder 500.
+        # Los ETag y el snapshot siguen en la versión anterior hasta el siguiente cambio
+        print(f"⚠️ Catalog version bump failed" + (f" ({reason})" if reason else "") + f": {str(e)}")
+        version = None
+        paint_ids = None
+    if paint_ids is None:
+        clear_paint_cache()
+        # Filas desconocidas: el índice de colores se reconstruye entero en la próxima consulta
+        paint_color_index.built = False
+    else:
+        for paint_id in paint_ids:
+            clear_paint_cache(paint_id)
+    return version
+
+def catalog_etag(scope):
+    """ETag fuerte del listado: versión del catálogo + variante de la query string"""
+    etag = f"{scope}-{get_catalog_epoch()}-{get_catalog_version()}"
+    if request.query_string:
+        etag += f"-{zlib.crc32(request.query_string):08x}"
+    return etag
+
+def catalog_not_modified(etag):
+    """Respuesta 304 si el cliente ya tiene esta versión (sin tocar la base de datos)"""
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def with_catalog_etag(response, etag):
+    if response.status_code == 200:
+        response.set_etag(etag)
+    return response
+
+def _session_touches_catalog(session):
+    return any(isinstance(obj, CATALOG_MODELS)
+               for obj in list(session.new) + list(session.dirty) + list(session.deleted))
+
+def _paint_color_or_brand_changed(session, paint):
+    if paint in session.new or paint in session.deleted:
+        return True
+    from sqlalchemy.orm.attributes import get_history
+    return any(get_history(paint, attribute).has_changes() for attribute in ('color_preview', 'brand'))
+
+@event.listens_for(db.session, 'after_flush')
+def _track_catalog_flush(session, flush_context):
+    if _session_touches_catalog(session):
+        session.info['catalog_changed'] = True
+        session.info.setdefault('changed_paint_ids', set()).update(
+            obj.id for obj in list(session.dirty) + list(session.deleted)
+            if isinstance(obj, Paint) and obj.id is not None
+        )
+        # Cambios para aplicar al índice de colores tras el commit (sin releer la base de datos)
+        color_changes = session.info.setdefault('paint_color_changes', [])
+        color_changes.extend(
+            ('upsert', obj.id, obj.color_preview, obj.brand, obj.stock)
+            for obj in list(session.new) + list(session.dirty) if isinstance(obj, Paint)
+        )
+        color_changes.extend(('remove', obj.id, None, None, None) for obj in session.deleted if isinstance(obj, Paint))
+        # Pinturas cuyas equivalencias entre marcas hay que recalcular
+        session.info.setdefault('equivalent_paint_ids', set()).update(
+            obj.id for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+            if isinstance(obj, Paint) and _paint_color_or_brand_changed(session, obj)
+        )
+
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def _track_catalog_bulk(context):
+    if context.mapper.class_ in CATALOG_MODELS:
+        context.session.info['catalog_changed'] = True
+        if context.mapper.class_ is Paint:
+            # No sabemos qué filas cambiaron: limpiar toda la caché de pinturas
+            context.session.info['all_paints_changed'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_catalog_on_commit(session):
+    changed_paint_ids = session.info.pop('changed_paint_ids', set())
+    all_paints_changed = session.info.pop('all_paints_changed', False)
+    color_changes = session.info.pop('paint_color_changes', [])
+    equivalent_paint_ids = session.info.pop('equivalent_paint_ids', set())
+    if session.info.pop('catalog_changed', False):
+        version = invalidate_catalog(paint_ids=None if all_paints_changed else changed_paint_ids)
+        if color_changes and not all_paints_changed:
+            apply_paint_color_changes(color_changes, version)
+        if equivalent_paint_ids:
+            schedule_paint_equivalents_refresh(equivalent_paint_ids)
+
+@event.listens_for(db.session, 'after_rollback')
+def _reset_catalog_on_rollback(session):
+    for key in ('catalog_changed', 'changed_paint_ids', 'all_paints_changed', 'paint_color_changes',
+                'equivalent_paint_ids'):
+        session.info.pop(key, None)
+
 # Decoradores para proteger rutas
 def login_required(f):
     @wraps(f)
@@ -140,6 +286,16 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def admin_or_api_key_required(f):
+    """Como admin_required, pero también admite la cabecera X-API-Key (scripts externos)"""
+    admin_view = admin_required(f)
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.headers.get('X-API-Key') == API_KEY:
+            return f(*args, **kwargs)
+        return admin_view(*args, **kwargs)
+    return decorated_function
+
 # Rutas públicas
 @app.route('/')
 def index():
@@ -584,15 +740,11 @@ def user_videos():
     # Obtener el parámetro para mostrar todos los niveles o solo el del usuario
     show_all_levels = request.args.get('show_all_levels', 'false').lower() == 'true'
     
-    # Filtrar videos según el nivel de experiencia del usuario
-    if show_all_levels:
-        videos = Video.query.all()
-    else:
-        videos = Video.query.filter(Video.difficulty_level == user.experience_level).all()
-    
-    # Cargar técnicas para cada video
-    for video in videos:
-        video.techniques = Technique.query.filter_by(video_id=video.id).all()
+    # Filtrar videos según el nivel de experiencia del usuario (técnicas en una sola consulta extra)
+    query = Video.query.options(selectinload(Video.techniques))
+    if not show_all_levels:
+        query = query.filter(Video.difficulty_level == user.experience_level)
+    videos = query.all()
     
     try:
         return render_template('user/videos.html', videos=videos, user=user, show_all_levels=show_all_levels)
@@ -607,13 +759,9 @@ def user_videos():
 @app.route('/user/videos/all')
 @login_required
 def user_all_videos():
-    videos = Video.query.all()
+    videos = Video.query.options(selectinload(Video.techniques)).all()
     user = User.query.get(session['user_id'])
     
-    # Cargar técnicas para cada video
-    for video in videos:
-        video.techniques = Technique.query.filter_by(video_id=video.id).all()
-    
     try:
         return render_template('user/videos.html', videos=videos, user=user, show_all_levels=True)
     except Exception as e:
@@ -628,13 +776,9 @@ def user_all_videos():
 @login_required
 def user_favorites():
     user = User.query.get(session['user_id'])
-    favorites = Favorite.query.filter_by(user_id=user.id).all()
-    
-    videos = []
-    for favorite in favorites:
-        video = favorite.video
-        video.techniques = Technique.query.filter_by(video_id=video.id).all()
-        videos.append(video)
+    videos = Video.query.join(Favorite, Favorite.video_id == Video.id).filter(
+        Favorite.user_id == user.id
+    ).options(selectinload(Video.techniques)).order_by(Favorite.id).all()
     
     try:
         return render_template('user/favorites.html', videos=videos, user=user)
@@ -742,14 +886,14 @@ def admin_dashboard():
 @app.route('/admin/videos')
 @admin_required
 def admin_videos():
-    videos = Video.query.all()
+    # La galería carga los videos por páginas desde /api/videos: no hace falta consultarlos aquí
     user = User.query.get(session['user_id'])  # Añade esta línea para obtener el usuario actual
     try:
-        return render_template('admin/videos.html', videos=videos, user=user)  # Pasa user a la plantilla
+        return render_template('admin/videos.html', user=user)  # Pasa user a la plantilla
     except Exception as e:
         print(f"Error al cargar la plantilla admin videos: {str(e)}")
         try:
-            return render_template('user/admin/videos.html', videos=videos, user=user)  # Pasa user aquí también
+            return render_template('user/admin/videos.html', user=user)  # Pasa user aquí también
         except Exception as e2:
             print(f"Error con plantilla alternativa: {str(e2)}")
             raise e
@@ -1023,41 +1167,113 @@ def delete_technique(technique_id):
     
     return '', 204
 
+def video_to_dict(video):
+    """Video con sus técnicas (video.techniques ya viene ordenado por start_time)"""
+    return {
+        'id': video.id,
+        'title': video.title,
+        'description': video.description,
+        'video_id': video.video_id,
+        'channel': video.channel,
+        'category': video.category,
+        'category_id': video.category_id,
+        'technique_start_time': video.technique_start_time,
+        'technique_end_time': video.technique_end_time,
+        'difficulty_level': video.difficulty_level,
+        'video_version': video.video_version,  # MODIFICADO: 'video_version' en lugar de 'version'
+        'published_at': video.published_at.isoformat() if video.published_at else None,
+        'techniques': [{
+            'id': technique.id,
+            'name': technique.name,
+            'start_time': technique.start_time,
+            'end_time': technique.end_time
+        } for technique in video.techniques]
+    }
+
+# Filtros y paginación keyset de /api/videos (índices videos(difficulty_level, id) y videos(category_id, id))
+VIDEO_FILTER_PARAMS = ('difficulty', 'category_id', 'channel')
+VIDEO_QUERY_PARAMS = ('limit', 'cursor') + VIDEO_FILTER_PARAMS
+VIDEOS_PAGE_DEFAULT_LIMIT = 50
+VIDEOS_PAGE_MAX_LIMIT = 200
+
+def apply_video_filters(query):
+    """
+    Aplicar los filtros difficulty/category_id (separados por comas o repetidos) y channel de la petición.
+    category_id=none selecciona los videos sin categoría
+    """
+    difficulties = get_multi_arg('difficulty')
+    if difficulties:
+        query = query.filter(Video.difficulty_level.in_(difficulties))
+    category_ids = get_multi_arg('category_id')
+    if category_ids:
+        conditions = [Video.category_id.is_(None)] if 'none' in category_ids else []
+        try:
+            ids = [int(category_id) for category_id in category_ids if category_id != 'none']
+        except ValueError:
+            raise ValueError("category_id must be an integer or 'none'")
+        if ids:
+            conditions.append(Video.category_id.in_(ids))
+        query = query.filter(db.or_(*conditions))
+    # Los nombres de canal pueden llevar comas: solo parámetro repetido
+    channels = [channel.strip() for channel in request.args.getlist('channel') if channel.strip()]
+    if channels:
+        query = query.filter(Video.channel.in_(channels))
+    return query
+
+def get_videos_page():
+    """Página de /api/videos ordenada por id; el cursor guarda el id del último video"""
+    try:
+        limit = int(request.args.get('limit', VIDEOS_PAGE_DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    limit = min(limit, VIDEOS_PAGE_MAX_LIMIT)
+
+    query = apply_video_filters(Video.query.options(selectinload(Video.techniques)))
+    cursor = request.args.get('cursor')
+    if cursor:
+        values = decode_paints_cursor(cursor)
+        if len(values) != 1 or not isinstance(values[0], int):
+            raise ValueError(f"Invalid cursor: {cursor}")
+        query = query.filter(Video.id > values[0])
+
+    # Una fila extra para saber si hay más páginas sin hacer COUNT(*)
+    videos = query.order_by(Video.id).limit(limit + 1).all()
+    has_more = len(videos) > limit
+    videos = videos[:limit]
+    return {
+        'data': [video_to_dict(video) for video in videos],
+        'count': len(videos),
+        'limit': limit,
+        'has_more': has_more,
+        'next_cursor': encode_paints_cursor([videos[-1].id]) if has_more else None
+    }
+
 # API para obtener videos
 @app.route('/api/videos', methods=['GET'])
 def get_videos():
+    """
+    Sin parámetros: todos los videos (lista). Con difficulty/category_id/channel: lista filtrada.
+    Con limit o cursor: página {data, count, limit, has_more, next_cursor}
+    """
+    etag = catalog_etag('videos')
+    not_modified = catalog_not_modified(etag)
+    if not_modified:
+        return not_modified
     try:
-        videos = Video.query.all()
-        result = []
-        for video in videos:
-            # Obtener las técnicas asociadas al video
-            techniques = Technique.query.filter_by(video_id=video.id).order_by(Technique.start_time).all()
-            techniques_data = []
-            
-            for technique in techniques:
-                techniques_data.append({
-                    'id': technique.id,
-                    'name': technique.name,
-                    'start_time': technique.start_time,
-                    'end_time': technique.end_time
-                })
-            
-            result.append({
-                'id': video.id,
-                'title': video.title,
-                'description': video.description,
-                'video_id': video.video_id,
-                'channel': video.channel,
-                'category': video.category,
-                'category_id': video.category_id,
-                'technique_start_time': video.technique_start_time,
-                'technique_end_time': video.technique_end_time,
-                'difficulty_level': video.difficulty_level,
-                'video_version': video.video_version,  # MODIFICADO: 'video_version' en lugar de 'version'
-                'published_at': video.published_at.isoformat() if video.published_at else None,
-                'techniques': techniques_data
-            })
-        return jsonify(result)
+        if any(param in request.args for param in VIDEO_QUERY_PARAMS):
+            try:
+                if 'limit' in request.args or 'cursor' in request.args:
+                    return with_catalog_etag(jsonify(get_videos_page()), etag)
+                videos = apply_video_filters(Video.query.options(selectinload(Video.techniques))).order_by(Video.id).all()
+                return with_catalog_etag(jsonify([video_to_dict(video) for video in videos]), etag)
+            except ValueError as ve:
+                return jsonify({"error": str(ve)}), 400
+
+        # Dos consultas en total: videos y técnicas de todos ellos (selectinload)
+        videos = Video.query.options(selectinload(Video.techniques)).all()
+        return with_catalog_etag(jsonify([video_to_dict(video) for video in videos]), etag)
     except Exception as e:
         print(f"Error en get_videos(): {str(e)}")
         import traceback
@@ -1067,35 +1283,8 @@ def get_videos():
 @app.route('/api/videos/<int:video_id>', methods=['GET'])
 def api_get_video(video_id):
     try:
-        video = Video.query.get_or_404(video_id)
-        
-        # Obtener las técnicas asociadas al video
-        techniques = Technique.query.filter_by(video_id=video.id).order_by(Technique.start_time).all()
-        techniques_data = []
-        
-        for technique in techniques:
-            techniques_data.append({
-                'id': technique.id,
-                'name': technique.name,
-                'start_time': technique.start_time,
-                'end_time': technique.end_time
-            })
-        
-        return jsonify({
-            'id': video.id,
-            'title': video.title,
-            'description': video.description,
-            'video_id': video.video_id,
-            'channel': video.channel,
-            'category': video.category,
-            'category_id': video.category_id,
-            'technique_start_time': video.technique_start_time,
-            'technique_end_time': video.technique_end_time,
-            'difficulty_level': video.difficulty_level,
-            'video_version': video.video_version,  # MODIFICADO: 'video_version' en lugar de 'version'
-            'published_at': video.published_at.isoformat() if video.published_at else None,
-            'techniques': techniques_data
-        })
+        video = Video.query.options(selectinload(Video.techniques)).get_or_404(video_id)
+        return jsonify(video_to_dict(video))
     except Exception as e:
         print(f"Error en api_get_video(): {str(e)}")
         import traceback
@@ -1224,6 +1413,10 @@ def delete_category(category_id):
 
 @app.route('/api/categories', methods=['GET'])
 def get_categories():
+    etag = catalog_etag('categories')
+    not_modified = catalog_not_modified(etag)
+    if not_modified:
+        return not_modified
     categories = Category.query.all()
     result = []
     for category in categories:
@@ -1232,7 +1425,7 @@ def get_categories():
             'name': category.name,
             'description': category.description
         })
-    return jsonify(result)
+    return with_catalog_etag(jsonify(result), etag)
 # Rutas para la gestión de pinturas (ADMIN)
 @app.route('/admin/paints')
 @admin_required
@@ -1244,52 +1437,1257 @@ def admin_paints():
         print(f"Error al cargar la plantilla admin paints: {str(e)}")
         return f"Error: {str(e)}", 500
 
+# Campos que /api/paints puede devolver (mismo orden que Paint.to_dict)
+PAINT_API_FIELDS = (
+    'id', 'name', 'brand', 'color_code', 'color_type', 'color_family', 'description',
+    'stock', 'price', 'color_preview', 'image_url', 'ean', 'shelf_position',
+    'sync_status', 'created_at', 'updated_at'
+)
+PAINTS_PAGE_DEFAULT_LIMIT = 500
+PAINTS_PAGE_MAX_LIMIT = 1000
+
+def encode_paints_cursor(values):
+    """Codificar la clave de la última fila de una página como cursor opaco"""
+    import base64
+    import json
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_paints_cursor(cursor):
+    """Decodificar un cursor generado por encode_paints_cursor (ValueError si no es válido)"""
+    import base64
+    import binascii
+    import json
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+def parse_paint_fields(raw_fields):
+    """Validar el parámetro fields= y devolver la tupla de columnas a seleccionar (id siempre incluido)"""
+    if not raw_fields:
+        return PAINT_API_FIELDS
+    requested = [field.strip() for field in raw_fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in PAINT_API_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(field for field in PAINT_API_FIELDS if field == 'id' or field in requested)
+
+def paint_row_to_dict(row, fields):
+    """Convertir una fila proyectada (query de columnas) en diccionario serializable"""
+    paint_dict = {}
+    for field, value in zip(fields, row):
+        if field in ('created_at', 'updated_at'):
+            value = value.isoformat() if value else None
+        elif field == 'sync_status' and value is None:
+            value = 'synced'
+        paint_dict[field] = value
+    return paint_dict
+
+# Filtros de servidor para /api/paints (valores separados por comas o parámetro repetido)
+PAINT_FILTER_FIELDS = ('brand', 'color_family', 'color_type', 'sync_status')
+# Mismos tramos que el panel de administración: in (>10), low (1-10), out (0)
+PAINT_STOCK_FILTERS = ('in', 'low', 'out')
+# Columnas ordenables y valor que sustituye a NULL (la paginación keyset no admite NULL)
+PAINT_SORT_FIELDS = {
+    'id': None,
+    'name': '',
+    'brand': '',
+    'color_code': '',
+    'color_type': '',
+    'color_family': '',
+    'stock': 0,
+    'price': 0.0,
+    'shelf_position': 2147483647,  # Sin posición: al final en orden ascendente
+    'created_at': datetime(1970, 1, 1),
+    'updated_at': datetime(1970, 1, 1),
+}
+PAINT_QUERY_PARAMS = ('limit', 'cursor', 'fields', 'sort', 'facets', 'stock') + PAINT_FILTER_FIELDS
+
+def get_multi_arg(name):
+    """Valores de un parámetro multivalor: ?brand=A,B o ?brand=A&brand=B"""
+    values = []
+    for raw in request.args.getlist(name):
+        values.extend(value.strip() for value in raw.split(',') if value.strip())
+    return values
+
+def apply_paint_filters(query):
+    """Aplicar los filtros brand/color_family/color_type/sync_status/stock de la petición"""
+    for field in PAINT_FILTER_FIELDS:
+        values = get_multi_arg(field)
+        if not values:
+            continue
+        column = getattr(Paint, field)
+        if field == 'sync_status' and 'synced' in values:
+            # NULL se expone como 'synced' en la API. Sin coalesce() para que use idx_paints_sync_status
+            query = query.filter(db.or_(column.in_(values), column.is_(None)))
+            continue
+        query = query.filter(column.in_(values))
+
+    stock_filters = get_multi_arg('stock')
+    if stock_filters:
+        unknown = [value for value in stock_filters if value not in PAINT_STOCK_FILTERS]
+        if unknown:
+            raise ValueError(f"Invalid stock filter: {', '.join(unknown)} (use in, low, out)")
+        # Misma expresión que el índice idx_paints_stock_id (filtro y ordenación por stock)
+        stock = db.func.coalesce(Paint.stock, 0)
+        conditions = []
+        if 'in' in stock_filters:
+            conditions.append(stock > 10)
+        if 'low' in stock_filters:
+            conditions.append(db.and_(stock > 0, stock <= 10))
+        if 'out' in stock_filters:
+            conditions.append(stock <= 0)
+        query = query.filter(db.or_(*conditions))
+    return query
+
+def parse_paint_sort():
+    """Parámetro sort=campo (ascendente) o sort=-campo (descendente)"""
+    raw_sort = (request.args.get('sort') or 'id').strip()
+    descending = raw_sort.startswith('-')
+    sort_field = raw_sort.lstrip('-')
+    if sort_field not in PAINT_SORT_FIELDS:
+        raise ValueError(f"Invalid sort field: {sort_field} (allowed: {', '.join(PAINT_SORT_FIELDS)})")
+    return sort_field, descending
+
+def get_paint_sort_expression(sort_field):
+    default = PAINT_SORT_FIELDS[sort_field]
+    column = getattr(Paint, sort_field)
+    return column if default is None else db.func.coalesce(column, default)
+
+def order_paints_query(query, sort_field, descending):
+    if sort_field == 'id':
+        return query.order_by(Paint.id.desc() if descending else Paint.id)
+    expression = get_paint_sort_expression(sort_field)
+    if descending:
+        return query.order_by(expression.desc(), Paint.id.desc())
+    return query.order_by(expression, Paint.id)
+
+def get_paint_facets():
+    """
+    Conteo por marca, familia y tipo en una sola consulta (GROUPING SETS),
+    aplicando los filtros de la petición.
+    """
+    grouped_columns = (Paint.brand, Paint.color_family, Paint.color_type)
+    query = db.session.query(
+        *grouped_columns,
+        db.func.grouping(Paint.brand),
+        db.func.grouping(Paint.color_family),
+        db.func.count(Paint.id)
+    )
+    rows = apply_paint_filters(query).group_by(db.func.grouping_sets(*grouped_columns)).all()
+
+    facets = {'brand': {}, 'color_family': {}, 'color_type': {}}
+    for brand, color_family, color_type, brand_grouped, family_grouped, count in rows:
+        if not brand_grouped:
+            facets['brand'][brand or ''] = count
+        elif not family_grouped:
+            facets['color_family'][color_family or ''] = count
+        else:
+            facets['color_type'][color_type or ''] = count
+    return facets
+
+def get_paints_page():
+    """
+    Página de /api/paints con filtros, ordenación, paginación keyset y proyección de columnas.
+    Solo se seleccionan las columnas pedidas, sin hidratar objetos Paint.
+    El cursor guarda (valor de ordenación, id) de la última fila, o solo id si se ordena por id.
+    """
+    fields = parse_paint_fields(request.args.get('fields'))
+    sort_field, descending = parse_paint_sort()
+    try:
+        limit = int(request.args.get('limit', PAINTS_PAGE_DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    limit = min(limit, PAINTS_PAGE_MAX_LIMIT)
+
+    sort_expression = get_paint_sort_expression(sort_field)
+    # La clave de ordenación se selecciona aparte para construir el cursor aunque no esté en fields
+    query = apply_paint_filters(db.session.query(sort_expression, *[getattr(Paint, field) for field in fields]))
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        values = decode_paints_cursor(cursor)
+        last_id = values[-1]
+        if not isinstance(last_id, int) or (sort_field != 'id' and len(values) != 2):
+            raise ValueError(f"Invalid cursor: {cursor}")
+        if sort_field == 'id':
+            query = query.filter(Paint.id < last_id if descending else Paint.id > last_id)
+        else:
+            last_value = values[0]
+            if sort_field in ('created_at', 'updated_at'):
+                try:
+                    last_value = datetime.fromisoformat(last_value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Invalid cursor: {cursor}")
+            last_key = db.tuple_(db.literal(last_value, type_=sort_expression.type), last_id)
+            current_key = db.tuple_(sort_expression, Paint.id)
+            query = query.filter(current_key < last_key if descending else current_key > last_key)
+
+    # Pedimos una fila extra para saber si hay más páginas sin hacer COUNT(*)
+    rows = order_paints_query(query, sort_field, descending).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    data = [paint_row_to_dict(row[1:], fields) for row in rows]
+    next_cursor = None
+    if has_more:
+        if sort_field == 'id':
+            next_cursor = encode_paints_cursor([rows[-1][0]])
+        else:
+            last_value = rows[-1][0]
+            if isinstance(last_value, datetime):
+                last_value = last_value.isoformat()
+            next_cursor = encode_paints_cursor([last_value, data[-1]['id']])
+
+    page = {
+        'data': data,
+        'count': len(data),
+        'limit': limit,
+        'has_more': has_more,
+        'next_cursor': next_cursor
+    }
+    if request.args.get('facets') in ('1', 'true'):
+        page['facets'] = get_paint_facets()
+    return page
+
+def get_paints_list():
+    """Lista filtrada/ordenada/proyectada sin paginar (sin limit ni cursor)"""
+    fields = parse_paint_fields(request.args.get('fields'))
+    sort_field, descending = parse_paint_sort()
+    query = apply_paint_filters(db.session.query(*[getattr(Paint, field) for field in fields]))
+    rows = order_paints_query(query, sort_field, descending).all()
+    return [paint_row_to_dict(row, fields) for row in rows]
+
 @app.route('/api/paints', methods=['GET'])
 def get_paints():
+    # La versión se lee antes de consultar: una escritura concurrente invalida este ETag
+    etag = catalog_etag('paints')
+    not_modified = catalog_not_modified(etag)
+    if not_modified:
+        return not_modified
     try:
-        paints = Paint.query.all()
-        result = []
-        for paint in paints:
+        # Filtros, ordenación, paginación (limit/cursor), facetas o proyección (fields):
+        # no cargar el catálogo completo
+        if any(param in request.args for param in PAINT_QUERY_PARAMS):
             try:
-                # Use the to_dict method if available, otherwise manual construction
-                if hasattr(paint, 'to_dict'):
-                    paint_dict = paint.to_dict()
-                else:
-                    # Fallback for backwards compatibility
-                    paint_dict = {
-                        'id': paint.id,
-                        'name': paint.name or '',
-                        'brand': paint.brand or '',
-                        'color_code': paint.color_code or '',
-                        'color_type': getattr(paint, 'color_type', '') or '',
-                        'color_family': getattr(paint, 'color_family', '') or '',
-                        'image_url': getattr(paint, 'image_url', '') or '',
-                        'stock': getattr(paint, 'stock', 0) or 0,
-                        'price': getattr(paint, 'price', 0.0) or 0.0,
-                        'description': getattr(paint, 'description', '') or '',
-                        'color_preview': getattr(paint, 'color_preview', '#000000') or '#000000',
-                        'shelf_position': getattr(paint, 'shelf_position', None),
-                        'sync_status': getattr(paint, 'sync_status', 'synced'),  # Default to 'synced'
-                        'created_at': paint.created_at.isoformat() if paint.created_at else None
-                    }
-                result.append(paint_dict)
-            except Exception as paint_error:
-                print(f"Error processing paint {paint.id}: {str(paint_error)}")
-                # Skip this paint but continue with others
-                continue
-        return jsonify(result)
+                if any(param in request.args for param in ('limit', 'cursor', 'facets')):
+                    return with_catalog_etag(jsonify(get_paints_page()), etag)
+                return with_catalog_etag(jsonify(get_paints_list()), etag)
+            except ValueError as ve:
+                return jsonify({"error": str(ve)}), 400
+
+        # Catálogo completo: se sirve el snapshot ya serializado (y comprimido si el cliente acepta gzip)
+        snapshot = get_paints_snapshot()
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+        response = app.response_class(
+            get_paints_snapshot_body(snapshot, gzipped=use_gzip),
+            mimetype='application/json'
+        )
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        if snapshot['sync_token']:
+            response.headers['X-Sync-Token'] = snapshot['sync_token']
+        return with_catalog_etag(response, etag)
     except Exception as e:
         print(f"Error en get_paints(): {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+def build_paints_list():
+    """Lista completa de pinturas serializables (cuerpo del listado GET /api/paints)"""
+    paints = Paint.query.all()
+    result = []
+    for paint in paints:
+        try:
+            # Use the to_dict method if available, otherwise manual construction
+            if hasattr(paint, 'to_dict'):
+                paint_dict = paint.to_dict()
+            else:
+                # Fallback for backwards compatibility
+                paint_dict = {
+                    'id': paint.id,
+                    'name': paint.name or '',
+                    'brand': paint.brand or '',
+                    'color_code': paint.color_code or '',
+                    'color_type': getattr(paint, 'color_type', '') or '',
+                    'color_family': getattr(paint, 'color_family', '') or '',
+                    'image_url': getattr(paint, 'image_url', '') or '',
+                    'stock': getattr(paint, 'stock', 0) or 0,
+                    'price': getattr(paint, 'price', 0.0) or 0.0,
+                    'description': getattr(paint, 'description', '') or '',
+                    'color_preview': getattr(paint, 'color_preview', '#000000') or '#000000',
+                    'shelf_position': getattr(paint, 'shelf_position', None),
+                    'sync_status': getattr(paint, 'sync_status', 'synced'),  # Default to 'synced'
+                    'created_at': paint.created_at.isoformat() if paint.created_at else None
+                }
+            result.append(paint_dict)
+        except Exception as paint_error:
+            print(f"Error processing paint {paint.id}: {str(paint_error)}")
+            # Skip this paint but continue with others
+            continue
+    return result
+
+# Snapshot del listado completo ya codificado en JSON. Se reconstruye de forma perezosa
+# cuando cambia la versión del catálogo (cualquier escritura confirmada lo invalida).
+import gzip
+import json
+
+# Dos niveles: copia local del worker + copia compartida (estado compartido) por versión,
+# de modo que solo un worker reconstruye el snapshot tras cada escritura. En el estado
+# compartido solo se conserva la última versión publicada (PAINTS_SNAPSHOT_CURRENT_KEY):
+# al publicar una nueva se borra la anterior. El TTL cubre lo que quede huérfano
+# (p. ej. un gzip de una versión ya sustituida), que el barrido del backend elimina.
+PAINTS_SNAPSHOT_SHARED_TTL = 3600
+PAINTS_SNAPSHOT_CURRENT_KEY = 'paints_snapshot:current'
+PAINTS_SNAPSHOT_PARTS = ('body', 'meta', 'gzip')
+
+paints_snapshot_lock = threading.Lock()
+paints_snapshot_state = {'current': None}
+paints_snapshot_stats = {
+    'hits': 0,
+    'shared_hits': 0,
+    'misses': 0,
+    'rebuilds': 0,
+    'gzip_builds': 0,
+    'last_rebuild_seconds': 0.0,
+    'total_rebuild_seconds': 0.0,
+    'last_rebuild_at': None,
+}
+
+def paints_snapshot_key(version, part):
+    return f"paints_snapshot:{version}:{part}"
+
+def load_shared_paints_snapshot(version):
+    """Snapshot de esta versión guardado por otro worker, o None"""
+    meta = shared_state.get_json(paints_snapshot_key(version, 'meta'))
+    body = shared_state.get(paints_snapshot_key(version, 'body')) if meta else None
+    if body is None:
+        return None
+    return {
+        'version': version,
+        'sync_token': meta['sync_token'],
+        'count': meta['count'],
+        'body': body,
+        'gzip': shared_state.get(paints_snapshot_key(version, 'gzip')),
+    }
+
+def publish_shared_paints_snapshot(snapshot):
+    """Guardar el snapshot en el estado compartido y borrar la versión publicada antes"""
+    version = snapshot['version']
+    # El cuerpo se guarda antes que los metadatos: quien lee meta encuentra siempre el cuerpo
+    shared_state.set(paints_snapshot_key(version, 'body'), snapshot['body'], ttl=PAINTS_SNAPSHOT_SHARED_TTL)
+    shared_state.set_json(paints_snapshot_key(version, 'meta'), {
+        'sync_token': snapshot['sync_token'],
+        'count': snapshot['count'],
+    }, ttl=PAINTS_SNAPSHOT_SHARED_TTL)
+
+    previous = shared_state.get_int(PAINTS_SNAPSHOT_CURRENT_KEY)
+    if previous > version:
+        # Otro worker ya publicó una versión más nueva: la nuestra sobra
+        obsolete = version
+    else:
+        shared_state.set(PAINTS_SNAPSHOT_CURRENT_KEY, str(version).encode('ascii'))
+        obsolete = previous if previous and previous != version else None
+    if obsolete is not None:
+        for part in PAINTS_SNAPSHOT_PARTS:
+            shared_state.delete(paints_snapshot_key(obsolete, part))
+
+def get_paints_snapshot():
+    """Devolver el snapshot vigente, reconstruyéndolo si la versión del catálogo cambió"""
+    version = get_catalog_version()
+    snapshot = paints_snapshot_state['current']
+    if snapshot and snapshot['version'] == version:
+        paints_snapshot_stats['hits'] += 1
+        return snapshot
+
+    with paints_snapshot_lock:
+        # Otro hilo puede haberlo reconstruido mientras esperábamos el lock
+        version = get_catalog_version()
+        snapshot = paints_snapshot_state['current']
+        if snapshot and snapshot['version'] == version:
+            paints_snapshot_stats['hits'] += 1
+            return snapshot
+
+        # Otro worker puede haberlo reconstruido ya
+        snapshot = load_shared_paints_snapshot(version)
+        if snapshot:
+            paints_snapshot_stats['shared_hits'] += 1
+            paints_snapshot_state['current'] = snapshot
+            return snapshot
+
+        paints_snapshot_stats['misses'] += 1
+        start_time = time.time()
+        # Marca de agua tomada antes de leer: el cliente la usa con /api/paints/changes
+        sync_token = get_paints_sync_head()
+        result = build_paints_list()
+        snapshot = {
+            'version': version,
+            'sync_token': sync_token,
+            'count': len(result),
+            'body': json.dumps(result, separators=(',', ':')).encode('utf-8'),
+            'gzip': None,
+        }
+        paints_snapshot_state['current'] = snapshot
+        publish_shared_paints_snapshot(snapshot)
+
+        elapsed = time.time() - start_time
+        paints_snapshot_stats['rebuilds'] += 1
+        paints_snapshot_stats['last_rebuild_seconds'] = round(elapsed, 4)
+        paints_snapshot_stats['total_rebuild_seconds'] = round(paints_snapshot_stats['total_rebuild_seconds'] + elapsed, 4)
+        paints_snapshot_stats['last_rebuild_at'] = datetime.utcnow().isoformat()
+        print(f"📸 Paints snapshot rebuilt: {len(result)} paints, {len(snapshot['body'])} bytes in {elapsed:.3f}s (version {version})")
+        return snapshot
+
+def get_paints_snapshot_body(snapshot, gzipped=False):
+    """Cuerpo del snapshot en bruto; la versión gzip se genera la primera vez que se pide"""
+    if not gzipped:
+        return snapshot['body']
+    if snapshot['gzip'] is None:
+        with paints_snapshot_lock:
+            if snapshot['gzip'] is None:
+                snapshot['gzip'] = gzip.compress(snapshot['body'], compresslevel=6)
+                # Una versión ya sustituida no se vuelve a publicar (quedaría huérfana)
+                if shared_state.get_int(PAINTS_SNAPSHOT_CURRENT_KEY) == snapshot['version']:
+                    shared_state.set(paints_snapshot_key(snapshot['version'], 'gzip'), snapshot['gzip'],
+                                     ttl=PAINTS_SNAPSHOT_SHARED_TTL)
+                paints_snapshot_stats['gzip_builds'] += 1
+    return snapshot['gzip']
+
+@app.route('/admin/paints-snapshot/stats', methods=['GET'])
+@admin_required
+def paints_snapshot_stats_endpoint():
+    snapshot = paints_snapshot_state['current']
+    lookups = paints_snapshot_stats['hits'] + paints_snapshot_stats['shared_hits'] + paints_snapshot_stats['misses']
+    return jsonify({
+        'success': True,
+        'backend': shared_state.name,
+        'stats': dict(paints_snapshot_stats),
+        'hit_rate': round((paints_snapshot_stats['hits'] + paints_snapshot_stats['shared_hits']) / lookups, 4) if lookups else None,
+        'catalog_version': get_catalog_version(),
+        'snapshot': {
+            'version': snapshot['version'],
+            'paints': snapshot['count'],
+            'bytes': len(snapshot['body']),
+            'gzip_bytes': len(snapshot['gzip']) if snapshot['gzip'] is not None else None,
+        } if snapshot else None
+    })
+
+# Sincronización delta ordenada por transacción: cada alta o modificación guarda en
+# paints.change_txid el txid de su transacción y cada baja deja una fila en deleted_paints
+# (trigger paints_track_change). Solo se leen los txid menores que el xmin del snapshot:
+# todas esas transacciones ya terminaron, así que ninguna puede confirmar después con un
+# txid por debajo del token que se entrega al cliente (da igual cuánto tarde en confirmar).
+# El token es [txid, id] de la última fila entregada, o [xmin, 0] cuando no quedan más.
+PAINT_CHANGES_MAX_LIMIT = 1000
+
+PAINT_CHANGES_SQL = """
+    SELECT changes.txid, changes.id AS change_id, changes.deleted, {columns}
+    FROM (
+        (SELECT change_txid AS txid, id, FALSE AS deleted
+         FROM paints
+         WHERE change_txid < :bound AND (change_txid, id) > (:since_txid, :since_id)
+         ORDER BY change_txid, id
+         LIMIT :limit)
+        UNION ALL
+        (SELECT deleted_txid, paint_id, TRUE
+         FROM deleted_paints
+         WHERE :include_deleted AND deleted_txid < :bound AND (deleted_txid, paint_id) > (:since_txid, :since_id)
+         ORDER BY deleted_txid, paint_id
+         LIMIT :limit)
+    ) changes
+    LEFT JOIN paints p ON NOT changes.deleted AND p.id = changes.id
+    ORDER BY changes.txid, changes.id
+    LIMIT :limit
+"""
+
+def get_paints_changes_bound():
+    """xmin del snapshot actual: todas las transacciones con txid menor ya terminaron"""
+    return db.session.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot())")).scalar()
+
+def get_paints_sync_head():
+    """Token a partir del cual pedir cambios tras leer el catálogo completo (tomado antes de leerlo)"""
+    return encode_paints_cursor([get_paints_changes_bound(), 0])
+
+@app.route('/api/paints/changes', methods=['GET'])
+def get_paint_changes():
+    """
+    Sincronización delta: pinturas modificadas (data) y borradas (deleted, ids) después del
+    token since. Sin since devuelve el catálogo completo por páginas. Recorre los índices
+    (change_txid, id) de paints y (deleted_txid, paint_id) de deleted_paints.
+    """
+    try:
+        since = request.args.get('since')
+        try:
+            limit = min(int(request.args.get('limit', PAINT_CHANGES_MAX_LIMIT)), PAINT_CHANGES_MAX_LIMIT)
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            return jsonify({"success": False, "message": "limit must be a positive integer"}), 400
+
+        since_txid, since_id = 0, 0
+        if since:
+            try:
+                since_txid, since_id = decode_paints_cursor(since)
+                if not all(isinstance(value, int) and not isinstance(value, bool) and value >= 0
+                           for value in (since_txid, since_id)):
+                    raise ValueError
+            except (TypeError, ValueError):
+                # Incluye los tokens (updated_at, id) anteriores: el cliente debe recargar el catálogo
+                return jsonify({"success": False, "message": f"Invalid since token: {since}"}), 400
+
+        fields = PAINT_API_FIELDS
+        bound = get_paints_changes_bound()
+        rows = db.session.execute(text(PAINT_CHANGES_SQL.format(columns=', '.join(f'p.{field}' for field in fields))), {
+            'bound': bound,
+            'since_txid': since_txid,
+            'since_id': since_id,
+            # Un cliente sin token no tiene nada que borrar
+            'include_deleted': bool(since),
+            'limit': limit + 1,
+        }).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        data = [paint_row_to_dict(row[3:], fields) for row in rows if not row.deleted]
+        deleted = [row.change_id for row in rows if row.deleted]
+        if has_more:
+            next_token = encode_paints_cursor([rows[-1].txid, rows[-1].change_id])
+        elif (bound, 0) > (since_txid, since_id):
+            next_token = encode_paints_cursor([bound, 0])
+        else:
+            next_token = since
+
+        return jsonify({
+            "success": True,
+            "data": data,
+            "deleted": deleted,
+            "count": len(data),
+            "has_more": has_more,
+            "next_token": next_token,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+    except Exception as e:
+        print(f"Error en get_paint_changes(): {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# Filas leídas por lote del cursor de servidor (y líneas por bloque enviado)
+PAINTS_EXPORT_BATCH_SIZE = 500
+
+@app.route('/api/paints/export.ndjson', methods=['GET'])
+def export_paints_ndjson():
+    """
+    Exportar el catálogo en streaming, una pintura en JSON por línea (NDJSON).
+    Usa un cursor de servidor: la memoria no crece con el tamaño del catálogo.
+    Parámetros opcionales: brand (filtro sin distinguir mayúsculas), fields (proyección)
+    """
+    from flask import stream_with_context
+    try:
+        fields = parse_paint_fields(request.args.get('fields')) if request.args.get('fields') else PAINT_API_FIELDS
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    query = db.session.query(*[getattr(Paint, field) for field in fields]).order_by(Paint.id)
+    brand = (request.args.get('brand') or '').strip()
+    if brand:
+        query = query.filter(db.func.upper(Paint.brand) == brand.upper())
+
+    def generate():
+        lines = []
+        exported = 0
+        for row in query.yield_per(PAINTS_EXPORT_BATCH_SIZE):
+            lines.append(json.dumps(paint_row_to_dict(row, fields), separators=(',', ':')))
+            if len(lines) >= PAINTS_EXPORT_BATCH_SIZE:
+                exported += len(lines)
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            exported += len(lines)
+            yield '\n'.join(lines) + '\n'
+        print(f"📤 NDJSON export finished: {exported} paints" + (f" (brand {brand})" if brand else ""))
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Búsqueda de pinturas: tsvector (nombre/descripción/marca) + trigramas (código/nombre).
+# La expresión debe coincidir exactamente con la del índice idx_paints_search_tsv.
+PAINT_SEARCH_VECTOR_SQL = (
+    "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || coalesce(brand, ''))"
+)
+PAINT_SEARCH_DEFAULT_LIMIT = 20
+PAINT_SEARCH_MAX_LIMIT = 100
+# Cada cuánto se vuelve a comprobar pg_trgm (la migración puede instalarlo con los workers en marcha)
+TRIGRAM_CHECK_TTL_SECONDS = 300
+
+paint_search_state = {'trigram_available': None, 'checked_at': 0.0}
+
+def is_trigram_search_available():
+    """Comprobar si la extensión pg_trgm está instalada (cacheado TRIGRAM_CHECK_TTL_SECONDS por proceso)"""
+    now = time.time()
+    if paint_search_state['trigram_available'] is None or now - paint_search_state['checked_at'] > TRIGRAM_CHECK_TTL_SECONDS:
+        from sqlalchemy import text
+        previous = paint_search_state['trigram_available']
+        try:
+            installed = db.session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar()
+            paint_search_state['trigram_available'] = bool(installed)
+        except Exception as e:
+            print(f"⚠️ [SEARCH] Could not check pg_trgm: {str(e)}")
+            db.session.rollback()
+            paint_search_state['trigram_available'] = False
+        paint_search_state['checked_at'] = now
+        if not paint_search_state['trigram_available'] and previous is not False:
+            print("⚠️ [SEARCH] pg_trgm not installed - using ILIKE for code/name matching")
+    return paint_search_state['trigram_available']
+
+def escape_like(value):
+    """Escapar los comodines de LIKE/ILIKE (% y _) en texto del usuario; usar con ESCAPE '\\'"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def build_paint_tsquery(q):
+    """Convertir el texto del usuario en un tsquery de prefijos: 'black prim' -> 'black:* & prim:*'"""
+    import re
+    terms = re.findall(r'[^\W_]+', q.lower())
+    return ' & '.join(f"{term}:*" for term in terms)
+
+@app.route('/api/paints/search', methods=['GET'])
+def search_paints():
+    """
+    Buscar pinturas por texto libre (nombre, descripción, marca, código)
+
+    Parámetros de consulta:
+    - q: Texto a buscar (obligatorio)
+    - limit: Límite de resultados (default: 20, máximo: 100)
+
+    Los resultados se ordenan por relevancia: coincidencia exacta de código,
+    rango full-text y similitud por trigramas de código y nombre.
+    """
+    from sqlalchemy import text
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({"success": False, "message": "q parameter is required"}), 400
+    try:
+        limit = min(int(request.args.get('limit', PAINT_SEARCH_DEFAULT_LIMIT)), PAINT_SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"success": False, "message": "limit must be a positive integer"}), 400
+
+    try:
+        tsquery = build_paint_tsquery(q)
+        pattern = escape_like(q)
+        params = {'q': q, 'prefix': f"{pattern}%", 'limit': limit}
+        rank_terms = ["CASE WHEN upper(color_code) = upper(:q) THEN 2 ELSE 0 END"]
+        conditions = ["color_code ILIKE :prefix ESCAPE '\\'"]
+
+        if tsquery:
+            params['tsquery'] = tsquery
+            rank_terms.append(f"ts_rank({PAINT_SEARCH_VECTOR_SQL}, to_tsquery('simple', :tsquery))")
+            conditions.append(f"{PAINT_SEARCH_VECTOR_SQL} @@ to_tsquery('simple', :tsquery)")
+
+        if is_trigram_search_available():
+            rank_terms.append("GREATEST(similarity(color_code, :q), similarity(name, :q))")
+            conditions.extend(["color_code % :q", "name % :q"])
+        else:
+            params['contains'] = f"%{pattern}%"
+            conditions.extend(["color_code ILIKE :contains ESCAPE '\\'", "name ILIKE :contains ESCAPE '\\'"])
+
+        rank_sql = ' + '.join(rank_terms)
+        sql = f"""
+            SELECT {', '.join(PAINT_API_FIELDS)}, {rank_sql} AS rank
+            FROM paints
+            WHERE {' OR '.join(conditions)}
+            ORDER BY rank DESC, id
+            LIMIT :limit
+        """
+        rows = db.session.execute(text(sql), params).fetchall()
+
+        data = []
+        for row in rows:
+            paint_dict = paint_row_to_dict(row[:len(PAINT_API_FIELDS)], PAINT_API_FIELDS)
+            paint_dict['rank'] = round(float(row[-1]), 4)
+            data.append(paint_dict)
+
+        print(f"🔍 Paint search '{q}': {len(data)} results")
+        return jsonify({
+            "success": True,
+            "query": q,
+            "data": data,
+            "count": len(data),
+            "limit": limit
+        })
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error searching paints: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# Pinturas similares por color (CIEDE2000). El índice vive en memoria de cada worker:
+# - los commits de este proceso lo actualizan fila a fila (apply_paint_color_changes)
+# - si la versión del catálogo avanzó en otro worker, se releen las pinturas y las bajas
+#   con change_txid/deleted_txid desde la marca de agua (refresh_paint_color_index)
+PAINT_SIMILAR_DEFAULT_LIMIT = 10
+PAINT_SIMILAR_MAX_LIMIT = 100
+
+def apply_paint_color_changes(changes, version):
+    """Aplicar al índice los cambios de pinturas de un commit de este proceso"""
+    index = paint_color_index
+    with index.lock:
+        if not index.built:
+            return
+        for operation, paint_id, color, brand, stock in changes:
+            if operation == 'remove':
+                index.remove(paint_id)
+            else:
+                index.upsert(paint_id, color, brand, stock)
+        # Solo si nadie más cambió el catálogo entre medias el índice queda al día
+        if version is not None and index.version == version - 1:
+            index.version = version
+
+def refresh_paint_color_index():
+    """Poner el índice de colores al día con la versión actual del catálogo"""
+    index = paint_color_index
+    version = get_catalog_version()
+    if index.built and index.version == version:
+        return index
+    with index.lock:
+        if index.built and index.version == version:
+            return index
+        started = time.time()
+        columns = (Paint.id, Paint.color_preview, Paint.brand, Paint.stock)
+        # Mismo límite que /api/paints/changes: las transacciones con txid menor ya terminaron,
+        # así que leer desde la marca anterior no se salta ningún commit tardío
+        bound = get_paints_changes_bound()
+
+        if index.built and index.watermark is not None:
+            rows = db.session.query(*columns).filter(Paint.change_txid >= index.watermark).all()
+            for paint_id, color, brand, stock in rows:
+                index.upsert(paint_id, color, brand, stock)
+            deleted_ids = [paint_id for (paint_id,) in db.session.query(DeletedPaint.paint_id).filter(
+                DeletedPaint.deleted_txid >= index.watermark
+            )]
+            for paint_id in deleted_ids:
+                index.remove(paint_id)
+            mode = 'delta'
+        else:
+            rows = db.session.query(*columns).all()
+            index.load(rows)
+            mode = 'rebuild'
+
+        index.watermark = bound
+        index.version = version
+        print(f"🎨 Color index {mode}: {len(rows)} rows read, {index.size} paints indexed "
+              f"({(time.time() - started) * 1000:.1f} ms)")
+    return index
+
+@app.route('/api/paints/similar', methods=['GET'])
+def get_similar_paints():
+    """
+    Pinturas más parecidas a un color (distancia CIEDE2000 en CIELAB)
+
+    Parámetros de consulta:
+    - color: Color hexadecimal (#RRGGBB, RRGGBB o #RGB) o
+    - paint_id: Usar el color_preview de esa pintura (se excluye de los resultados)
+    - k: Número de resultados (default: 10, máximo: 100)
+    - brand: Filtrar por marca (admite varias separadas por comas)
+    - in_stock: true para devolver solo pinturas con stock
+    """
+    color = request.args.get('color', '').strip()
+    paint_id = request.args.get('paint_id', type=int)
+    try:
+        k = min(int(request.args.get('k', PAINT_SIMILAR_DEFAULT_LIMIT)), PAINT_SIMILAR_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"success": False, "message": "k must be an integer"}), 400
+    if k < 1:
+        return jsonify({"success": False, "message": "k must be a positive integer"}), 400
+
+    brands = get_multi_arg('brand')
+    in_stock = request.args.get('in_stock', '').lower() in ('1', 'true', 'yes')
+
+    try:
+        exclude_ids = ()
+        if paint_id is not None:
+            reference = db.session.query(Paint.color_preview).filter(Paint.id == paint_id).first()
+            if not reference:
+                return jsonify({"success": False, "message": "Paint not found"}), 404
+            color = (reference.color_preview or '').strip()
+            exclude_ids = (paint_id,)
+        if not color:
+            return jsonify({"success": False, "message": "color or paint_id parameter is required"}), 400
+        rgb = parse_hex_color(color)
+        if rgb is None:
+            return jsonify({"success": False, "message": f"Invalid color: {color}"}), 400
+
+        nearest = refresh_paint_color_index().query(rgb, k=k, brands=brands, in_stock=in_stock, exclude_ids=exclude_ids)
+
+        data = []
+        if nearest:
+            ids = [nearest_id for nearest_id, _ in nearest]
+            rows = db.session.query(*[getattr(Paint, field) for field in PAINT_API_FIELDS]).filter(
+                Paint.id.in_(ids)
+            ).all()
+            paints_by_id = {row.id: paint_row_to_dict(row, PAINT_API_FIELDS) for row in rows}
+            for nearest_id, distance in nearest:
+                paint_dict = paints_by_id.get(nearest_id)
+                if paint_dict:
+                    paint_dict['distance'] = round(distance, 4)
+                    data.append(paint_dict)
+
+        return jsonify({
+            "success": True,
+            "query": {
+                "color": '#%02x%02x%02x' % rgb,
+                "paint_id": paint_id,
+                "brand": brands,
+                "in_stock": in_stock,
+                "k": k
+            },
+            "data": data,
+            "count": len(data)
+        })
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error finding similar paints: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/admin/paints/color-index/stats')
+@admin_required
+def paint_color_index_stats():
+    """Estado del índice de colores de este worker"""
+    return jsonify({
+        "success": True,
+        "catalog_version": get_catalog_version(),
+        "index": paint_color_index.stats()
+    })
+
+# Equivalencias entre marcas precalculadas (tabla paint_equivalents, ver paint_equivalents.py).
+# Los commits que cambian color o marca encolan sus pinturas; un hilo por worker agrupa
+# los cambios de PAINT_EQUIVALENTS_REFRESH_DELAY segundos y recalcula solo las filas afectadas.
+import queue
+from paint_equivalents import EQUIVALENTS_PER_BRAND, rebuild_paint_equivalents, refresh_paint_equivalents
+
+PAINT_EQUIVALENTS_REFRESH_DELAY = 2
+paint_equivalents_queue = queue.Queue()
+paint_equivalents_worker = {'thread': None, 'lock': threading.Lock()}
+
+def schedule_paint_equivalents_refresh(paint_ids):
+    for paint_id in paint_ids:
+        paint_equivalents_queue.put(paint_id)
+    with paint_equivalents_worker['lock']:
+        thread = paint_equivalents_worker['thread']
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=_paint_equivalents_refresh_loop, name='paint-equivalents', daemon=True)
+            paint_equivalents_worker['thread'] = thread
+            thread.start()
+
+def _paint_equivalents_refresh_loop():
+    while True:
+        paint_ids = {paint_equivalents_queue.get()}
+        time.sleep(PAINT_EQUIVALENTS_REFRESH_DELAY)
+        while not paint_equivalents_queue.empty():
+            paint_ids.add(paint_equivalents_queue.get_nowait())
+        with app.app_context():
+            try:
+                started = time.time()
+                result = refresh_paint_equivalents(refresh_paint_color_index().snapshot(), paint_ids)
+                print(f"🔁 Paint equivalents refreshed: {result['changed']} changed, "
+                      f"{result['recomputed']} recomputed ({(time.time() - started) * 1000:.1f} ms)")
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Error refreshing paint equivalents {sorted(paint_ids)}: {str(e)}")
+            finally:
+                db.session.remove()
+
+@app.route('/api/paints/<int:paint_id>/equivalents', methods=['GET'])
+def get_paint_equivalents(paint_id):
+    """
+    Pinturas equivalentes de otras marcas (precalculadas, una sola lectura indexada)
+
+    Parámetros de consulta:
+    - brand: Solo estas marcas (admite varias separadas por comas)
+    - limit: Equivalencias por marca (default y máximo: las precalculadas, 3)
+    """
+    try:
+        limit = int(request.args.get('limit', EQUIVALENTS_PER_BRAND))
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"success": False, "message": "limit must be a positive integer"}), 400
+    brands = [brand.upper() for brand in get_multi_arg('brand')]
+
+    try:
+        query = db.session.query(
+            PaintEquivalent.equivalent_brand,
+            PaintEquivalent.distance,
+            *[getattr(Paint, field) for field in PAINT_API_FIELDS]
+        ).join(Paint, Paint.id == PaintEquivalent.equivalent_id).filter(
+            PaintEquivalent.paint_id == paint_id,
+            PaintEquivalent.rank <= limit
+        )
+        if brands:
+            query = query.filter(PaintEquivalent.equivalent_brand.in_(brands))
+        rows = query.order_by(PaintEquivalent.equivalent_brand, PaintEquivalent.rank).all()
+
+        if not rows and not db.session.query(Paint.id).filter(Paint.id == paint_id).first():
+            return jsonify({"success": False, "message": "Paint not found"}), 404
+
+        data = {}
+        for row in rows:
+            paint_dict = paint_row_to_dict(row[2:], PAINT_API_FIELDS)
+            paint_dict['distance'] = row.distance
+            data.setdefault(row.equivalent_brand, []).append(paint_dict)
+
+        return jsonify({
+            "success": True,
+            "paint_id": paint_id,
+            "data": data,
+            "count": len(rows)
+        })
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error getting equivalents for paint {paint_id}: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/admin/paints/equivalents/rebuild', methods=['POST'])
+@admin_required
+def rebuild_paint_equivalents_endpoint():
+    """Recalcular la tabla paint_equivalents completa (mismo proceso que python paint_equivalents.py)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        k = int(data.get('k', EQUIVALENTS_PER_BRAND))
+        started = time.time()
+        result = rebuild_paint_equivalents(refresh_paint_color_index().snapshot(), k=k)
+        result['elapsed_ms'] = round((time.time() - started) * 1000, 1)
+        print(f"✅ Paint equivalents rebuilt: {result}")
+        return jsonify({"success": True, **result})
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error rebuilding paint equivalents: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# Importación masiva de stock desde CSV (sustituye a railway_stock_update.py):
+# COPY a una tabla temporal + un único UPDATE ... FROM por (marca, código normalizado)
+from paint_bulk import UTC_NOW_SQL, import_stock_csv, upsert_paints_csv
+
+@app.route('/admin/paints/stock-import', methods=['POST'])
+@admin_or_api_key_required
+def import_paint_stock():
+    """
+    Actualizar el stock de pinturas desde un CSV (multipart 'file' o cuerpo text/csv)
+
+    Columnas: código (codigo/code/color_code), stock (stock/existencias) y
+    opcionalmente marca (brand/marca). Parámetros (formulario o query string):
+    - brand: Marca para todas las filas si el CSV no tiene columna de marca
+    - dry_run: true para calcular el resultado sin guardar cambios
+    """
+    upload = request.files.get('file')
+    data = upload.read() if upload else request.get_data()
+    if not data:
+        return jsonify({"success": False, "message": "CSV file is required"}), 400
+    brand = (request.values.get('brand') or '').strip() or None
+    dry_run = (request.values.get('dry_run') or '').lower() in ('1', 'true', 'yes')
+
+    try:
+        started = time.time()
+        result, changes = import_stock_csv(data, default_brand=brand)
+        if dry_run:
+            db.session.rollback()
+        else:
+            if changes:
+                # Una sola notificación para Android con todos los cambios de stock (mismo commit)
+                send_android_notification(None, 'stock_bulk_updated', {
+                    'changes': [{
+                        'paint_id': change.id,
+                        'paint_name': change.name,
+                        'paint_code': change.color_code,
+                        'brand': change.brand,
+                        'old_stock': change.old_stock,
+                        'new_stock': change.new_stock
+                    } for change in changes],
+                    'count': len(changes),
+                    'source': 'stock_import'
+                })
+            db.session.commit()
+            if changes:
+                invalidate_catalog('stock import', paint_ids=[change.id for change in changes])
+        result['dry_run'] = dry_run
+        result['elapsed_ms'] = round((time.time() - started) * 1000, 1)
+        print(f"📦 Stock import{' (dry run)' if dry_run else ''}: {result['matched']} matched, "
+              f"{result['unmatched']} unmatched, {result['updated']} updated, {result['invalid']} invalid "
+              f"({result['elapsed_ms']} ms)")
+        return jsonify({"success": True, **result})
+    except ValueError as ve:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error importing stock CSV: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+def finish_paint_upsert(written):
+    """
+    Tras el commit de un upsert masivo: invalidar catálogo y recalcular las equivalencias
+    de las pinturas nuevas o con otro color (stock o precio no les afectan)
+    """
+    paint_ids = [row.id for row in written]
+    if paint_ids:
+        invalidate_catalog('paint import', paint_ids=paint_ids)
+        color_changed_ids = [row.id for row in written if row.color_changed]
+        if color_changed_ids:
+            schedule_paint_equivalents_refresh(color_changed_ids)
+
+@app.route('/admin/paints/import', methods=['POST'])
+@admin_or_api_key_required
+def import_paints_catalog():
+    """
+    Importar un catálogo de pinturas desde CSV (multipart 'file' o cuerpo text/csv):
+    alta de las nuevas y actualización de las existentes por (marca, código)
+
+    Columnas: color_code (obligatoria), brand, name, color_type, color_family, image_url,
+    stock, price, description, color_preview, ean, shelf_position (o sus alias en castellano).
+    Parámetros (formulario o query string):
+    - brand: Marca para todas las filas si el CSV no tiene columna de marca
+    - dry_run: true para calcular el resultado sin guardar cambios
+    """
+    upload = request.files.get('file')
+    data = upload.read() if upload else request.get_data()
+    if not data:
+        return jsonify({"success": False, "message": "CSV file is required"}), 400
+    brand = (request.values.get('brand') or '').strip() or None
+    dry_run = (request.values.get('dry_run') or '').lower() in ('1', 'true', 'yes')
+
+    try:
+        started = time.time()
+        result, written = upsert_paints_csv(data, default_brand=brand)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+            finish_paint_upsert(written)
+        result['dry_run'] = dry_run
+        result['elapsed_ms'] = round((time.time() - started) * 1000, 1)
+        print(f"📥 Paint import{' (dry run)' if dry_run else ''}: {result['inserted']} inserted, "
+              f"{result['updated']} updated, {result['skipped']} skipped ({result['elapsed_ms']} ms)")
+        return jsonify({"success": True, **result})
+    except ValueError as ve:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error importing paints CSV: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# PATCH /api/paints/bulk: actualizaciones parciales de muchas pinturas en una petición.
+# Campo -> tipo SQL de la columna en VALUES
+PAINT_BULK_FIELDS = {
+    'stock': 'INTEGER',
+    'price': 'DOUBLE PRECISION',
+    'shelf_position': 'INTEGER',
+    'color_preview': 'TEXT',
+    'sync_status': 'VARCHAR(20)',
+    'ean': 'VARCHAR(13)',
+}
+PAINT_BULK_MAX_ITEMS = 5000
+PAINT_SYNC_STATUSES = ('synced', 'pending_upload')
+# stock y shelf_position son INTEGER: un valor mayor haría fallar el UPDATE de todo el lote
+PAINT_INTEGER_MIN = -2147483648
+PAINT_INTEGER_MAX = 2147483647
+
+def validate_paint_bulk_value(field, value):
+    """Valor normalizado del campo; ValueError si no es válido"""
+    if field == 'stock':
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= PAINT_INTEGER_MAX \
+                or value != int(value):
+            raise ValueError(f'stock must be an integer between 0 and {PAINT_INTEGER_MAX}')
+        return int(value)
+    if value is None:
+        if field == 'sync_status':
+            raise ValueError('sync_status cannot be null')
+        return None
+    if field == 'price':
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError('price must be a non-negative number')
+        return float(value)
+    if field == 'shelf_position':
+        if isinstance(value, bool) or not isinstance(value, int) or not PAINT_INTEGER_MIN <= value <= PAINT_INTEGER_MAX:
+            raise ValueError(f'shelf_position must be an integer between {PAINT_INTEGER_MIN} and {PAINT_INTEGER_MAX}')
+        return value
+    if field == 'color_preview':
+        rgb = parse_hex_color(value) if isinstance(value, str) else None
+        if rgb is None:
+            raise ValueError('color_preview must be a hex color (#RRGGBB)')
+        return '#%02x%02x%02x' % rgb
+    if field == 'sync_status':
+        if value not in PAINT_SYNC_STATUSES:
+            raise ValueError(f"sync_status must be one of {', '.join(PAINT_SYNC_STATUSES)}")
+        return value
+    if field == 'ean':
+        value = str(value).strip()
+        if not value.isdigit() or len(value) > 13:
+            raise ValueError('ean must have up to 13 digits')
+        return value
+    raise ValueError(f'{field} cannot be updated in bulk')
+
+@app.route('/api/paints/bulk', methods=['PATCH'])
+@admin_or_api_key_required
+def bulk_update_paints():
+    """
+    Actualización parcial de muchas pinturas en una sola transacción
+
+    Cuerpo: {"updates": [{"id": 1, "stock": 5}, {"id": 2, "price": 3.5, "shelf_position": 12}], "source": "..."}
+    Campos admitidos: stock, price, shelf_position, color_preview, sync_status, ean.
+    Si un id se repite se combinan sus campos (gana el último valor). Las entradas no
+    válidas se informan en results y no impiden aplicar las demás. Los cambios de
+    stock se notifican a Android en una sola notificación.
+    """
+    from sqlalchemy import text
+    data = request.get_json(silent=True)
+    updates = data.get('updates') if isinstance(data, dict) else data
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"success": False, "message": "updates array is required"}), 400
+    if len(updates) > PAINT_BULK_MAX_ITEMS:
+        return jsonify({
+            "success": False,
+            "message": f"Too many updates: {len(updates)} (max {PAINT_BULK_MAX_ITEMS})"
+        }), 400
+    source = (data.get('source') if isinstance(data, dict) else None) or 'bulk_api'
+
+    try:
+        # 1) Validación de todas las entradas
+        errors = {}    # id (o posición si no hay id válido) -> error
+        patches = {}   # id -> {campo: valor}
+        for position, update in enumerate(updates):
+            if not isinstance(update, dict):
+                errors[f'#{position}'] = 'update must be an object'
+                continue
+            paint_id = update.get('id', update.get('paint_id'))
+            if isinstance(paint_id, bool) or not isinstance(paint_id, int):
+                errors[f'#{position}'] = 'id must be an integer'
+                continue
+            fields = {key: value for key, value in update.items() if key not in ('id', 'paint_id')}
+            try:
+                if not fields:
+                    raise ValueError('no fields to update')
+                patch = {field: validate_paint_bulk_value(field, value) for field, value in fields.items()}
+            except ValueError as ve:
+                errors[paint_id] = str(ve)
+                patches.pop(paint_id, None)
+                continue
+            if paint_id not in errors:
+                patches.setdefault(paint_id, {}).update(patch)
+
+        if patches:
+            existing = {row.id for row in db.session.query(Paint.id).filter(Paint.id.in_(list(patches)))}
+            for paint_id in list(patches):
+                if paint_id not in existing:
+                    errors[paint_id] = f'Paint with id {paint_id} not found'
+                    del patches[paint_id]
+
+            # EAN único: ni repetido en el lote ni de otra pintura
+            eans = {}
+            for paint_id, patch in patches.items():
+                if patch.get('ean'):
+                    eans.setdefault(patch['ean'], []).append(paint_id)
+            owners = dict(db.session.query(Paint.ean, Paint.id).filter(Paint.ean.in_(list(eans)))) if eans else {}
+            for ean, paint_ids in eans.items():
+                owner = owners.get(ean)
+                if len(paint_ids) > 1 or (owner is not None and owner not in paint_ids):
+                    for paint_id in paint_ids:
+                        errors[paint_id] = f'EAN {ean} already belongs to another paint'
+                        patches.pop(paint_id, None)
+
+        # 2) Un UPDATE ... FROM (VALUES ...) por cada combinación de campos, todo en una transacción
+        groups = {}
+        for paint_id, patch in patches.items():
+            groups.setdefault(tuple(sorted(patch)), []).append(paint_id)
+
+        changed_rows = []
+        for number, (fields, paint_ids) in enumerate(groups.items()):
+            params = {}
+            values = []
+            for row_number, paint_id in enumerate(paint_ids):
+                placeholders = [f"CAST(:g{number}_{row_number}_id AS INTEGER)"]
+                params[f'g{number}_{row_number}_id'] = paint_id
+                for field in fields:
+                    key = f'g{number}_{row_number}_{field}'
+                    params[key] = patches[paint_id][field]
+                    placeholders.append(f"CAST(:{key} AS {PAINT_BULK_FIELDS[field]})")
+                values.append(f"({', '.join(placeholders)})")
+            columns = ', '.join(fields)
+            incoming = ', '.join(f"v.{field}" for field in fields)
+            current = ', '.join(f"old.{field}" for field in fields)
+            changed_rows.extend(db.session.execute(text(f"""
+                UPDATE paints p
+                SET ({columns}, updated_at) = ({incoming}, {UTC_NOW_SQL})
+                FROM (VALUES {', '.join(values)}) AS v (id, {columns})
+                JOIN paints old ON old.id = v.id
+                WHERE p.id = v.id AND ROW({current}) IS DISTINCT FROM ROW({incoming})
+                RETURNING p.id, p.name, p.color_code, p.brand, old.stock AS old_stock, p.stock,
+                          old.color_preview AS old_color_preview, p.color_preview
+            """), params).fetchall())
+
+        # 3) Notificación (en la misma transacción), commit e invalidación, una vez por lote
+        stock_changes = [row for row in changed_rows if row.stock != row.old_stock]
+        if stock_changes:
+            send_android_notification(None, 'stock_bulk_updated', {
+                'changes': [{
+                    'paint_id': row.id,
+                    'paint_name': row.name,
+                    'paint_code': row.color_code,
+                    'brand': row.brand,
+                    'old_stock': row.old_stock,
+                    'new_stock': row.stock
+                } for row in stock_changes],
+                'count': len(stock_changes),
+                'source': source
+            })
+        db.session.commit()
+
+        changed_ids = [row.id for row in changed_rows]
+        if changed_ids:
+            invalidate_catalog(f'bulk update ({source})', paint_ids=changed_ids)
+            color_changed = [row.id for row in changed_rows if row.color_preview != row.old_color_preview]
+            if color_changed:
+                schedule_paint_equivalents_refresh(color_changed)
+
+        changed = set(changed_ids)
+        results = [{'id': paint_id, 'success': False, 'error': error} for paint_id, error in errors.items()]
+        results.extend(
+            {'id': paint_id, 'success': True, 'status': 'updated' if paint_id in changed else 'unchanged'}
+            for paint_id in patches
+        )
+        print(f"📝 Bulk paint update ({source}): {len(changed)} updated, "
+              f"{len(patches) - len(changed)} unchanged, {len(errors)} failed in {len(groups)} statements")
+        return jsonify({
+            "success": True,
+            "updated": len(changed),
+            "unchanged": len(patches) - len(changed),
+            "failed": len(errors),
+            "results": results
+        })
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error in bulk paint update: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
 @app.route('/admin/paints', methods=['POST'])
 @admin_required
 def add_paint():
     try:
         data = request.json
         
+        # Evitar duplicados aunque el código se escriba con otra grafía (70.950 / 70950)
+        if data.get('color_code') and Paint.query.filter(
+            Paint.brand == data.get('brand'),
+            code_matches(Paint.color_code, Paint.normalized_code, data.get('color_code'), data.get('brand'))
+        ).first():
+            return jsonify({'error': f"Ya existe una pintura {data.get('brand')} con el código {data.get('color_code')}"}), 409
+        
         new_paint = Paint(
             name=data.get('name'),
             brand=data.get('brand'),
@@ -1318,8 +2716,8 @@ def add_paint():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/admin/paints/<int:paint_id>', methods=['GET'])
-@cache_paint_result(timeout=300)  # Cache por 5 minutos
 @admin_required
+@cache_paint_result(timeout=300)  # Cache por 5 minutos (detrás de la autenticación)
 def get_paint(paint_id):
     import time
     from flask import g
@@ -1360,7 +2758,8 @@ def get_paint(paint_id):
         # Optimización 3: Cerrar explícitamente la sesión
         db.session.close()
         
-        return jsonify(response_data)
+        # Se devuelve el dict (Flask lo serializa) para que la caché guarde el payload
+        return response_data
         
     except Exception as e:
         error_time = time.time() - start_time
@@ -1376,6 +2775,12 @@ def clear_cache_endpoint(paint_id):
     clear_paint_cache(paint_id)
     return jsonify({'status': 'success', 'message': f'Cache cleared for paint {paint_id}'})
 
+# Estadísticas de la caché de pinturas (aciertos, fallos, expulsiones, caducidades)
+@app.route('/admin/cache/stats', methods=['GET'])
+@admin_required
+def paint_cache_stats():
+    return jsonify({'success': True, 'paint_cache': paint_cache.stats()})
+
 @app.route('/admin/paints/<int:paint_id>', methods=['PUT'])
 @admin_required
 def update_paint(paint_id):
@@ -1397,23 +2802,20 @@ def update_paint(paint_id):
     paint.color_preview = data.get('color_preview', paint.color_preview)
     paint.shelf_position = data.get('shelf_position', paint.shelf_position)
     
-    db.session.commit()
+    # Notificación push a Android si el stock cambió (se guarda con el mismo commit)
+    if 'stock' in data and data.get('stock') != old_stock:
+        send_android_notification(paint_id, 'stock_updated', {
+            'paint_id': paint.id,
+            'paint_name': paint.name,
+            'paint_code': paint.color_code,
+            'brand': paint.brand,
+            'old_stock': old_stock,
+            'new_stock': paint.stock,
+            'source': 'web_admin'
+        })
+        print(f"🔔 Notification queued for Android stock update: {paint.name} (Stock: {old_stock} → {paint.stock})")
     
-    # Enviar notificación push a Android si el stock cambió
-    try:
-        if 'stock' in data and data.get('stock') != old_stock:
-            send_android_notification(paint_id, 'stock_updated', {
-                'paint_id': paint.id,
-                'paint_name': paint.name,
-                'paint_code': paint.color_code,
-                'brand': paint.brand,
-                'old_stock': old_stock,
-                'new_stock': paint.stock,
-                'source': 'web_admin'
-            })
-            print(f"🔔 Notification sent to Android for stock update: {paint.name} (Stock: {old_stock} → {paint.stock})")
-    except Exception as e:
-        print(f"⚠️ Failed to send Android notification: {str(e)}")
+    db.session.commit()
     
     return jsonify({
         'id': paint.id,
@@ -1854,6 +3256,46 @@ def save_to_db():
 API_KEY = os.environ.get('API_KEY', 'print_and_paint_secret_key_2025')
 
 # ⭐ ENDPOINT CRÍTICO - POST /api/paints para Android
+def paint_code_lookup_candidates(color_code):
+    """
+    Códigos normalizados a probar cuando no se conoce la marca: el código tal cual
+    y, si empieza por letras seguidas de dígitos ('AK11001'), también sin ese prefijo.
+    """
+    import re
+    normalized = normalize_paint_code(color_code)
+    if not normalized:
+        return []
+    candidates = [normalized]
+    prefixed = re.match(r'^[A-Z]+([0-9].*)$', normalized)
+    if prefixed:
+        candidates.append(prefixed.group(1))
+    return candidates
+
+def code_matches(code_column, normalized_column, code, brand):
+    """
+    Condición "mismo código con cualquier grafía". La comparación exacta cubre las filas
+    sin normalized_code (escritas con SQL directo o anteriores a la migración)
+    """
+    normalized = normalize_paint_code(code, brand)
+    if not normalized:
+        return code_column == code
+    return db.or_(normalized_column == normalized, code_column == code)
+
+def find_paint_by_code(color_code, brand=None):
+    """Buscar una pintura por código con cualquier grafía (una consulta al índice normalized_code)"""
+    if brand:
+        return Paint.query.filter(
+            code_matches(Paint.color_code, Paint.normalized_code, color_code, brand),
+            db.func.upper(Paint.brand) == brand.strip().upper()
+        ).first()
+    candidates = paint_code_lookup_candidates(color_code)
+    if not candidates:
+        return Paint.query.filter(Paint.color_code == color_code).order_by(Paint.id).first()
+    # Preferir la coincidencia exacta sobre la que descarta el prefijo
+    return Paint.query.filter(db.or_(
+        Paint.normalized_code.in_(candidates), Paint.color_code == color_code
+    )).order_by((Paint.normalized_code != candidates[0]), Paint.id).first()
+
 @app.route('/api/paints', methods=['POST'])
 def create_paint_android():
     """Create paint from Android app - CRITICAL ENDPOINT"""
@@ -1892,10 +3334,10 @@ def create_paint_android():
                 "message": f"Missing required fields: {', '.join(missing_fields)}"
             }), 400
         
-        # Verificar si ya existe una pintura con esa marca y código (índice único correcto)
-        existing_paint = Paint.query.filter_by(
-            brand=data['brand'], 
-            color_code=data['color_code']
+        # Verificar si ya existe una pintura con esa marca y código (con cualquier grafía del código)
+        existing_paint = Paint.query.filter(
+            Paint.brand == data['brand'],
+            code_matches(Paint.color_code, Paint.normalized_code, data['color_code'], data['brand'])
         ).first()
         if existing_paint:
             return jsonify({
@@ -1984,25 +3426,35 @@ def update_paint_android(id):
                 "message": f"Paint with id {id} not found"
             }), 404
         
+        # Marca y código resultantes: los duplicados se buscan en la marca nueva si se envía
+        new_brand = data['brand'] if 'brand' in data else paint.brand
+        new_color_code = data.get('color_code')
+        if 'color_code' in data and (not new_color_code or new_color_code.strip() == "" or new_color_code == "0"):
+            # Para actualizaciones desde Android, ignorar color_code si está vacío o es problemático
+            print(f"⚠️ Ignoring invalid/empty color_code in update for paint {id}")
+            new_color_code = None
+        target_color_code = new_color_code or paint.color_code
+        if (new_brand, target_color_code) != (paint.brand, paint.color_code):
+            # Solo verificar duplicados si la marca o el código realmente están cambiando
+            existing = Paint.query.filter(
+                Paint.brand == new_brand,
+                code_matches(Paint.color_code, Paint.normalized_code, target_color_code, new_brand),
+                Paint.id != id
+            ).first()
+            if existing:
+                return jsonify({
+                    "success": False,
+                    "data": None,
+                    "message": f"Another paint with code {target_color_code} already exists"
+                }), 409
+        
         # Actualizar campos enviados
         if 'name' in data:
             paint.name = data['name']
         if 'brand' in data:
-            paint.brand = data['brand']
-        if 'color_code' in data:
-            new_color_code = data['color_code']
-            # Para actualizaciones desde Android, ignorar color_code si está vacío o es problemático
-            if not new_color_code or new_color_code.strip() == "" or new_color_code == "0":
-                print(f"⚠️ Ignoring invalid/empty color_code in update for paint {id}")
-            elif paint.color_code != new_color_code:
-                # Solo verificar duplicados si el código realmente está cambiando
-                existing = Paint.query.filter(Paint.color_code == new_color_code, Paint.id != id).first()
-                if existing:
-                    return jsonify({
-                        "success": False,
-                        "data": None,
-                        "message": f"Another paint with code {new_color_code} already exists"
-                    }), 409
+            paint.brand = new_brand
+        if new_color_code:
+            if paint.color_code != new_color_code:
                 paint.color_code = new_color_code
                 print(f"🔄 Color code updated for paint {id}: {paint.color_code} → {new_color_code}")
             else:
@@ -2057,25 +3509,23 @@ def update_paint_android(id):
         if hasattr(paint, 'sync_status'):
             paint.sync_status = 'pending_upload'
         
+        # Notificación push a Android si el stock cambió (desde aplicación externa como nuestro script de testing);
+        # se guarda en la misma transacción que el cambio
+        if 'stock' in data and data.get('stock') != old_stock:
+            send_android_notification(id, 'stock_updated', {
+                'paint_id': paint.id,
+                'paint_name': paint.name,
+                'paint_code': paint.color_code,
+                'brand': paint.brand,
+                'old_stock': old_stock,
+                'new_stock': paint.stock,
+                'source': 'external_api'
+            })
+            print(f"📱 Android notification queued: {paint.name} stock {old_stock} → {paint.stock}")
+        
         # Guardar cambios
         db.session.commit()
         
-        # Enviar notificación push a Android si el stock cambió (desde aplicación externa como nuestro script de testing)
-        try:
-            if 'stock' in data and data.get('stock') != old_stock:
-                send_android_notification(id, 'stock_updated', {
-                    'paint_id': paint.id,
-                    'paint_name': paint.name,
-                    'paint_code': paint.color_code,
-                    'brand': paint.brand,
-                    'old_stock': old_stock,
-                    'new_stock': paint.stock,
-                    'source': 'external_api'
-                })
-                print(f"📱 Android notification sent: {paint.name} stock {old_stock} → {paint.stock}")
-        except Exception as e:
-            print(f"⚠️ Failed to send Android notification: {str(e)}")
-        
         # Retornar respuesta para Android
         return jsonify({
             "success": True,
@@ -2122,7 +3572,8 @@ def get_paint_by_code_android(color_code):
                 "message": "Invalid or missing API key"
             }), 401
         
-        paint = Paint.query.filter_by(color_code=color_code).first()
+        # brand opcional (?brand=) para desambiguar; '70.950' y '70950' encuentran la misma pintura
+        paint = find_paint_by_code(color_code, request.args.get('brand'))
         
         if paint:
             paint_data = {
@@ -2207,6 +3658,133 @@ def get_paint_by_ean_android(ean):
             "message": f"Error retrieving paint by EAN: {str(e)}"
         }), 500
 
+# Máximo de entradas (EANs + pares marca/código) por petición de búsqueda en lote
+PAINT_LOOKUP_MAX_ITEMS = 500
+
+@app.route('/api/paints/lookup', methods=['POST'])
+def lookup_paints_android():
+    """
+    Resolver en una sola consulta muchos EANs y/o pares (marca, código) para Android
+
+    Body:
+    {
+        "eans": ["8429551708906", ...],
+        "codes": [{"brand": "VALLEJO", "color_code": "70.950"}, ...]
+    }
+
+    Respuesta: aciertos y fallos indexados por la entrada recibida
+    {
+        "success": true,
+        "data": {
+            "eans": {"hits": {"8429551708906": {...}}, "misses": []},
+            "codes": {"hits": {"VALLEJO:70.950": {...}}, "misses": []}
+        },
+        "message": "..."
+    }
+    """
+    try:
+        # Verificar API key
+        api_key = request.headers.get('X-API-Key')
+        if not api_key or api_key != API_KEY:
+            return jsonify({
+                "success": False,
+                "data": None,
+                "message": "Invalid or missing API key"
+            }), 401
+
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "data": None, "message": "JSON body required"}), 400
+
+        eans = data.get('eans') or []
+        codes = data.get('codes') or []
+        if not isinstance(eans, list) or not all(isinstance(ean, str) for ean in eans):
+            return jsonify({"success": False, "data": None, "message": "eans must be a list of strings"}), 400
+        if not isinstance(codes, list) or not all(
+                isinstance(item, dict) and item.get('brand') and item.get('color_code') for item in codes):
+            return jsonify({
+                "success": False,
+                "data": None,
+                "message": "codes must be a list of {brand, color_code} objects"
+            }), 400
+        if len(eans) + len(codes) > PAINT_LOOKUP_MAX_ITEMS:
+            return jsonify({
+                "success": False,
+                "data": None,
+                "message": f"Too many items: maximum {PAINT_LOOKUP_MAX_ITEMS} per request"
+            }), 400
+
+        ean_keys = {ean.strip(): ean for ean in eans if ean.strip()}
+        # Clave de búsqueda (MARCA, código normalizado) -> entradas originales que la usan
+        code_keys = {}
+        for item in codes:
+            brand = str(item['brand']).strip()
+            color_code = str(item['color_code'])
+            key = (brand.upper(), normalize_paint_code(color_code, brand))
+            code_keys.setdefault(key, []).append(f"{item['brand']}:{color_code}")
+
+        conditions = []
+        if ean_keys:
+            conditions.append(Paint.ean.in_(list(ean_keys)))
+        code_pairs = [key for key in code_keys if key[1]]
+        if code_pairs:
+            conditions.append(db.tuple_(db.func.upper(Paint.brand), Paint.normalized_code).in_(code_pairs))
+
+        rows = []
+        if conditions:
+            # Una sola consulta con IN sobre los índices de ean y normalized_code; sin hidratar objetos Paint
+            rows = db.session.query(
+                *[getattr(Paint, field) for field in PAINT_API_FIELDS],
+                db.func.upper(Paint.brand),
+                Paint.normalized_code
+            ).filter(db.or_(*conditions)).order_by(Paint.id).all()
+
+        paints_by_ean = {}
+        paints_by_code = {}
+        for row in rows:
+            paint_dict = paint_row_to_dict(row[:len(PAINT_API_FIELDS)], PAINT_API_FIELDS)
+            if paint_dict['ean']:
+                paints_by_ean.setdefault(paint_dict['ean'], paint_dict)
+            paints_by_code.setdefault((row[-2], row[-1]), paint_dict)
+
+        ean_result = {"hits": {}, "misses": []}
+        for ean_key, ean in ean_keys.items():
+            if ean_key in paints_by_ean:
+                ean_result["hits"][ean] = paints_by_ean[ean_key]
+            else:
+                ean_result["misses"].append(ean)
+
+        code_result = {"hits": {}, "misses": []}
+        for key, inputs in code_keys.items():
+            for input_key in inputs:
+                if key in paints_by_code:
+                    code_result["hits"][input_key] = paints_by_code[key]
+                else:
+                    code_result["misses"].append(input_key)
+
+        hits = len(ean_result["hits"]) + len(code_result["hits"])
+        misses = len(ean_result["misses"]) + len(code_result["misses"])
+        print(f"🔍 Batch lookup: {len(eans)} EANs + {len(codes)} codes -> {hits} hits, {misses} misses")
+
+        return jsonify({
+            "success": True,
+            "data": {
+                "eans": ean_result,
+                "codes": code_result
+            },
+            "message": f"{hits} paints found, {misses} not found"
+        }), 200
+
+    except Exception as e:
+        print(f"Error en lookup_paints_android(): {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            "success": False,
+            "data": None,
+            "message": f"Error in batch lookup: {str(e)}"
+        }), 500
+
 # Debug endpoint to verify EAN endpoint deployment
 @app.route('/api/debug/ean-endpoint-status', methods=['GET'])
 def debug_ean_endpoint_status():
@@ -2497,7 +4075,15 @@ def search_paint_images():
         
         # Filtrar por código si se especifica
         if codigo:
-            query = query.filter(PaintImage.codigo.ilike(f'%{codigo}%'))
+            normalized_codigo = normalize_paint_code(codigo, marca or None)
+            if normalized_codigo:
+                # Acepta '70.950', '70950' o 'VALLEJO 70950' como el mismo código
+                query = query.filter(db.or_(
+                    PaintImage.codigo.ilike(f'%{codigo}%'),
+                    PaintImage.normalized_code == normalized_codigo
+                ))
+            else:
+                query = query.filter(PaintImage.codigo.ilike(f'%{codigo}%'))
         
         # Filtrar por nombre si se especifica
         if nombre:
@@ -2557,7 +4143,10 @@ def get_paint_image_by_marca_codigo(marca, codigo):
         print(f"🔍 Searching specific paint image - marca: '{marca}', codigo: '{codigo}'")
         
         # Buscar la imagen específica
-        paint_image = PaintImage.query.filter_by(marca=marca, codigo=codigo).first()
+        paint_image = PaintImage.query.filter(
+            PaintImage.marca == marca,
+            code_matches(PaintImage.codigo, PaintImage.normalized_code, codigo, marca)
+        ).order_by(PaintImage.codigo != codigo, PaintImage.id).first()
         
         if not paint_image:
             return jsonify({
@@ -2772,11 +4361,15 @@ def mark_paints_as_viewed():
 def debug_pending_notifications():
     """Debug endpoint para ver notificaciones pendientes"""
     try:
-        notifications = getattr(app, 'pending_notifications', [])
+        pending_count, _ = notification_counts('web')
+        rows = NotificationOutbox.query.filter(
+            NotificationOutbox.channel == 'web',
+            NotificationOutbox.acked_at.is_(None)
+        ).order_by(NotificationOutbox.id).limit(NOTIFICATION_BATCH_LIMIT).all()
         return jsonify({
             'success': True,
-            'pending_count': len(notifications),
-            'notifications': notifications,
+            'pending_count': pending_count,
+            'notifications': [web_notification_to_dict(row) for row in rows],
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
@@ -3068,16 +4661,17 @@ def search_high_quality_images():
                 
                 # 1. PRIMERA BÚSQUEDA: MARCA + COLOR_CODE (MÁXIMA PRIORIDAD)
                 if vallejo_code:
-                    # Generar ambas versiones: con punto y sin punto
+                    # Generar ambas versiones (con punto y sin punto) a partir del código normalizado
                     vallejo_code_with_dot = None
                     vallejo_code_without_dot = None
+                    normalized_vallejo_code = paint.normalized_code or normalize_paint_code(vallejo_code, brand)
                     
-                    if '.' in vallejo_code:
-                        # Si ya tiene punto (ej: 70.950), generar versión sin punto
-                        vallejo_code_without_dot = vallejo_code.replace('.', '')  # 70.950 -> 70950
-                    elif vallejo_code.isdigit() and len(vallejo_code) == 5:
+                    if normalized_vallejo_code and normalized_vallejo_code != vallejo_code:
+                        # Si se escribió con punto u otro separador (ej: 70.950), usar la versión sin punto
+                        vallejo_code_without_dot = normalized_vallejo_code  # 70.950 -> 70950
+                    elif normalized_vallejo_code and normalized_vallejo_code.isdigit() and len(normalized_vallejo_code) == 5:
                         # Si no tiene punto y es de 5 dígitos (ej: 72082), generar versión con punto
-                        vallejo_code_with_dot = f"{vallejo_code[:2]}.{vallejo_code[2:]}"  # 72082 -> 72.082
+                        vallejo_code_with_dot = f"{normalized_vallejo_code[:2]}.{normalized_vallejo_code[2:]}"  # 72082 -> 72.082
                     
                     # Búsquedas con el código original
                     vallejo_searches.extend([
@@ -3817,12 +5411,235 @@ def clear_old_backups():
         }), 500
 
 # =====================================================
-# ENDPOINTS DE NOTIFICACIONES WEB PARA ACTUALIZACIONES ANDROID → WEB
+# COLA DE NOTIFICACIONES PERSISTENTE (tabla notification_outbox)
 # =====================================================
+# Las notificaciones se guardan con el mismo commit que el cambio que las origina:
+# todos los workers de gunicorn las ven y sobreviven a reinicios.
+# Las lecturas van por el índice (channel, id); el índice parcial solo tiene las pendientes.
+# Los lectores avanzan por id (Last-Event-ID del stream SSE, cursor de cada dispositivo), así que
+# el orden de los ids tiene que ser el de los commits: las filas se insertan justo antes del
+# commit con un advisory lock de transacción, que se libera al terminar el commit.
+
+from sqlalchemy import text
+
+NOTIFICATION_BATCH_LIMIT = 100
+ANDROID_NOTIFICATION_TTL = 300  # Segundos: las notificaciones Android más antiguas ya no se entregan
+ANDROID_REDELIVERY_SECONDS = 120  # Entregada y sin confirmar en 2 minutos: se vuelve a enviar
+NOTIFICATION_RETENTION = timedelta(days=1)
+NOTIFICATION_PRUNE_INTERVAL = 600  # Segundos entre limpiezas (por worker)
+DEVICE_CURSOR_RETENTION = timedelta(days=30)  # Dispositivos sin conectarse en 30 días: se olvida su cursor
+NOTIFICATION_COMMIT_LOCK = 5_180_018  # Clave de pg_advisory_xact_lock para insertar en notification_outbox
+notification_prune_state = {'last': 0.0}
+
+def enqueue_notification(channel, paint_id, payload):
+    """Añadir una notificación a la transacción actual; se inserta y se guarda con el siguiente commit"""
+    db.session.info.setdefault('pending_notifications', []).append((channel, paint_id, payload))
+    db.session.info.setdefault('notification_channels', set()).add(channel)
+
+@event.listens_for(db.session, 'before_commit')
+def _insert_pending_notifications(session):
+    """
+    Insertar las notificaciones de la transacción con el lock de notification_outbox tomado:
+    los ids se asignan y se confirman en el mismo orden, y nadie lee un id mayor antes que uno
+    menor todavía sin confirmar. Los demás cambios se escriben antes de esperar al lock
+    """
+    pending = session.info.pop('pending_notifications', None)
+    if not pending:
+        return
+    session.flush()
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': NOTIFICATION_COMMIT_LOCK})
+    for channel, paint_id, payload in pending:
+        if channel == 'android' and payload.get('action') in STOCK_NOTIFICATION_ACTIONS:
+            coalesced = coalesce_stock_notification(paint_id, payload['action'], payload.get('data') or {})
+            if coalesced is None:
+                continue
+            paint_id, action, data = coalesced
+            payload = {**payload, 'action': action, 'data': data}
+        session.add(NotificationOutbox(channel=channel, paint_id=paint_id, payload=payload))
+
+# Aviso a las peticiones en espera de este worker (stream SSE, long-poll) cuando se confirma
+# una notificación. Las generaciones cuentan los avisos por canal: solo se espera si no ha
+# habido ninguno desde la última lectura
+notification_signal = threading.Condition()
+notification_generations = {'web': 0, 'android': 0}
+
+def wake_notification_waiters(channels):
+    with notification_signal:
+        for channel in channels:
+            notification_generations[channel] = notification_generations.get(channel, 0) + 1
+        notification_signal.notify_all()
+
+def wait_for_notifications(channel, generation, timeout):
+    """Esperar (como mucho timeout segundos) a una notificación del canal confirmada en este worker"""
+    with notification_signal:
+        if notification_generations.get(channel, 0) == generation:
+            notification_signal.wait(timeout=timeout)
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_waiters_on_commit(session):
+    channels = session.info.pop('notification_channels', None)
+    if channels:
+        wake_notification_waiters(channels)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_wakeup_on_rollback(session):
+    session.info.pop('pending_notifications', None)
+    session.info.pop('notification_channels', None)
+
+# Fan-out entre workers: cada flush con notificaciones hace NOTIFY paint_changes dentro de la
+# transacción (Postgres lo entrega solo si hay commit) y un hilo por worker escucha con LISTEN
+# y despierta a los streams SSE / long-poll de su proceso. Los cambios de pinturas sin
+# notificación no se avisan: las cachés de otros workers ya siguen la versión del catálogo
+import select
+
+PAINT_CHANGES_CHANNEL = 'paint_changes'
+LISTENER_PING_SECONDS = 60
+LISTENER_RECONNECT_SECONDS = 5
+notification_listener = {'thread': None, 'connected': False, 'lock': threading.Lock()}
+
+@event.listens_for(db.session, 'after_flush')
+def _notify_paint_changes(session, flush_context):
+    channels = {obj.channel for obj in session.new if isinstance(obj, NotificationOutbox)}
+    if not channels or session.get_bind().dialect.name != 'postgresql':
+        return
+    payload = {'pid': os.getpid(), 'channels': sorted(channels)}
+    session.execute(text("SELECT pg_notify(:channel, :payload)"), {
+        'channel': PAINT_CHANGES_CHANNEL,
+        'payload': json.dumps(payload, separators=(',', ':'))
+    })
+
+def ensure_notification_listener():
+    """Arrancar (una vez por worker) el hilo LISTEN. Devuelve True si está escuchando"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    with notification_listener['lock']:
+        thread = notification_listener['thread']
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=_notification_listener_loop, daemon=True, name='notification-listener')
+            notification_listener['thread'] = thread
+            thread.start()
+    return notification_listener['connected']
+
+def _notification_listener_loop():
+    while True:
+        connection = None
+        try:
+            # Conexión propia, fuera del pool: queda abierta mientras el worker viva
+            with app.app_context():
+                pooled = db.engine.raw_connection()
+            pooled.detach()
+            connection = pooled.connection
+            connection.rollback()
+            connection.autocommit = True
+            connection.cursor().execute(f"LISTEN {PAINT_CHANGES_CHANNEL}")
+            notification_listener['connected'] = True
+            print(f"👂 Worker {os.getpid()} listening on {PAINT_CHANGES_CHANNEL}")
+            # Lo confirmado mientras no escuchábamos: que los clientes vuelvan a leer
+            wake_notification_waiters(list(notification_generations))
+
+            while True:
+                if select.select([connection], [], [], LISTENER_PING_SECONDS) == ([], [], []):
+                    # Detectar conexiones caídas; los NOTIFY que lleguen durante la consulta quedan
+                    # en connection.notifies (el socket ya está leído): se procesan abajo
+                    connection.cursor().execute("SELECT 1")
+                else:
+                    connection.poll()
+                channels = set()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    try:
+                        payload = json.loads(notify.payload)
+                    except ValueError:
+                        continue
+                    # Los commits de este proceso ya despiertan a sus clientes (after_commit)
+                    if payload.get('pid') != os.getpid():
+                        channels.update(payload.get('channels', []))
+                if channels:
+                    wake_notification_waiters(channels)
+        except Exception as e:
+            print(f"⚠️ Notification listener error: {str(e)}")
+        finally:
+            notification_listener['connected'] = False
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+        time.sleep(LISTENER_RECONNECT_SECONDS)
+
+def notification_counts(channel):
+    """(pendientes, entregadas sin confirmar) de un canal"""
+    row = db.session.execute(text("""
+        SELECT count(*) AS pending, count(*) FILTER (WHERE delivered_at IS NOT NULL) AS delivered
+        FROM notification_outbox
+        WHERE channel = :channel AND acked_at IS NULL
+    """), {'channel': channel}).first()
+    return row.pending, row.delivered
+
+def prune_notification_outbox():
+    """
+    Borrar confirmadas antiguas y Android caducadas (como mucho cada NOTIFICATION_PRUNE_INTERVAL).
+    No hace commit: lo hace quien la llama
+    """
+    if time.time() - notification_prune_state['last'] < NOTIFICATION_PRUNE_INTERVAL:
+        return 0
+    notification_prune_state['last'] = time.time()
+    now = datetime.utcnow()
+    deleted, pruned_android_id = db.session.execute(text("""
+        WITH deleted AS (
+            DELETE FROM notification_outbox
+            WHERE created_at < :retention_cutoff
+               OR (channel = 'android' AND acked_at IS NULL AND created_at < :expired_before)
+            RETURNING id, channel
+        )
+        SELECT count(*), max(id) FILTER (WHERE channel = 'android') FROM deleted
+    """), {
+        'retention_cutoff': now - NOTIFICATION_RETENTION,
+        'expired_before': now - timedelta(seconds=ANDROID_NOTIFICATION_TTL)
+    }).first()
+    if deleted:
+        print(f"🗑️ Removed {deleted} old notifications from outbox")
+    if pruned_android_id:
+        # Los dispositivos cuyo cursor no llegaba a las borradas se las han perdido: resincronización completa
+        db.session.execute(text("""
+            UPDATE notification_device_cursors SET needs_resync = TRUE
+            WHERE last_acked_id < :pruned_android_id AND NOT needs_resync
+        """), {'pruned_android_id': pruned_android_id})
+    NotificationDeviceCursor.query.filter(
+        NotificationDeviceCursor.last_seen_at < now - DEVICE_CURSOR_RETENTION
+    ).delete(synchronize_session=False)
+    return deleted
+
+def web_notification_to_dict(row):
+    return {
+        **row.payload,
+        'id': row.id,
+        'paint_id': row.paint_id,
+        'timestamp': row.created_at.isoformat()
+    }
+
+def android_notification_to_dict(row):
+    return {
+        'id': str(row.id),
+        'type': row.payload.get('type', 'paint_update'),
+        'action': row.payload.get('action'),
+        'paint_id': row.paint_id,
+        'timestamp': row.created_at.isoformat(),
+        'data': row.payload.get('data'),
+        'sent': row.acked_at is not None,
+        'delivered_at': row.delivered_at.isoformat() if row.delivered_at else None
+    }
+
+def parse_notification_limit():
+    try:
+        return max(1, min(int(request.args.get('limit', NOTIFICATION_BATCH_LIMIT)), NOTIFICATION_BATCH_LIMIT))
+    except (TypeError, ValueError):
+        return NOTIFICATION_BATCH_LIMIT
 
-# Variable global para mantener notificaciones pendientes
-if not hasattr(app, 'pending_notifications'):
-    app.pending_notifications = []
+# =====================================================
+# ENDPOINTS DE NOTIFICACIONES WEB PARA ACTUALIZACIONES ANDROID → WEB
+# =====================================================
 
 @app.route('/api/web-notify/paint-updated', methods=['POST'])
 def notify_paint_updated():
@@ -3844,25 +5661,17 @@ def notify_paint_updated():
         print(f"🔔 Notificación web recibida: {action} - {paint_name} (ID: {paint_id}) desde {source}")
         
         # Almacenar notificación para clientes web conectados
-        notification = {
+        enqueue_notification('web', paint_id, {
             'type': 'paint_update',
             'action': action,
-            'paint_id': paint_id,
             'paint_name': paint_name,
             'paint_code': data.get('paint_code'),
             'paint_brand': data.get('paint_brand'),
-            'timestamp': datetime.now().isoformat(),
             'source': source
-        }
-        
-        # Almacenar en lista en memoria
-        app.pending_notifications.append(notification)
-        
-        # Mantener solo las últimas 100 notificaciones para evitar problemas de memoria
-        if len(app.pending_notifications) > 100:
-            app.pending_notifications = app.pending_notifications[-100:]
+        })
+        db.session.commit()
         
-        print(f"✅ Notificación almacenada exitosamente. Total pendientes: {len(app.pending_notifications)}")
+        print("✅ Notificación almacenada exitosamente")
         
         return jsonify({
             'success': True, 
@@ -3871,6 +5680,7 @@ def notify_paint_updated():
         })
         
     except Exception as e:
+        db.session.rollback()
         print(f"❌ Error procesando notificación web: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
@@ -3893,24 +5703,17 @@ def notify_paint_created():
         print(f"🔔 Notificación web recibida: CREADA - {paint_name} (ID: {paint_id}) desde {source}")
         
         # Almacenar notificación
-        notification = {
+        enqueue_notification('web', paint_id, {
             'type': 'paint_create',
             'action': 'created',
-            'paint_id': paint_id,
             'paint_name': paint_name,
             'paint_code': data.get('paint_code'),
             'paint_brand': data.get('paint_brand'),
-            'timestamp': datetime.now().isoformat(),
             'source': source
-        }
-        
-        app.pending_notifications.append(notification)
-        
-        # Mantener solo las últimas 100 notificaciones
-        if len(app.pending_notifications) > 100:
-            app.pending_notifications = app.pending_notifications[-100:]
+        })
+        db.session.commit()
         
-        print(f"✅ Notificación de creación almacenada exitosamente. Total pendientes: {len(app.pending_notifications)}")
+        print("✅ Notificación de creación almacenada exitosamente")
         
         return jsonify({
             'success': True, 
@@ -3919,6 +5722,7 @@ def notify_paint_created():
         })
         
     except Exception as e:
+        db.session.rollback()
         print(f"❌ Error procesando notificación de creación: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
@@ -3926,14 +5730,28 @@ def notify_paint_created():
 def get_pending_notifications():
     """
     Endpoint para que la web app obtenga las notificaciones pendientes
-    La web app puede llamar esto periódicamente o cuando necesite actualizar
+    La web app puede llamar esto periódicamente o cuando necesite actualizar.
+    Las notificaciones devueltas quedan confirmadas (como mucho ?limit=, por defecto 100)
     """
     try:
-        # Obtener todas las notificaciones pendientes
-        notifications = app.pending_notifications.copy()
+        now = datetime.utcnow()
+        # Las primeras pendientes por el índice parcial; SKIP LOCKED evita que dos
+        # pestañas/workers se lleven la misma notificación
+        rows = db.session.execute(text("""
+            UPDATE notification_outbox SET delivered_at = :now, acked_at = :now
+            WHERE id IN (
+                SELECT id FROM notification_outbox
+                WHERE channel = 'web' AND acked_at IS NULL
+                ORDER BY id
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, paint_id, payload, created_at, delivered_at, acked_at
+        """), {'now': now, 'limit': parse_notification_limit()}).fetchall()
+        prune_notification_outbox()
+        db.session.commit()
         
-        # Limpiar las notificaciones después de enviarlas
-        app.pending_notifications.clear()
+        notifications = [web_notification_to_dict(row) for row in sorted(rows, key=lambda row: row.id)]
         
         print(f"📤 Enviando {len(notifications)} notificaciones a la web app")
         
@@ -3945,19 +5763,100 @@ def get_pending_notifications():
         })
         
     except Exception as e:
+        db.session.rollback()
         print(f"❌ Error obteniendo notificaciones: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
+# Stream SSE: cada conexión ocupa un hilo (gunicorn gthread, ver gunicorn.conf.py), no un worker
+WEB_STREAM_HEARTBEAT_SECONDS = 15
+WEB_STREAM_POLL_SECONDS = 3  # Sin el hilo LISTEN (p. ej. SQLite): lectura por rango como mucho cada 3 s
+WEB_STREAM_MAX_SECONDS = 600  # Después se cierra; EventSource reconecta solo con Last-Event-ID
+WEB_STREAM_RETRY_MS = 3000
+
+def format_sse_event(row):
+    payload = web_notification_to_dict(row)
+    return f"id: {row.id}\nevent: {payload.get('type', 'paint_update')}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+@app.route('/api/web-notify/stream', methods=['GET'])
+def stream_web_notifications():
+    """
+    Server-Sent Events con las notificaciones web (eventos paint_update y paint_create).
+    El id de cada evento es el id de notification_outbox (en orden de commit, ver
+    _insert_pending_notifications): al reconectar, EventSource envía Last-Event-ID
+    (o ?last_event_id=) y se reanuda desde ahí. Sin él, solo llegan las nuevas.
+    Si esa notificación ya se borró (NOTIFICATION_RETENTION) pudo perderse alguna más: se envía
+    un evento resync para que la página recargue los datos.
+    No confirma notificaciones: todas las pestañas abiertas reciben todos los eventos
+    """
+    from flask import stream_with_context
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Last-Event-ID inválido'}), 400
+    resync = False
+    if last_id is None:
+        last_id = db.session.query(db.func.max(NotificationOutbox.id)).filter(
+            NotificationOutbox.channel == 'web'
+        ).scalar() or 0
+    elif last_id > 0:
+        resync = db.session.query(NotificationOutbox.id).filter(NotificationOutbox.id == last_id).first() is None
+    db.session.remove()
+
+    def generate():
+        nonlocal last_id
+        started = last_write = time.time()
+        sent = 0
+        yield f"retry: {WEB_STREAM_RETRY_MS}\n\n"
+        if resync:
+            print(f"📡 SSE resume from pruned id {last_id}: asking client to resync")
+            yield "event: resync\ndata: {}\n\n"
+        try:
+            while time.time() - started < WEB_STREAM_MAX_SECONDS:
+                generation = notification_generations['web']
+                rows = NotificationOutbox.query.filter(
+                    NotificationOutbox.channel == 'web',
+                    NotificationOutbox.id > last_id
+                ).order_by(NotificationOutbox.id).limit(NOTIFICATION_BATCH_LIMIT).all()
+                # Devolver la conexión al pool mientras se espera
+                db.session.remove()
+                if rows:
+                    last_id = rows[-1].id
+                    sent += len(rows)
+                    last_write = time.time()
+                    yield ''.join(format_sse_event(row) for row in rows)
+                    if len(rows) == NOTIFICATION_BATCH_LIMIT:
+                        continue
+                if time.time() - last_write >= WEB_STREAM_HEARTBEAT_SECONDS:
+                    last_write = time.time()
+                    yield ": heartbeat\n\n"
+                # Con LISTEN activo solo se despierta por notificaciones (o para el siguiente heartbeat)
+                timeout = max(0.1, last_write + WEB_STREAM_HEARTBEAT_SECONDS - time.time())
+                if not ensure_notification_listener():
+                    timeout = min(timeout, WEB_STREAM_POLL_SECONDS)
+                wait_for_notifications('web', generation, timeout)
+        finally:
+            db.session.remove()
+            print(f"📡 SSE stream closed after {time.time() - started:.0f}s ({sent} events, last id {last_id})")
+
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/web-notify/status', methods=['GET'])
 def notification_status():
     """
     Endpoint para verificar el estado del sistema de notificaciones
     """
     try:
+        pending_count, _ = notification_counts('web')
         return jsonify({
             'success': True,
             'status': 'activo',
-            'pending_count': len(app.pending_notifications),
+            'pending_count': pending_count,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -4059,7 +5958,9 @@ def debug_search_paint_by_code(color_code):
     Buscar pintura por color_code para debugging
     """
     try:
-        paints = Paint.query.filter_by(color_code=color_code).all()
+        paints = Paint.query.filter(db.or_(
+            Paint.normalized_code.in_(paint_code_lookup_candidates(color_code)), Paint.color_code == color_code
+        )).all()
         
         debug_info = {
             "success": True,
@@ -4150,6 +6051,142 @@ def create_shelf_position_column():
             'message': f'Error crítico: {str(e)}'
         }), 500
 
+# Cambios de esquema de la tabla paints que db.create_all() no aplica sobre tablas existentes.
+# Todas las sentencias son idempotentes (mismo contenido que catalog_schema_migration.sql).
+# Equivalente SQL de models.normalize_paint_code para rellenar filas existentes
+NORMALIZED_CODE_BACKFILL_SQL = """
+    UPDATE {table} t
+    SET normalized_code = NULLIF(CASE
+        WHEN n.brand_token <> '' AND n.code ~ ('^' || n.brand_token || '[0-9]') THEN substr(n.code, length(n.brand_token) + 1)
+        WHEN n.first_token <> '' AND n.code ~ ('^' || n.first_token || '[0-9]') THEN substr(n.code, length(n.first_token) + 1)
+        ELSE n.code
+    END, '')
+    FROM (
+        SELECT id,
+               regexp_replace(upper(coalesce({code}, '')), '[^A-Z0-9]', '', 'g') AS code,
+               regexp_replace(upper(coalesce({brand}, '')), '[^A-Z0-9]', '', 'g') AS brand_token,
+               regexp_replace(upper(split_part(trim(coalesce({brand}, '')), ' ', 1)), '[^A-Z0-9]', '', 'g') AS first_token
+        FROM {table}
+    ) n
+    WHERE t.id = n.id AND t.normalized_code IS NULL
+"""
+
+CATALOG_SCHEMA_MIGRATIONS = [
+    # Sincronización delta (/api/paints/changes)
+    "ALTER TABLE paints ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+    "UPDATE paints SET updated_at = COALESCE(created_at, NOW()) WHERE updated_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS idx_paints_updated_at_id ON paints (updated_at, id)",
+    # Cursor por transacción y bajas de /api/paints/changes (trigger paints_track_change, ver models.py)
+    "ALTER TABLE paints ADD COLUMN IF NOT EXISTS change_txid BIGINT",
+    """CREATE TABLE IF NOT EXISTS deleted_paints (
+        paint_id INTEGER PRIMARY KEY,
+        deleted_txid BIGINT NOT NULL,
+        deleted_at TIMESTAMP NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_deleted_paints_txid_id ON deleted_paints (deleted_txid, paint_id)",
+    PAINT_CHANGE_TRACKING_SQL,
+    "UPDATE paints SET change_txid = txid_current() WHERE change_txid IS NULL",
+    "CREATE INDEX IF NOT EXISTS idx_paints_change_txid_id ON paints (change_txid, id)",
+    # Filtros de servidor en /api/paints
+    "CREATE INDEX IF NOT EXISTS idx_paints_brand_color_code ON paints (brand, color_code)",
+    "CREATE INDEX IF NOT EXISTS idx_paints_color_family ON paints (color_family)",
+    "CREATE INDEX IF NOT EXISTS idx_paints_sync_status ON paints (sync_status)",
+    # Expresión: /api/paints filtra y ordena por COALESCE(stock, 0). No se declara en models.py
+    "CREATE INDEX IF NOT EXISTS idx_paints_stock_id ON paints ((COALESCE(stock, 0)), id)",
+    # Filtros y paginación de /api/videos (y /user/videos por nivel)
+    "CREATE INDEX IF NOT EXISTS idx_videos_difficulty_level_id ON videos (difficulty_level, id)",
+    "CREATE INDEX IF NOT EXISTS idx_videos_category_id_id ON videos (category_id, id)",
+    # Búsqueda full-text y por trigramas (/api/paints/search, /api/paint-images/search).
+    # No se declaran en models.py: dependen de la extensión pg_trgm y de una expresión.
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS idx_paints_search_tsv ON paints USING GIN (({PAINT_SEARCH_VECTOR_SQL}))",
+    "CREATE INDEX IF NOT EXISTS idx_paints_color_code_trgm ON paints USING GIN (color_code gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_paints_name_trgm ON paints USING GIN (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_paint_images_codigo_trgm ON paint_images USING GIN (codigo gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_paint_images_nombre_trgm ON paint_images USING GIN (nombre gin_trgm_ops)",
+    # Código normalizado (models.normalize_paint_code): '70.950' y '70950' son el mismo código
+    "ALTER TABLE paints ADD COLUMN IF NOT EXISTS normalized_code TEXT",
+    "ALTER TABLE paint_images ADD COLUMN IF NOT EXISTS normalized_code VARCHAR(50)",
+    NORMALIZED_CODE_BACKFILL_SQL.format(table='paints', code='color_code', brand='brand'),
+    NORMALIZED_CODE_BACKFILL_SQL.format(table='paint_images', code='codigo', brand='marca'),
+    "CREATE INDEX IF NOT EXISTS idx_paints_normalized_code_brand ON paints (normalized_code, brand)",
+    "CREATE INDEX IF NOT EXISTS idx_paint_images_normalized_code_marca ON paint_images (normalized_code, marca)",
+    # Equivalencias entre marcas (/api/paints/<id>/equivalents)
+    """CREATE TABLE IF NOT EXISTS paint_equivalents (
+        paint_id INTEGER NOT NULL REFERENCES paints (id) ON DELETE CASCADE,
+        equivalent_brand VARCHAR(100) NOT NULL,
+        rank SMALLINT NOT NULL,
+        equivalent_id INTEGER NOT NULL,
+        distance DOUBLE PRECISION NOT NULL,
+        computed_at TIMESTAMP,
+        PRIMARY KEY (paint_id, equivalent_brand, rank)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_paint_equivalents_equivalent_id ON paint_equivalents (equivalent_id)",
+    # Upsert de catálogos (POST /admin/paints/import): falla si hay pinturas duplicadas por (brand, color_code),
+    # ver la consulta de duplicados en catalog_schema_migration.sql
+    """DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'unique_brand_code') THEN
+            ALTER TABLE paints ADD CONSTRAINT unique_brand_code UNIQUE (brand, color_code);
+        END IF;
+    END $$""",
+    # Cola de notificaciones persistente (/api/web-notify/*, /api/android-notify/*)
+    """CREATE TABLE IF NOT EXISTS notification_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        channel VARCHAR(20) NOT NULL,
+        paint_id INTEGER,
+        payload JSONB NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+        delivered_at TIMESTAMP,
+        acked_at TIMESTAMP
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_notification_outbox_channel_id ON notification_outbox (channel, id)",
+    "CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending ON notification_outbox (channel, id) WHERE acked_at IS NULL",
+    # Cursor confirmado por dispositivo Android (/api/android-notify/poll)
+    """CREATE TABLE IF NOT EXISTS notification_device_cursors (
+        device_id VARCHAR(100) PRIMARY KEY,
+        last_acked_id BIGINT NOT NULL DEFAULT 0,
+        last_seen_at TIMESTAMP
+    )""",
+    "ALTER TABLE notification_device_cursors ADD COLUMN IF NOT EXISTS needs_resync BOOLEAN NOT NULL DEFAULT FALSE",
+]
+
+@app.route('/admin/migrate-catalog-schema', methods=['POST'])
+@admin_required
+def migrate_catalog_schema():
+    """
+    Aplicar las migraciones de esquema del catálogo de pinturas (idempotente)
+    Solo accesible por administradores
+    """
+    try:
+        from sqlalchemy import text
+        print(f"🔧 [SCHEMA] Applying {len(CATALOG_SCHEMA_MIGRATIONS)} catalog schema statements...")
+
+        for statement in CATALOG_SCHEMA_MIGRATIONS:
+            print(f"🔧 [SCHEMA] {statement.strip().splitlines()[0][:100]}")
+            db.session.execute(text(statement))
+        db.session.commit()
+        # SQL directo: los eventos del ORM no lo detectan
+        invalidate_catalog('catalog schema migration')
+        # La migración instala pg_trgm: volver a comprobarlo en la próxima búsqueda
+        paint_search_state['trigram_available'] = None
+
+        print("✅ [SCHEMA] Catalog schema is up to date")
+
+        return jsonify({
+            'success': True,
+            'applied_statements': len(CATALOG_SCHEMA_MIGRATIONS),
+            'message': 'Esquema del catálogo actualizado correctamente'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ [SCHEMA ERROR] {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error aplicando migraciones: {str(e)}'
+        }), 500
+
 @app.route('/admin/migrate-shelf-positions', methods=['POST'])
 @admin_required
 def migrate_shelf_positions():
@@ -4209,7 +6246,7 @@ def migrate_shelf_positions():
                 # Buscar pinturas VALLEJO con este color_code
                 paints = Paint.query.filter(
                     Paint.brand == 'VALLEJO',
-                    Paint.color_code == color_code
+                    code_matches(Paint.color_code, Paint.normalized_code, color_code, 'VALLEJO')
                 ).all()
                 
                 if paints:
@@ -4289,36 +6326,100 @@ def debug_paint_count_by_brand():
 
 # ==================== SISTEMA DE NOTIFICACIONES WEB → ANDROID ====================
 
-# Variables globales para mantener notificaciones pendientes para Android
-if not hasattr(app, 'pending_android_notifications'):
-    app.pending_android_notifications = []
-if not hasattr(app, 'sent_notification_ids'):
-    app.sent_notification_ids = set()
+# Cambios de stock aún no entregados de la misma pintura se fusionan en un solo evento
+STOCK_NOTIFICATION_ACTIONS = ('stock_updated', 'stock_bulk_updated')
+STOCK_COALESCE_WINDOW_SECONDS = 120
+
+def stock_changes_of(paint_id, action, data):
+    """Cambios de stock [{paint_id, old_stock, new_stock, ...}] de una notificación"""
+    if action == 'stock_bulk_updated':
+        return data.get('changes') or []
+    return [{**data, 'paint_id': data.get('paint_id', paint_id)}]
+
+# Pinturas de una fila de notification_outbox: paint_id y las de data.changes (stock_bulk_updated)
+OUTBOX_ROW_PAINT_IDS_SQL = """
+    SELECT notification_outbox.paint_id
+    UNION ALL
+    SELECT (change->>'paint_id')::int
+    FROM jsonb_array_elements(COALESCE(notification_outbox.payload->'data'->'changes', '[]'::jsonb)) AS change
+"""
+
+def coalesce_stock_notification(paint_id, action, data):
+    """
+    Fusionar con las notificaciones de stock pendientes (sin entregar, dentro de la ventana)
+    que tocan las mismas pinturas: de cada pintura se queda el primer old_stock y el último
+    new_stock. Las absorbidas se borran en la misma transacción.
+    No se fusiona por encima de otra notificación posterior de esas pinturas (p. ej. paint_deleted),
+    para no cambiar el orden en que llegan. Devuelve (paint_id, action, data), o None si el
+    resultado no cambia ningún stock (5 → 6 → 5)
+    """
+    changes = stock_changes_of(paint_id, action, data)
+    touched = sorted({change.get('paint_id') for change in changes if change.get('paint_id') is not None})
+    if not touched:
+        return paint_id, action, data
+    stock_actions = NotificationOutbox.payload['action'].astext.in_(STOCK_NOTIFICATION_ACTIONS)
+    # Solo se bloquean las candidatas (SKIP LOCKED: las que get-notifications está entregando no se tocan)
+    pending = NotificationOutbox.query.filter(
+        NotificationOutbox.channel == 'android',
+        NotificationOutbox.acked_at.is_(None),
+        NotificationOutbox.delivered_at.is_(None),
+        NotificationOutbox.created_at > datetime.utcnow() - timedelta(seconds=STOCK_COALESCE_WINDOW_SECONDS),
+        stock_actions,
+        text(f"""
+            EXISTS (SELECT 1 FROM ({OUTBOX_ROW_PAINT_IDS_SQL}) AS row_paints (paint_id)
+                    WHERE row_paints.paint_id = ANY(:touched))
+            AND NOT EXISTS (
+                SELECT 1 FROM notification_outbox later
+                WHERE later.channel = 'android' AND later.id > notification_outbox.id
+                  AND later.payload->>'action' NOT IN :stock_actions
+                  AND (later.paint_id IS NULL OR later.paint_id IN ({OUTBOX_ROW_PAINT_IDS_SQL}))
+            )
+        """).bindparams(touched=touched, stock_actions=tuple(STOCK_NOTIFICATION_ACTIONS))
+    ).order_by(NotificationOutbox.id).with_for_update(skip_locked=True).all()
+    if not pending:
+        return paint_id, action, data
+
+    merged = {}  # paint_id -> cambio fusionado, en orden de primera aparición
+    for row in pending:
+        for change in stock_changes_of(row.paint_id, row.payload['action'], row.payload.get('data') or {}):
+            merge_stock_change(merged, change)
+    for change in changes:
+        merge_stock_change(merged, change)
+    for row in pending:
+        db.session.delete(row)
+    coalesced = sum((row.payload.get('data') or {}).get('coalesced', 1) for row in pending) + 1
+    # Pinturas que han vuelto al stock inicial: no hay nada que notificar
+    merged = {key: change for key, change in merged.items() if change.get('old_stock') != change.get('new_stock')}
+    print(f"🔗 Coalesced {len(pending)} pending stock notifications ({len(merged)} paints changed)")
+
+    if not merged:
+        return None
+    if len(merged) == 1:
+        change = next(iter(merged.values()))
+        return change['paint_id'], 'stock_updated', {**change, 'coalesced': coalesced}
+    return None, 'stock_bulk_updated', {
+        'changes': list(merged.values()),
+        'count': len(merged),
+        'source': data.get('source'),
+        'coalesced': coalesced
+    }
+
+def merge_stock_change(merged, change):
+    previous = merged.get(change.get('paint_id'))
+    merged[change.get('paint_id')] = {**change, 'old_stock': previous['old_stock']} if previous else dict(change)
 
 def send_android_notification(paint_id, action, data):
     """
-    Función para enviar notificaciones a Android
+    Función para enviar notificaciones a Android.
+    La notificación se guarda con el commit del cambio que la origina; al insertarla, los
+    cambios de stock se fusionan con los pendientes de las mismas pinturas
     """
     try:
-        import uuid
-        notification_id = str(uuid.uuid4())
-        
-        notification = {
-            'id': notification_id,
+        enqueue_notification('android', paint_id, {
             'type': 'paint_update',
             'action': action,
-            'paint_id': paint_id,
-            'timestamp': datetime.utcnow().isoformat(),
-            'data': data,
-            'sent': False
-        }
-        
-        app.pending_android_notifications.append(notification)
-        
-        # Mantener solo las últimas 100 notificaciones
-        if len(app.pending_android_notifications) > 100:
-            app.pending_android_notifications = app.pending_android_notifications[-100:]
-        
+            'data': data
+        })
         return True
     except Exception as e:
         print(f"❌ Error sending Android notification: {str(e)}")
@@ -4328,109 +6429,184 @@ def send_android_notification(paint_id, action, data):
 def get_android_notifications():
     """
     Endpoint para que Android obtenga las notificaciones pendientes
-    Solo retorna notificaciones que no han sido enviadas previamente
+    Solo retorna notificaciones no entregadas, o entregadas hace más de 2 minutos sin confirmar;
+    se confirman con /api/android-notify/confirm-processed
     """
     try:
-        if not hasattr(app, 'pending_android_notifications'):
-            app.pending_android_notifications = []
-        if not hasattr(app, 'sent_notification_ids'):
-            app.sent_notification_ids = set()
-        
-        # Limpiar notificaciones antiguas (más de 5 minutos) y IDs de enviados antiguos
-        current_time = datetime.utcnow()
-        valid_notifications = []
-        valid_sent_ids = set()
-        
-        for notif in app.pending_android_notifications:
-            try:
-                # Manejar diferentes formatos de timestamp
-                timestamp_str = notif['timestamp'].replace('Z', '+00:00').replace('+00:00', '')
-                notif_time = datetime.fromisoformat(timestamp_str)
-                time_diff = (current_time - notif_time).total_seconds()
-                
-                # 🔧 MEJORADO: Limpiar notificaciones que han estado demasiado tiempo sin confirmación
-                # Si una notificación tiene delivered_at pero no se ha confirmado en 2 minutos, permitir reenvío
-                delivered_at = notif.get('delivered_at')
-                if delivered_at and not notif.get('sent', False):
-                    try:
-                        delivered_time = datetime.fromisoformat(delivered_at.replace('Z', '+00:00').replace('+00:00', ''))
-                        delivery_diff = (current_time - delivered_time).total_seconds()
-                        if delivery_diff > 120:  # 2 minutos desde entrega
-                            print(f"🔄 Reactivating unconfirmed notification {notif.get('id')} (delivered {delivery_diff:.1f}s ago)")
-                            # Remover metadata de entrega para permitir reenvío
-                            if 'delivered_at' in notif:
-                                del notif['delivered_at']
-                    except Exception:
-                        pass
-                
-                if time_diff < 300:  # Menor a 5 minutos
-                    valid_notifications.append(notif)
-                    if notif.get('sent', False):
-                        valid_sent_ids.add(notif.get('id'))
-                else:
-                    print(f"🗑️ Removing old notification {notif.get('id')} (age: {time_diff:.1f}s)")
-            except Exception as parse_error:
-                print(f"⚠️ Error parsing notification timestamp: {parse_error}")
-                # Mantener notificación si no se puede parsear timestamp (asumir reciente)
-                valid_notifications.append(notif)
-        
-        app.pending_android_notifications = valid_notifications
-        app.sent_notification_ids = valid_sent_ids
-        
-        # Obtener solo notificaciones no enviadas (incluye las que tienen delivered_at pero no están confirmadas)
-        new_notifications = [
-            notif for notif in app.pending_android_notifications 
-            if not notif.get('sent', False) and notif.get('id') not in app.sent_notification_ids and not notif.get('delivered_at')
-        ]
-        
-        # 🔧 FIX: NO marcar como enviadas inmediatamente
-        # Las notificaciones solo se marcarán como enviadas cuando Android confirme que las procesó
-        # mediante el endpoint /api/android-notify/confirm-processed
+        now = datetime.utcnow()
+        rows = db.session.execute(text("""
+            UPDATE notification_outbox SET delivered_at = :now
+            WHERE id IN (
+                SELECT id FROM notification_outbox
+                WHERE channel = 'android' AND acked_at IS NULL
+                  AND created_at > :expired_before
+                  AND (delivered_at IS NULL OR delivered_at < :redeliver_before)
+                ORDER BY id
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, paint_id, payload, created_at, delivered_at, acked_at
+        """), {
+            'now': now,
+            'expired_before': now - timedelta(seconds=ANDROID_NOTIFICATION_TTL),
+            'redeliver_before': now - timedelta(seconds=ANDROID_REDELIVERY_SECONDS),
+            'limit': parse_notification_limit()
+        }).fetchall()
+        prune_notification_outbox()
+        db.session.commit()
         
-        # Crear copias de las notificaciones para enviar (sin modificar las originales)
-        notifications_to_send = []
-        for notif in new_notifications:
-            notification_copy = notif.copy()
-            # Agregar metadata de envío para tracking temporal
-            notification_copy['delivered_at'] = datetime.utcnow().isoformat()
-            notifications_to_send.append(notification_copy)
+        notifications_to_send = [android_notification_to_dict(row) for row in sorted(rows, key=lambda row: row.id)]
+        total_pending, _ = notification_counts('android')
         
-        print(f"📤 Sending {len(notifications_to_send)} new notifications to Android (total pending: {len(app.pending_android_notifications)})")
+        print(f"📤 Sending {len(notifications_to_send)} new notifications to Android (total pending: {total_pending})")
         
         return jsonify({
             'success': True,
             'notifications': notifications_to_send,
             'count': len(notifications_to_send),
-            'total_pending': len(app.pending_android_notifications),
+            'total_pending': total_pending,
             'timestamp': datetime.utcnow().isoformat()
         })
         
     except Exception as e:
+        db.session.rollback()
         print(f"❌ Error getting Android notifications: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
+# Long-poll por dispositivo: cada tablet guarda su propio cursor (último id de notificación
+# procesado), así varias pueden consumir las mismas notificaciones sin quitárselas entre sí.
+# needs_resync: el dispositivo es nuevo (o se olvidó su cursor) o se borraron notificaciones que
+# no había recibido; debe recargar el catálogo entero. Se limpia cuando confirma (ack)
+ANDROID_POLL_DEFAULT_TIMEOUT = 25
+ANDROID_POLL_MAX_TIMEOUT = 60
+ANDROID_POLL_CHECK_SECONDS = 3  # Sin el hilo LISTEN (p. ej. SQLite): lectura por rango como mucho cada 3 s
+DEVICE_ID_MAX_LENGTH = 100
+
+def get_device_id(data=None):
+    device_id = ((data or {}).get('device_id') or request.args.get('device_id')
+                 or request.headers.get('X-Device-ID') or '')
+    device_id = str(device_id).strip()
+    if not device_id or len(device_id) > DEVICE_ID_MAX_LENGTH:
+        raise ValueError(f'device_id is required (max {DEVICE_ID_MAX_LENGTH} characters)')
+    return device_id
+
+def advance_device_cursor(device_id, ack=None):
+    """
+    Registrar el dispositivo y avanzar su cursor hasta ack (nunca retrocede).
+    Devuelve (cursor, needs_resync). Un dispositivo nuevo empieza en la última notificación
+    existente (solo recibe las nuevas) y con needs_resync
+    """
+    row = db.session.execute(text("""
+        INSERT INTO notification_device_cursors (device_id, last_acked_id, last_seen_at, needs_resync)
+        VALUES (:device_id,
+                COALESCE(:ack, (SELECT max(id) FROM notification_outbox WHERE channel = 'android'), 0),
+                :now, TRUE)
+        ON CONFLICT (device_id) DO UPDATE
+        SET last_acked_id = GREATEST(notification_device_cursors.last_acked_id, COALESCE(:ack, 0)),
+            last_seen_at = EXCLUDED.last_seen_at,
+            needs_resync = notification_device_cursors.needs_resync AND :ack IS NULL
+        RETURNING last_acked_id, needs_resync
+    """), {'device_id': device_id, 'ack': ack, 'now': datetime.utcnow()}).first()
+    return row.last_acked_id, row.needs_resync
+
+@app.route('/api/android-notify/poll', methods=['GET'])
+def poll_android_notifications():
+    """
+    Long-poll de notificaciones para un dispositivo (device_id o cabecera X-Device-ID).
+    Devuelve en cuanto hay notificaciones posteriores a su cursor, o vacío tras timeout segundos.
+    ?ack=<id> confirma hasta ese id antes de esperar (equivale a /api/android-notify/ack).
+    Lo no confirmado se vuelve a entregar en la siguiente llamada.
+    Con resync: true el dispositivo debe recargar el catálogo entero antes de confirmar
+    """
+    try:
+        device_id = get_device_id()
+        ack = int(request.args['ack']) if request.args.get('ack') else None
+        timeout = float(request.args.get('timeout', ANDROID_POLL_DEFAULT_TIMEOUT))
+    except ValueError as ve:
+        return jsonify({'success': False, 'message': str(ve)}), 400
+    timeout = max(0.0, min(timeout, ANDROID_POLL_MAX_TIMEOUT))
+    limit = parse_notification_limit()
+
+    try:
+        cursor, needs_resync = advance_device_cursor(device_id, ack)
+        db.session.commit()
+
+        deadline = time.time() + timeout
+        while True:
+            generation = notification_generations['android']
+            rows = NotificationOutbox.query.filter(
+                NotificationOutbox.channel == 'android',
+                NotificationOutbox.id > cursor
+            ).order_by(NotificationOutbox.id).limit(limit).all()
+            notifications = [android_notification_to_dict(row) for row in rows]
+            # Devolver la conexión al pool mientras se espera
+            db.session.remove()
+            remaining = deadline - time.time()
+            if notifications or needs_resync or remaining <= 0:
+                break
+            wait_for_notifications('android', generation,
+                                   remaining if ensure_notification_listener() else min(ANDROID_POLL_CHECK_SECONDS, remaining))
+
+        if notifications:
+            print(f"📤 Long-poll: {len(notifications)} notifications for device {device_id} (cursor {cursor})")
+        return jsonify({
+            'success': True,
+            'device_id': device_id,
+            'notifications': notifications,
+            'count': len(notifications),
+            'cursor': cursor,
+            'next_cursor': int(notifications[-1]['id']) if notifications else cursor,
+            'resync': needs_resync,
+            'timestamp': datetime.utcnow().isoformat()
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error in Android long-poll: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+@app.route('/api/android-notify/ack', methods=['POST'])
+def ack_android_notifications():
+    """Confirmar las notificaciones de un dispositivo hasta el id cursor (incluido)"""
+    data = request.get_json() or {}
+    try:
+        device_id = get_device_id(data)
+    except ValueError as ve:
+        return jsonify({'success': False, 'message': str(ve)}), 400
+    try:
+        ack = int(data.get('cursor'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'cursor must be a notification id'}), 400
+
+    try:
+        cursor, needs_resync = advance_device_cursor(device_id, ack)
+        db.session.commit()
+        return jsonify({
+            'success': True,
+            'device_id': device_id,
+            'cursor': cursor,
+            'timestamp': datetime.utcnow().isoformat()
+        })
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error acknowledging Android notifications: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
 @app.route('/api/android-notify/status', methods=['GET'])
 def android_notification_status():
     """
     Endpoint para verificar el estado del sistema de notificaciones para Android
     """
     try:
-        if not hasattr(app, 'pending_android_notifications'):
-            app.pending_android_notifications = []
-        if not hasattr(app, 'sent_notification_ids'):
-            app.sent_notification_ids = set()
-        
         # Contar notificaciones por estado
-        sent_count = sum(1 for n in app.pending_android_notifications if n.get('sent', False))
-        unsent_count = len(app.pending_android_notifications) - sent_count
+        total_pending, delivered_count = notification_counts('android')
         
         return jsonify({
             'success': True,
             'status': 'active',
-            'total_pending': len(app.pending_android_notifications),
-            'sent_count': sent_count,
-            'unsent_count': unsent_count,
-            'sent_ids_tracked': len(app.sent_notification_ids),
+            'total_pending': total_pending,
+            'delivered_count': delivered_count,
+            'unsent_count': total_pending - delivered_count,
             'timestamp': datetime.utcnow().isoformat()
         })
         
@@ -4444,9 +6620,6 @@ def create_test_notification():
     ENDPOINT TEMPORAL - Crear notificación de testing para verificar que Android funciona
     """
     try:
-        if not hasattr(app, 'pending_android_notifications'):
-            app.pending_android_notifications = []
-        
         # Get Blanco Hueso data
         paint = Paint.query.filter_by(name='Blanco Hueso').first()
         if not paint:
@@ -4459,11 +6632,8 @@ def create_test_notification():
         old_stock = paint.stock
         new_stock = old_stock + 1
         
-        # Update stock
+        # Update stock and send notification in the same transaction
         paint.stock = new_stock
-        db.session.commit()
-        
-        # Send notification
         send_android_notification(paint.id, 'stock_updated', {
             'paint_id': paint.id,
             'paint_name': paint.name,
@@ -4473,20 +6643,23 @@ def create_test_notification():
             'new_stock': new_stock,
             'source': 'test_endpoint'
         })
+        db.session.commit()
         
         print(f"🧪 TEST: Created notification for {paint.name} stock {old_stock} → {new_stock}")
         
+        notification_count, _ = notification_counts('android')
         return jsonify({
             'success': True,
             'message': f'Test notification created for {paint.name}',
             'paint_name': paint.name,
             'old_stock': old_stock,
             'new_stock': new_stock,
-            'notification_count': len(app.pending_android_notifications),
+            'notification_count': notification_count,
             'timestamp': datetime.utcnow().isoformat()
         })
         
     except Exception as e:
+        db.session.rollback()
         print(f"❌ Error creating test notification: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
@@ -4497,103 +6670,98 @@ def confirm_notifications_processed():
     Acepta tanto processed_count como notification_ids para mayor flexibilidad
     """
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         processed_count = data.get('processed_count', 0)
         notification_ids = data.get('notification_ids', [])
+        now = datetime.utcnow()
+        removed_count = 0
         
-        if not hasattr(app, 'pending_android_notifications'):
-            app.pending_android_notifications = []
-        if not hasattr(app, 'sent_notification_ids'):
-            app.sent_notification_ids = set()
-        
-        initial_count = len(app.pending_android_notifications)
-        
-        # Método 1: Por IDs específicos (más preciso)
+        # Método 1: Por IDs específicos (más preciso); búsqueda por clave primaria
         if notification_ids:
-            # Primero marcar las notificaciones como enviadas antes de removerlas
-            for notif in app.pending_android_notifications:
-                if notif.get('id') in notification_ids:
-                    notif['sent'] = True
-                    notif['processed_at'] = datetime.utcnow().isoformat()
-                    if 'id' in notif:
-                        app.sent_notification_ids.add(notif['id'])
-            
-            # Luego remover las notificaciones confirmadas
-            app.pending_android_notifications = [
-                notif for notif in app.pending_android_notifications
-                if notif.get('id') not in notification_ids
-            ]
-            print(f"✅ Android confirmed processing {len(notification_ids)} notifications by ID")
-        
-        # Método 2: Por cantidad (compatibilidad con implementación anterior)
+            ids = [int(notification_id) for notification_id in notification_ids
+                   if str(notification_id).isdigit()]
+            if ids:
+                removed_count = NotificationOutbox.query.filter(
+                    NotificationOutbox.id.in_(ids),
+                    NotificationOutbox.channel == 'android',
+                    NotificationOutbox.acked_at.is_(None)
+                ).update({NotificationOutbox.acked_at: now}, synchronize_session=False)
+            print(f"✅ Android confirmed processing {removed_count} notifications by ID")
+        
+        # Método 2: Por cantidad (compatibilidad con implementación anterior):
+        # las primeras N entregadas y sin confirmar
         elif processed_count > 0:
-            # Remover las primeras N notificaciones enviadas
-            sent_notifications = [n for n in app.pending_android_notifications if n.get('sent', False)]
-            to_remove = sent_notifications[:processed_count]
-            
-            for notif in to_remove:
-                if notif in app.pending_android_notifications:
-                    app.pending_android_notifications.remove(notif)
-                if 'id' in notif:
-                    app.sent_notification_ids.discard(notif['id'])
-            
-            print(f"✅ Android confirmed processing {processed_count} notifications by count")
+            removed_count = db.session.execute(text("""
+                UPDATE notification_outbox SET acked_at = :now
+                WHERE id IN (
+                    SELECT id FROM notification_outbox
+                    WHERE channel = 'android' AND acked_at IS NULL AND delivered_at IS NOT NULL
+                    ORDER BY id
+                    LIMIT :limit
+                )
+            """), {'now': now, 'limit': int(processed_count)}).rowcount
+            print(f"✅ Android confirmed processing {removed_count} notifications by count")
         
-        removed_count = initial_count - len(app.pending_android_notifications)
+        db.session.commit()
+        remaining_count, _ = notification_counts('android')
         
         return jsonify({
             'success': True,
-            'remaining_count': len(app.pending_android_notifications),
+            'remaining_count': remaining_count,
             'removed_count': removed_count,
             'timestamp': datetime.utcnow().isoformat()
         })
         
     except Exception as e:
+        db.session.rollback()
         print(f"❌ Error confirming processed notifications: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
 @app.route('/api/android-notify/debug', methods=['GET'])
 def debug_android_notifications():
     """
-    Endpoint de debugging para inspeccionar el estado completo de las notificaciones
+    Endpoint de debugging para inspeccionar el estado de las notificaciones (las 100 más recientes)
     """
     try:
-        if not hasattr(app, 'pending_android_notifications'):
-            app.pending_android_notifications = []
-        if not hasattr(app, 'sent_notification_ids'):
-            app.sent_notification_ids = set()
-        
         # Analizar estado de las notificaciones
-        total_count = len(app.pending_android_notifications)
-        sent_count = sum(1 for n in app.pending_android_notifications if n.get('sent', False))
-        delivered_count = sum(1 for n in app.pending_android_notifications if n.get('delivered_at'))
-        unsent_count = total_count - sent_count
+        summary = db.session.execute(text("""
+            SELECT count(*) AS total,
+                   count(*) FILTER (WHERE acked_at IS NOT NULL) AS sent,
+                   count(*) FILTER (WHERE delivered_at IS NOT NULL) AS delivered
+            FROM notification_outbox
+            WHERE channel = 'android'
+        """)).first()
         
         # Detalles de cada notificación
-        notification_details = []
-        for notif in app.pending_android_notifications:
-            notification_details.append({
-                'id': notif.get('id'),
-                'action': notif.get('action'),
-                'paint_id': notif.get('paint_id'),
-                'timestamp': notif.get('timestamp'),
-                'sent': notif.get('sent', False),
-                'delivered_at': notif.get('delivered_at'),
-                'processed_at': notif.get('processed_at'),
-                'source': notif.get('data', {}).get('source')
-            })
+        rows = NotificationOutbox.query.filter(
+            NotificationOutbox.channel == 'android'
+        ).order_by(NotificationOutbox.id.desc()).limit(NOTIFICATION_BATCH_LIMIT).all()
+        notification_details = [{
+            'id': str(row.id),
+            'action': row.payload.get('action'),
+            'paint_id': row.paint_id,
+            'timestamp': row.created_at.isoformat(),
+            'sent': row.acked_at is not None,
+            'delivered_at': row.delivered_at.isoformat() if row.delivered_at else None,
+            'processed_at': row.acked_at.isoformat() if row.acked_at else None,
+            'source': (row.payload.get('data') or {}).get('source')
+        } for row in rows]
         
         return jsonify({
             'success': True,
             'summary': {
-                'total_notifications': total_count,
-                'sent_count': sent_count,
-                'unsent_count': unsent_count,
-                'delivered_count': delivered_count,
-                'sent_ids_tracked': len(app.sent_notification_ids)
+                'total_notifications': summary.total,
+                'sent_count': summary.sent,
+                'unsent_count': summary.total - summary.sent,
+                'delivered_count': summary.delivered
             },
             'notifications': notification_details,
-            'sent_ids': list(app.sent_notification_ids),
+            'devices': [{
+                'device_id': device.device_id,
+                'cursor': device.last_acked_id,
+                'needs_resync': device.needs_resync,
+                'last_seen_at': device.last_seen_at.isoformat() if device.last_seen_at else None
+            } for device in NotificationDeviceCursor.query.order_by(NotificationDeviceCursor.device_id).all()],
             'timestamp': datetime.utcnow().isoformat()
         })
         
@@ -4607,56 +6775,35 @@ def clear_android_notifications():
     Endpoint para limpiar manualmente las notificaciones (útil para debugging)
     """
     try:
-        if not hasattr(app, 'pending_android_notifications'):
-            app.pending_android_notifications = []
-        if not hasattr(app, 'sent_notification_ids'):
-            app.sent_notification_ids = set()
-        
         data = request.get_json() or {}
         clear_type = data.get('type', 'all')  # 'all', 'sent', 'old'
         
-        initial_count = len(app.pending_android_notifications)
-        initial_sent_ids = len(app.sent_notification_ids)
-        
-        if clear_type == 'all':
-            app.pending_android_notifications = []
-            app.sent_notification_ids = set()
-            print("🧹 Cleared all Android notifications")
-        
-        elif clear_type == 'sent':
-            app.pending_android_notifications = [
-                notif for notif in app.pending_android_notifications 
-                if not notif.get('sent', False)
-            ]
-            app.sent_notification_ids = set()
-            print("🧹 Cleared sent Android notifications")
-        
+        query = NotificationOutbox.query.filter(NotificationOutbox.channel == 'android')
+        if clear_type == 'sent':
+            query = query.filter(NotificationOutbox.acked_at.isnot(None))
         elif clear_type == 'old':
-            current_time = datetime.utcnow()
-            app.pending_android_notifications = [
-                notif for notif in app.pending_android_notifications
-                if (current_time - datetime.fromisoformat(notif['timestamp'].replace('Z', '+00:00').replace('+00:00', ''))).total_seconds() < 60
-            ]
-            print("🧹 Cleared old Android notifications (>1 minute)")
+            query = query.filter(NotificationOutbox.created_at < datetime.utcnow() - timedelta(minutes=1))
+        
+        removed = query.delete(synchronize_session=False)
+        db.session.commit()
+        print(f"🧹 Cleared {removed} Android notifications ({clear_type})")
         
-        final_count = len(app.pending_android_notifications)
-        final_sent_ids = len(app.sent_notification_ids)
+        remaining = NotificationOutbox.query.filter(NotificationOutbox.channel == 'android').count()
         
         return jsonify({
             'success': True,
             'type': clear_type,
             'removed': {
-                'notifications': initial_count - final_count,
-                'sent_ids': initial_sent_ids - final_sent_ids
+                'notifications': removed
             },
             'remaining': {
-                'notifications': final_count,
-                'sent_ids': final_sent_ids
+                'notifications': remaining
             },
             'timestamp': datetime.utcnow().isoformat()
         })
         
     except Exception as e:
+        db.session.rollback()
         print(f"❌ Error clearing Android notifications: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
@@ -4708,7 +6855,6 @@ def update_image_url_batch():
             return jsonify({"success": False, "message": "Invalid or missing API key"}), 401
         
         data = request.get_json()
-        print(f"🖼️ [BATCH UPDATE] Request data: {data}")
         
         if not data:
             print(f"❌ [BATCH UPDATE] No data provided")
@@ -4718,78 +6864,89 @@ def update_image_url_batch():
         if not updates:
             print(f"❌ [BATCH UPDATE] No updates array provided")
             return jsonify({"success": False, "message": "updates array is required"}), 400
+        print(f"🖼️ [BATCH UPDATE] {len(updates)} updates received")
         
-        updated_count = 0
-        failed_count = 0
-        results = []
+        from sqlalchemy import text
         
-        for update in updates:
+        # 1) Validación de todas las entradas (sin tocar la base de datos)
+        results = [None] * len(updates)
+        valid = {}  # paint_id -> posición en updates (si se repite, gana la última)
+        for position, update in enumerate(updates):
+            if not isinstance(update, dict):
+                results[position] = {'paint_id': None, 'color_code': 'Unknown', 'success': False,
+                                     'error': 'Each update must be an object'}
+                continue
             paint_id = update.get('paint_id')
             image_url = update.get('image_url')
             color_code = update.get('color_code', 'Unknown')
-            
-            try:
-                if not paint_id or not image_url:
-                    results.append({
-                        'paint_id': paint_id,
-                        'color_code': color_code,
-                        'success': False,
-                        'error': 'paint_id and image_url are required'
-                    })
-                    failed_count += 1
-                    continue
-                
-                # Validar URL
-                if not (image_url.startswith('http://') or image_url.startswith('https://')):
-                    results.append({
-                        'paint_id': paint_id,
-                        'color_code': color_code,
-                        'success': False,
-                        'error': 'Invalid URL format'
-                    })
-                    failed_count += 1
-                    continue
-                
-                # Buscar la pintura
-                paint = Paint.query.get(paint_id)
-                if not paint:
-                    results.append({
-                        'paint_id': paint_id,
-                        'color_code': color_code,
-                        'success': False,
-                        'error': f'Paint with id {paint_id} not found'
-                    })
-                    failed_count += 1
-                    continue
-                
-                # Actualizar image_url
-                old_url = paint.image_url
-                paint.image_url = image_url
-                
-                print(f"🖼️ [BATCH UPDATE] Updating paint {paint_id} ({paint.color_code}): {old_url} -> {image_url}")
-                
-                db.session.commit()
-                
-                results.append({
+            error = None
+            if not paint_id or not image_url:
+                error = 'paint_id and image_url are required'
+            elif not isinstance(image_url, str):
+                error = 'image_url must be a string'
+            elif not (image_url.startswith('http://') or image_url.startswith('https://')):
+                error = 'Invalid URL format'
+            else:
+                try:
+                    paint_id = int(paint_id)
+                except (TypeError, ValueError):
+                    error = 'paint_id must be an integer'
+            if error:
+                results[position] = {'paint_id': paint_id, 'color_code': color_code, 'success': False, 'error': error}
+                continue
+            if paint_id in valid:
+                previous = valid[paint_id]
+                results[previous] = {
+                    'paint_id': paint_id,
+                    'color_code': updates[previous].get('color_code', 'Unknown'),
+                    'success': False,
+                    'error': 'Duplicate paint_id in batch (the last entry is applied)'
+                }
+            valid[paint_id] = position
+        
+        # 2) Un solo UPDATE ... FROM (VALUES ...) en una transacción; RETURNING da el resultado por pintura
+        updated_rows = {}
+        if valid:
+            params = {}
+            values = []
+            for number, (paint_id, position) in enumerate(valid.items()):
+                params[f'id_{number}'] = paint_id
+                params[f'url_{number}'] = updates[position]['image_url']
+                values.append(f"(CAST(:id_{number} AS INTEGER), CAST(:url_{number} AS TEXT))")
+            rows = db.session.execute(text(f"""
+                UPDATE paints p
+                SET image_url = v.url, updated_at = {UTC_NOW_SQL}
+                FROM (VALUES {', '.join(values)}) AS v (id, url)
+                JOIN paints old ON old.id = v.id
+                WHERE p.id = v.id
+                RETURNING p.id, p.color_code, old.image_url AS old_url, p.image_url AS new_url
+            """), params).fetchall()
+            db.session.commit()
+            updated_rows = {row.id: row for row in rows}
+            if updated_rows:
+                # SQL directo: los eventos del ORM no lo detectan
+                invalidate_catalog('image url batch', paint_ids=list(updated_rows))
+        
+        for paint_id, position in valid.items():
+            row = updated_rows.get(paint_id)
+            if row:
+                results[position] = {
                     'paint_id': paint_id,
-                    'color_code': paint.color_code,
+                    'color_code': row.color_code,
                     'success': True,
-                    'old_url': old_url,
-                    'new_url': image_url
-                })
-                updated_count += 1
-                
-            except Exception as e:
-                print(f"❌ [BATCH UPDATE] Error updating paint {paint_id}: {str(e)}")
-                results.append({
+                    'old_url': row.old_url,
+                    'new_url': row.new_url
+                }
+            else:
+                results[position] = {
                     'paint_id': paint_id,
-                    'color_code': color_code,
+                    'color_code': updates[position].get('color_code', 'Unknown'),
                     'success': False,
-                    'error': str(e)
-                })
-                failed_count += 1
-                # Rollback en caso de error
-                db.session.rollback()
+                    'error': f'Paint with id {paint_id} not found'
+                }
+        
+        updated_count = len(updated_rows)
+        failed_count = len(results) - updated_count
         
         print(f"✅ [BATCH UPDATE] Completed: {updated_count} updated, {failed_count} failed")
         
@@ -4916,8 +7073,7 @@ def receive_feedback():
         
         print(f"🚨 === END FEEDBACK ANALYSIS ===\n")
         
-        # Almacenar feedback para consulta posterior
-        global recent_feedbacks
+        # Almacenar feedback para consulta posterior (compartido entre workers)
         feedback_summary = {
             'timestamp': datetime.now().isoformat(),
             'paint_code': paint_code,
@@ -4934,11 +7090,8 @@ def receive_feedback():
             'search_results': search_results[:3] if search_results else [],  # Solo primeros 3
             'scraping_logs': scraping_logs[-5:] if scraping_logs else []  # Últimos 5
         }
-        recent_feedbacks.append(feedback_summary)
-        
         # Mantener solo los últimos 50 feedbacks
-        if len(recent_feedbacks) > 50:
-            recent_feedbacks = recent_feedbacks[-50:]
+        shared_state.list_push(RECENT_FEEDBACKS_KEY, json.dumps(feedback_summary).encode('utf-8'), RECENT_FEEDBACKS_MAX)
         
         # Respuesta exitosa
         response_data = {
@@ -5035,19 +7188,20 @@ def check_brand_code_constraint():
             'message': f'Error verificando constraint: {str(e)}'
         }), 500
 
-# Variable global para almacenar los últimos feedbacks recibidos
-recent_feedbacks = []
+# Últimos feedbacks recibidos (lista en el estado compartido, visible desde todos los workers)
+RECENT_FEEDBACKS_KEY = 'feedback:recent'
+RECENT_FEEDBACKS_MAX = 50
 
 @app.route('/admin/feedback-history', methods=['GET'])
 def get_feedback_history():
     """Consultar los últimos feedbacks recibidos"""
     try:
-        global recent_feedbacks
+        recent_feedbacks = [json.loads(item) for item in shared_state.list_range(RECENT_FEEDBACKS_KEY, 10)]
         
         return jsonify({
             'success': True,
-            'total_feedbacks': len(recent_feedbacks),
-            'feedbacks': recent_feedbacks[-10:],  # Últimos 10 feedbacks
+            'total_feedbacks': shared_state.list_length(RECENT_FEEDBACKS_KEY),
+            'feedbacks': recent_feedbacks,  # Últimos 10 feedbacks
         }), 200
         
     except Exception as e:
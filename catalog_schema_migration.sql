@@ -0,0 +1,180 @@
+-- Migraciones de esquema del catálogo de pinturas (tabla paints y tablas auxiliares)
+-- Para ejecutar en Railway PostgreSQL Console o pgAdmin.
+-- También se aplican con POST /admin/migrate-catalog-schema (mismas sentencias, idempotentes).
+
+-- 1. Sincronización delta: columna updated_at + índice (updated_at, id) para /api/paints/changes
+ALTER TABLE paints ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+
+UPDATE paints
+SET updated_at = COALESCE(created_at, NOW())
+WHERE updated_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_paints_updated_at_id ON paints (updated_at, id);
+
+-- Verificar
+SELECT column_name, data_type, is_nullable
+FROM information_schema.columns
+WHERE table_name = 'paints' AND column_name = 'updated_at';
+
+-- 2. Filtros de servidor en /api/paints (brand, color_family, sync_status, stock)
+CREATE INDEX IF NOT EXISTS idx_paints_brand_color_code ON paints (brand, color_code);
+CREATE INDEX IF NOT EXISTS idx_paints_color_family ON paints (color_family);
+CREATE INDEX IF NOT EXISTS idx_paints_sync_status ON paints (sync_status);
+-- Índice de expresión: la API filtra y ordena por COALESCE(stock, 0)
+CREATE INDEX IF NOT EXISTS idx_paints_stock_id ON paints ((COALESCE(stock, 0)), id);
+
+-- Verificar
+SELECT indexname, indexdef
+FROM pg_indexes
+WHERE tablename = 'paints' AND indexname LIKE 'idx_paints_%';
+
+-- 3. Búsqueda full-text (tsvector) y por trigramas (pg_trgm)
+--    /api/paints/search y los ILIKE '%...%' de /api/paint-images/search usan estos índices
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_paints_search_tsv ON paints USING GIN (
+    (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || coalesce(brand, '')))
+);
+CREATE INDEX IF NOT EXISTS idx_paints_color_code_trgm ON paints USING GIN (color_code gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_paints_name_trgm ON paints USING GIN (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_paint_images_codigo_trgm ON paint_images USING GIN (codigo gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_paint_images_nombre_trgm ON paint_images USING GIN (nombre gin_trgm_ops);
+
+-- Verificar
+SELECT extname, extversion FROM pg_extension WHERE extname = 'pg_trgm';
+
+-- 4. Código normalizado (mismo criterio que models.normalize_paint_code):
+--    mayúsculas, solo alfanuméricos y sin el prefijo de la marca si va seguido de dígitos
+ALTER TABLE paints ADD COLUMN IF NOT EXISTS normalized_code TEXT;
+ALTER TABLE paint_images ADD COLUMN IF NOT EXISTS normalized_code VARCHAR(50);
+
+UPDATE paints t
+SET normalized_code = NULLIF(CASE
+    WHEN n.brand_token <> '' AND n.code ~ ('^' || n.brand_token || '[0-9]') THEN substr(n.code, length(n.brand_token) + 1)
+    WHEN n.first_token <> '' AND n.code ~ ('^' || n.first_token || '[0-9]') THEN substr(n.code, length(n.first_token) + 1)
+    ELSE n.code
+END, '')
+FROM (
+    SELECT id,
+           regexp_replace(upper(coalesce(color_code, '')), '[^A-Z0-9]', '', 'g') AS code,
+           regexp_replace(upper(coalesce(brand, '')), '[^A-Z0-9]', '', 'g') AS brand_token,
+           regexp_replace(upper(split_part(trim(coalesce(brand, '')), ' ', 1)), '[^A-Z0-9]', '', 'g') AS first_token
+    FROM paints
+) n
+WHERE t.id = n.id AND t.normalized_code IS NULL;
+
+UPDATE paint_images t
+SET normalized_code = NULLIF(CASE
+    WHEN n.brand_token <> '' AND n.code ~ ('^' || n.brand_token || '[0-9]') THEN substr(n.code, length(n.brand_token) + 1)
+    WHEN n.first_token <> '' AND n.code ~ ('^' || n.first_token || '[0-9]') THEN substr(n.code, length(n.first_token) + 1)
+    ELSE n.code
+END, '')
+FROM (
+    SELECT id,
+           regexp_replace(upper(coalesce(codigo, '')), '[^A-Z0-9]', '', 'g') AS code,
+           regexp_replace(upper(coalesce(marca, '')), '[^A-Z0-9]', '', 'g') AS brand_token,
+           regexp_replace(upper(split_part(trim(coalesce(marca, '')), ' ', 1)), '[^A-Z0-9]', '', 'g') AS first_token
+    FROM paint_images
+) n
+WHERE t.id = n.id AND t.normalized_code IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_paints_normalized_code_brand ON paints (normalized_code, brand);
+CREATE INDEX IF NOT EXISTS idx_paint_images_normalized_code_marca ON paint_images (normalized_code, marca);
+
+-- Verificar
+SELECT brand, color_code, normalized_code FROM paints ORDER BY id LIMIT 20;
+
+-- 5. Equivalencias entre marcas (/api/paints/<id>/equivalents)
+--    Se rellenan con: python paint_equivalents.py  (o POST /admin/paints/equivalents/rebuild)
+CREATE TABLE IF NOT EXISTS paint_equivalents (
+    paint_id INTEGER NOT NULL REFERENCES paints (id) ON DELETE CASCADE,
+    equivalent_brand VARCHAR(100) NOT NULL,
+    rank SMALLINT NOT NULL,
+    equivalent_id INTEGER NOT NULL,
+    distance DOUBLE PRECISION NOT NULL,
+    computed_at TIMESTAMP,
+    PRIMARY KEY (paint_id, equivalent_brand, rank)
+);
+CREATE INDEX IF NOT EXISTS idx_paint_equivalents_equivalent_id ON paint_equivalents (equivalent_id);
+
+-- Verificar
+SELECT equivalent_brand, count(*) FROM paint_equivalents GROUP BY equivalent_brand;
+
+-- 6. Restricción única (brand, color_code) para el upsert de catálogos (POST /admin/paints/import)
+--    Antes, comprobar que no hay duplicados (si los hay, fusionarlos o borrarlos):
+SELECT brand, color_code, count(*), array_agg(id ORDER BY id) AS ids
+FROM paints GROUP BY brand, color_code HAVING count(*) > 1;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'unique_brand_code') THEN
+        ALTER TABLE paints ADD CONSTRAINT unique_brand_code UNIQUE (brand, color_code);
+    END IF;
+END $$;
+
+-- 7. Cola de notificaciones persistente (web y Android)
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    channel VARCHAR(20) NOT NULL,
+    paint_id INTEGER,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+    delivered_at TIMESTAMP,
+    acked_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_channel_id ON notification_outbox (channel, id);
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending ON notification_outbox (channel, id) WHERE acked_at IS NULL;
+
+-- Verificar
+SELECT channel, count(*) FILTER (WHERE acked_at IS NULL) AS pending, count(*) AS total
+FROM notification_outbox GROUP BY channel;
+
+-- 8. Cursor por dispositivo Android para el long-poll (/api/android-notify/poll)
+CREATE TABLE IF NOT EXISTS notification_device_cursors (
+    device_id VARCHAR(100) PRIMARY KEY,
+    last_acked_id BIGINT NOT NULL DEFAULT 0,
+    last_seen_at TIMESTAMP
+);
+-- needs_resync: el dispositivo debe recargar el catálogo (nuevo o con notificaciones borradas sin recibir)
+ALTER TABLE notification_device_cursors ADD COLUMN IF NOT EXISTS needs_resync BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- 9. Índices para filtrar y paginar /api/videos por nivel y categoría
+CREATE INDEX IF NOT EXISTS idx_videos_difficulty_level_id ON videos (difficulty_level, id);
+CREATE INDEX IF NOT EXISTS idx_videos_category_id_id ON videos (category_id, id);
+
+-- 10. Sincronización delta ordenada por transacción y bajas para /api/paints/changes
+--     change_txid guarda el txid de la última escritura (el token ya no depende del reloj)
+--     y deleted_paints recibe una fila por cada pintura borrada. Los tokens anteriores
+--     (updated_at, id) responden 400 y el panel recarga el catálogo completo.
+ALTER TABLE paints ADD COLUMN IF NOT EXISTS change_txid BIGINT;
+
+CREATE TABLE IF NOT EXISTS deleted_paints (
+    paint_id INTEGER PRIMARY KEY,
+    deleted_txid BIGINT NOT NULL,
+    deleted_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_deleted_paints_txid_id ON deleted_paints (deleted_txid, paint_id);
+
+CREATE OR REPLACE FUNCTION paints_track_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO deleted_paints (paint_id, deleted_txid, deleted_at)
+        VALUES (OLD.id, txid_current(), NOW() AT TIME ZONE 'UTC')
+        ON CONFLICT (paint_id) DO UPDATE SET deleted_txid = EXCLUDED.deleted_txid, deleted_at = EXCLUDED.deleted_at;
+        RETURN OLD;
+    END IF;
+    NEW.change_txid := txid_current();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS paints_track_change ON paints;
+CREATE TRIGGER paints_track_change BEFORE INSERT OR UPDATE OR DELETE ON paints
+    FOR EACH ROW EXECUTE PROCEDURE paints_track_change();
+
+UPDATE paints SET change_txid = txid_current() WHERE change_txid IS NULL;
+CREATE INDEX IF NOT EXISTS idx_paints_change_txid_id ON paints (change_txid, id);
+
+-- Verificar
+SELECT count(*) FILTER (WHERE change_txid IS NULL) AS sin_txid, count(*) AS total FROM paints;
+SELECT tgname FROM pg_trigger WHERE tgrelid = 'paints'::regclass AND NOT tgisinternal;
@@ -0,0 +1,237 @@
+"""
+Motor de búsqueda de pinturas por color (CIELAB + CIEDE2000 vectorizado con NumPy)
+
+Todas las pinturas con color_preview válido se guardan en arrays:
+ids, color en CIELAB, marca y stock. Una consulta calcula la distancia
+CIEDE2000 contra todas las filas a la vez y devuelve las k más cercanas.
+El índice admite altas, cambios y bajas sueltas sin reconstruirse entero.
+"""
+
+import re
+import threading
+
+import numpy as np
+
+_HEX_COLOR = re.compile(r'^#?([0-9a-fA-F]{6}|[0-9a-fA-F]{3})$')
+
+# sRGB (D65) -> XYZ
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def parse_hex_color(value):
+    """'#7a3b2e', '7A3B2E' o '#abc' -> (r, g, b); None si no es un color hexadecimal"""
+    if not value:
+        return None
+    match = _HEX_COLOR.match(value.strip())
+    if not match:
+        return None
+    digits = match.group(1)
+    if len(digits) == 3:
+        digits = ''.join(digit * 2 for digit in digits)
+    return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def srgb_to_lab(rgb):
+    """Array (N, 3) de sRGB 0-255 -> array (N, 3) CIELAB (iluminante D65)"""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _RGB_TO_XYZ.T / _D65_WHITE
+    delta = 6.0 / 29.0
+    f = np.where(xyz > delta ** 3, np.cbrt(xyz), xyz / (3 * delta ** 2) + 4.0 / 29.0)
+    L = 116.0 * f[:, 1] - 16.0
+    a = 500.0 * (f[:, 0] - f[:, 1])
+    b = 200.0 * (f[:, 1] - f[:, 2])
+    return np.stack([L, a, b], axis=1)
+
+
+def ciede2000(lab, labs):
+    """
+    Distancia CIEDE2000 entre un color lab (3,) y cada fila de labs (N, 3).
+    Admite broadcasting: lab (3, B, 1) contra labs (B, M, 3) da una matriz (B, M)
+    """
+    L1, a1, b1 = lab
+    L2, a2, b2 = labs[..., 0], labs[..., 1], labs[..., 2]
+
+    C1 = np.hypot(a1, b1)
+    C2 = np.hypot(a2, b2)
+    C_bar7 = ((C1 + C2) / 2.0) ** 7
+    G = 0.5 * (1.0 - np.sqrt(C_bar7 / (C_bar7 + 25.0 ** 7)))
+    a1p = (1.0 + G) * a1
+    a2p = (1.0 + G) * a2
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360.0
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360.0
+
+    chroma_product = C1p * C2p
+    zero_chroma = chroma_product == 0
+
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180.0, dhp - 360.0, dhp)
+    dhp = np.where(dhp < -180.0, dhp + 360.0, dhp)
+    dhp = np.where(zero_chroma, 0.0, dhp)
+    dHp = 2.0 * np.sqrt(chroma_product) * np.sin(np.radians(dhp / 2.0))
+
+    Lp_bar = (L1 + L2) / 2.0
+    Cp_bar = (C1p + C2p) / 2.0
+    h_sum = h1p + h2p
+    hp_bar = np.where(
+        np.abs(h1p - h2p) <= 180.0,
+        h_sum / 2.0,
+        np.where(h_sum < 360.0, (h_sum + 360.0) / 2.0, (h_sum - 360.0) / 2.0)
+    )
+    hp_bar = np.where(zero_chroma, h_sum, hp_bar)
+
+    T = (1.0
+         - 0.17 * np.cos(np.radians(hp_bar - 30.0))
+         + 0.24 * np.cos(np.radians(2.0 * hp_bar))
+         + 0.32 * np.cos(np.radians(3.0 * hp_bar + 6.0))
+         - 0.20 * np.cos(np.radians(4.0 * hp_bar - 63.0)))
+    d_theta = 30.0 * np.exp(-(((hp_bar - 275.0) / 25.0) ** 2))
+    Cp_bar7 = Cp_bar ** 7
+    R_C = 2.0 * np.sqrt(Cp_bar7 / (Cp_bar7 + 25.0 ** 7))
+    S_L = 1.0 + (0.015 * (Lp_bar - 50.0) ** 2) / np.sqrt(20.0 + (Lp_bar - 50.0) ** 2)
+    S_C = 1.0 + 0.045 * Cp_bar
+    S_H = 1.0 + 0.015 * Cp_bar * T
+    R_T = -np.sin(np.radians(2.0 * d_theta)) * R_C
+
+    dL = dLp / S_L
+    dC = dCp / S_C
+    dH = dHp / S_H
+    return np.sqrt(dL ** 2 + dC ** 2 + dH ** 2 + R_T * dC * dH)
+
+
+class PaintColorIndex:
+    """
+    Colores de las pinturas en arrays contiguos (capacidad que crece al doble).
+    version/watermark los gestiona app.py para saber si el índice está al día.
+    """
+
+    def __init__(self, capacity=1024):
+        self.lock = threading.RLock()
+        self._initial_capacity = capacity
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self._ids = np.zeros(self._initial_capacity, dtype=np.int64)
+            self._labs = np.zeros((self._initial_capacity, 3), dtype=np.float64)
+            self._stock = np.zeros(self._initial_capacity, dtype=np.int64)
+            self._brands = np.empty(self._initial_capacity, dtype=object)
+            self._positions = {}  # paint_id -> fila
+            self.size = 0
+            self.built = False
+            self.version = None
+            self.watermark = None
+
+    def _ensure_capacity(self, needed):
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self._ids = np.resize(self._ids, capacity)
+        self._labs = np.resize(self._labs, (capacity, 3))
+        self._stock = np.resize(self._stock, capacity)
+        brands = np.empty(capacity, dtype=object)
+        brands[:self.size] = self._brands[:self.size]
+        self._brands = brands
+
+    def load(self, rows):
+        """Cargar el índice completo desde filas (id, color_preview, brand, stock)"""
+        parsed = [(paint_id, parse_hex_color(color), brand, stock) for paint_id, color, brand, stock in rows]
+        parsed = [row for row in parsed if row[1] is not None]
+        with self.lock:
+            self.reset()
+            self._ensure_capacity(len(parsed))
+            if parsed:
+                self._ids[:len(parsed)] = [row[0] for row in parsed]
+                self._labs[:len(parsed)] = srgb_to_lab([row[1] for row in parsed])
+                self._stock[:len(parsed)] = [row[3] or 0 for row in parsed]
+                self._brands[:len(parsed)] = [(row[2] or '').upper() for row in parsed]
+            self.size = len(parsed)
+            self._positions = {paint_id: position for position, paint_id in enumerate(self._ids[:self.size].tolist())}
+            self.built = True
+
+    def upsert(self, paint_id, color, brand, stock):
+        """Alta o cambio de una pintura; sin color válido se quita del índice"""
+        rgb = parse_hex_color(color)
+        if rgb is None:
+            self.remove(paint_id)
+            return
+        lab = srgb_to_lab([rgb])[0]
+        with self.lock:
+            position = self._positions.get(paint_id)
+            if position is None:
+                self._ensure_capacity(self.size + 1)
+                position = self.size
+                self.size += 1
+                self._positions[paint_id] = position
+                self._ids[position] = paint_id
+            self._labs[position] = lab
+            self._stock[position] = stock or 0
+            self._brands[position] = (brand or '').upper()
+
+    def remove(self, paint_id):
+        """Baja de una pintura: la última fila ocupa su hueco"""
+        with self.lock:
+            position = self._positions.pop(paint_id, None)
+            if position is None:
+                return
+            last = self.size - 1
+            if position != last:
+                moved_id = int(self._ids[last])
+                self._ids[position] = moved_id
+                self._labs[position] = self._labs[last]
+                self._stock[position] = self._stock[last]
+                self._brands[position] = self._brands[last]
+                self._positions[moved_id] = position
+            self._brands[last] = None
+            self.size = last
+
+    def query(self, rgb, k=10, brands=None, in_stock=False, exclude_ids=()):
+        """[(paint_id, distancia CIEDE2000)] de las k pinturas más cercanas al color rgb"""
+        lab = srgb_to_lab([rgb])[0]
+        with self.lock:
+            n = self.size
+            mask = np.ones(n, dtype=bool)
+            if brands:
+                mask &= np.isin(self._brands[:n], [brand.upper() for brand in brands])
+            if in_stock:
+                mask &= self._stock[:n] > 0
+            for paint_id in exclude_ids:
+                position = self._positions.get(paint_id)
+                if position is not None:
+                    mask[position] = False
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+            distances = ciede2000(lab, self._labs[candidates])
+            ids = self._ids[candidates]
+
+        k = min(k, len(candidates))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.lexsort((ids[nearest], distances[nearest]))]
+        return [(int(ids[i]), float(distances[i])) for i in nearest]
+
+    def snapshot(self):
+        """Copia (ids, labs, marcas) de las filas ocupadas, para cálculos largos sin bloquear el índice"""
+        with self.lock:
+            n = self.size
+            return self._ids[:n].copy(), self._labs[:n].copy(), self._brands[:n].copy()
+
+    def stats(self):
+        return {
+            'paints': self.size,
+            'capacity': len(self._ids),
+            'built': self.built,
+            'version': self.version,
+            'watermark': self.watermark,
+        }
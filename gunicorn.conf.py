@@ -0,0 +1,17 @@
+"""
+Configuración de gunicorn (se lee automáticamente: `gunicorn app:app` en Procfile, Dockerfile y start.sh)
+
+gthread: cada worker atiende varias peticiones en hilos. Los streams SSE
+(/api/web-notify/stream) ocupan un hilo mientras están abiertos, no un worker entero.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Hilos por worker: conexiones SSE abiertas + peticiones normales simultáneas
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+# Con gthread el timeout vigila que el worker siga vivo, no la duración de cada petición
+timeout = 120
+keepalive = 5
@@ -31,25 +31,29 @@ def test_api_connection():
         print(f"❌ Error conectando a API: {e}")
         return False
 
+def stream_paints(brand=None, fields=None):
+    """Descargar pinturas desde el export NDJSON (línea a línea, filtrado en el servidor)"""
+    headers = {'X-API-Key': API_KEY}
+    params = {}
+    if brand:
+        params['brand'] = brand
+    if fields:
+        params['fields'] = ','.join(fields)
+
+    with requests.get(f"{API_BASE_URL}/api/paints/export.ndjson", headers=headers,
+                      params=params, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
 def get_paints_by_brand(brand="VALLEJO"):
     """Obtener todas las pinturas de una marca específica"""
     try:
-        headers = {
-            'Content-Type': 'application/json',
-            'X-API-Key': API_KEY
-        }
-        
         print(f"📊 Obteniendo pinturas de marca: {brand}...")
-        response = requests.get(f"{API_BASE_URL}/api/paints", headers=headers, timeout=30)
-        
-        if response.status_code == 200:
-            all_paints = response.json()
-            brand_paints = [paint for paint in all_paints if paint.get('brand', '').upper() == brand.upper()]
-            print(f"✅ Encontradas {len(brand_paints)} pinturas de {brand}")
-            return brand_paints
-        else:
-            print(f"❌ Error obteniendo pinturas: {response.status_code}")
-            return []
+        brand_paints = list(stream_paints(brand=brand, fields=['id', 'name', 'color_code']))
+        print(f"✅ Encontradas {len(brand_paints)} pinturas de {brand}")
+        return brand_paints
             
     except Exception as e:
         print(f"❌ Error obteniendo pinturas: {e}")
@@ -156,34 +160,23 @@ def update_shelf_positions(paints, positions_data):
 def verify_update():
     """Verificar que la actualización se realizó correctamente"""
     try:
-        headers = {
-            'Content-Type': 'application/json',
-            'X-API-Key': API_KEY
-        }
-        
         print("\n🔍 Verificando actualización...")
-        response = requests.get(f"{API_BASE_URL}/api/paints", headers=headers, timeout=30)
+        vallejo_paints = list(stream_paints(brand='VALLEJO', fields=['id', 'name', 'color_code', 'shelf_position']))
+
+        with_position = [paint for paint in vallejo_paints if paint.get('shelf_position') is not None]
+        without_position = [paint for paint in vallejo_paints if paint.get('shelf_position') is None]
         
-        if response.status_code == 200:
-            all_paints = response.json()
-            vallejo_paints = [paint for paint in all_paints if paint.get('brand', '').upper() == 'VALLEJO']
-            
-            with_position = [paint for paint in vallejo_paints if paint.get('shelf_position') is not None]
-            without_position = [paint for paint in vallejo_paints if paint.get('shelf_position') is None]
-            
-            print(f"\n📊 Verificación final:")
-            print(f"  - Pinturas VALLEJO con posición: {len(with_position)}")
-            print(f"  - Pinturas VALLEJO sin posición: {len(without_position)}")
-            
-            if with_position:
-                print(f"\n  Ejemplos de pinturas con posición:")
-                # Mostrar los primeros 5 ejemplos ordenados por posición
-                examples = sorted(with_position, key=lambda x: x.get('shelf_position', 0))[:5]
-                for paint in examples:
-                    print(f"    • {paint['name']} ({paint['color_code']}) - Posición: {paint['shelf_position']}")
-        else:
-            print(f"❌ Error verificando: {response.status_code}")
-            
+        print(f"\n📊 Verificación final:")
+        print(f"  - Pinturas VALLEJO con posición: {len(with_position)}")
+        print(f"  - Pinturas VALLEJO sin posición: {len(without_position)}")
+        
+        if with_position:
+            print(f"\n  Ejemplos de pinturas con posición:")
+            # Mostrar los primeros 5 ejemplos ordenados por posición
+            examples = sorted(with_position, key=lambda x: x.get('shelf_position', 0))[:5]
+            for paint in examples:
+                print(f"    • {paint['name']} ({paint['color_code']}) - Posición: {paint['shelf_position']}")
+
     except Exception as e:
         print(f"❌ Error al verificar: {e}")
 
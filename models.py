@@ -1,9 +1,30 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+import re
 
 db = SQLAlchemy()
 
+def _compact_code(value):
+    """Mayúsculas y solo caracteres alfanuméricos: '70.950' -> '70950', 'ak-11001' -> 'AK11001'"""
+    return re.sub(r'[^A-Z0-9]', '', (value or '').upper())
+
+def normalize_paint_code(code, brand=None):
+    """
+    Forma canónica de un código de pintura para búsquedas y duplicados.
+    Elimina puntos, guiones y espacios, y el prefijo de la marca si va seguido
+    de dígitos ('AK-11001' con marca AK -> '11001', '70.950' -> '70950').
+    Debe coincidir con el backfill SQL de CATALOG_SCHEMA_MIGRATIONS en app.py.
+    """
+    normalized = _compact_code(code)
+    if brand and normalized:
+        for prefix in (_compact_code(brand), _compact_code(brand.strip().split(' ')[0])):
+            if prefix and normalized.startswith(prefix) and normalized[len(prefix):][:1].isdigit():
+                return normalized[len(prefix):]
+    return normalized or None
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -47,11 +68,16 @@ class Video(db.Model):
     # Relación con los favoritos
     favorites = db.relationship('Favorite', backref='video', lazy=True)
     
-    # Relación con las técnicas
-    techniques = db.relationship('Technique', backref='video', lazy=True, cascade='all, delete-orphan')
+    # Relación con las técnicas (en orden de aparición en el video)
+    techniques = db.relationship('Technique', backref='video', lazy=True, cascade='all, delete-orphan',
+                                 order_by='Technique.start_time')
     
-    # Restricción única compuesta
-    __table_args__ = (db.UniqueConstraint('video_id', 'difficulty_level', name='video_level_uc'),)
+    # Restricción única compuesta; índices para filtrar y paginar por nivel y categoría (/api/videos)
+    __table_args__ = (
+        db.UniqueConstraint('video_id', 'difficulty_level', name='video_level_uc'),
+        db.Index('idx_videos_difficulty_level_id', 'difficulty_level', 'id'),
+        db.Index('idx_videos_category_id_id', 'category_id', 'id'),
+    )
     
     def __repr__(self):
         return f'<Video {self.title}>'
@@ -103,7 +129,7 @@ class Paint(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.Text, nullable=False)
     brand = db.Column(db.Text, nullable=False)
-    color_code = db.Column(db.Text)  # No unique constraint to avoid conflicts
+    color_code = db.Column(db.Text)  # Único junto con brand (unique_brand_code)
     color_type = db.Column(db.Text)
     color_family = db.Column(db.Text)
     image_url = db.Column(db.Text)
@@ -116,10 +142,25 @@ class Paint(db.Model):
     # New fields temporarily disabled
     # volume = db.Column(db.Integer, nullable=True)
     # hex_color = db.Column(db.String(6), default='000000')  # Hex color field
-    # updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     sync_status = db.Column(db.String(20), default='synced')  # 'synced', 'pending_upload'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Marca de agua para sincronización delta
+    normalized_code = db.Column(db.Text)  # normalize_paint_code(color_code, brand), se rellena al guardar
+    # txid_current() de la última escritura (trigger paints_track_change, también con SQL directo):
+    # cursor de /api/paints/changes, ordenado por transacción y no por reloj
+    change_txid = db.Column(db.BigInteger, server_default=db.FetchedValue(), server_onupdate=db.FetchedValue())
+
+    # Índices para mejorar rendimiento
+    __table_args__ = (
+        db.UniqueConstraint('brand', 'color_code', name='unique_brand_code'),  # Upsert de catálogos (paint_bulk.py)
+        db.Index('idx_paints_updated_at_id', 'updated_at', 'id'),
+        db.Index('idx_paints_change_txid_id', 'change_txid', 'id'),
+        db.Index('idx_paints_normalized_code_brand', 'normalized_code', 'brand'),
+        db.Index('idx_paints_brand_color_code', 'brand', 'color_code'),
+        db.Index('idx_paints_color_family', 'color_family'),
+        db.Index('idx_paints_sync_status', 'sync_status'),
+    )
+
     def to_dict(self):
         """Convert Paint object to dictionary for JSON serialization"""
         return {
@@ -141,7 +182,7 @@ class Paint(db.Model):
             # 'volume': self.volume,
             # 'hex_color': self.hex_color,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            # 'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
     
     def __repr__(self):
@@ -205,9 +246,13 @@ class PaintImage(db.Model):
     categoria = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    normalized_code = db.Column(db.String(50))  # normalize_paint_code(codigo, marca), se rellena al guardar
     
     # Constraint unique para evitar duplicados
-    __table_args__ = (db.UniqueConstraint('marca', 'codigo', name='unique_marca_codigo'),)
+    __table_args__ = (
+        db.UniqueConstraint('marca', 'codigo', name='unique_marca_codigo'),
+        db.Index('idx_paint_images_normalized_code_marca', 'normalized_code', 'marca'),
+    )
     
     def to_dict(self):
         """Convert PaintImage object to dictionary for JSON serialization"""
@@ -225,6 +270,107 @@ class PaintImage(db.Model):
     def __repr__(self):
         return f'<PaintImage {self.marca} - {self.codigo} - {self.nombre}>'
 
+# Mantener normalized_code al día en cada alta o modificación hecha con el ORM
+@event.listens_for(Paint, 'before_insert')
+@event.listens_for(Paint, 'before_update')
+def _fill_paint_normalized_code(mapper, connection, target):
+    target.normalized_code = normalize_paint_code(target.color_code, target.brand)
+
+@event.listens_for(PaintImage, 'before_insert')
+@event.listens_for(PaintImage, 'before_update')
+def _fill_paint_image_normalized_code(mapper, connection, target):
+    target.normalized_code = normalize_paint_code(target.codigo, target.marca)
+
+class DeletedPaint(db.Model):
+    """Pinturas borradas (las anota el trigger paints_track_change) para la sincronización delta"""
+    __tablename__ = 'deleted_paints'
+    
+    paint_id = db.Column(db.Integer, primary_key=True)
+    deleted_txid = db.Column(db.BigInteger, nullable=False)  # txid_current() de la transacción que la borró
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_deleted_paints_txid_id', 'deleted_txid', 'paint_id'),
+    )
+    
+    def __repr__(self):
+        return f'<DeletedPaint {self.paint_id} @{self.deleted_txid}>'
+
+# Trigger de paints: change_txid en cada alta/modificación y una fila en deleted_paints por cada baja.
+# Lo instala db.create_all() y POST /admin/migrate-catalog-schema (mismo SQL)
+PAINT_CHANGE_TRACKING_SQL = """
+CREATE OR REPLACE FUNCTION paints_track_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO deleted_paints (paint_id, deleted_txid, deleted_at)
+        VALUES (OLD.id, txid_current(), NOW() AT TIME ZONE 'UTC')
+        ON CONFLICT (paint_id) DO UPDATE SET deleted_txid = EXCLUDED.deleted_txid, deleted_at = EXCLUDED.deleted_at;
+        RETURN OLD;
+    END IF;
+    NEW.change_txid := txid_current();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS paints_track_change ON paints;
+CREATE TRIGGER paints_track_change BEFORE INSERT OR UPDATE OR DELETE ON paints
+    FOR EACH ROW EXECUTE PROCEDURE paints_track_change();
+"""
+
+event.listen(Paint.__table__, 'after_create', db.DDL(PAINT_CHANGE_TRACKING_SQL).execute_if(dialect='postgresql'))
+
+class PaintEquivalent(db.Model):
+    """Equivalencias precalculadas: las k pinturas de otra marca más parecidas en color (CIEDE2000)"""
+    __tablename__ = 'paint_equivalents'
+    
+    paint_id = db.Column(db.Integer, db.ForeignKey('paints.id', ondelete='CASCADE'), primary_key=True)
+    equivalent_brand = db.Column(db.String(100), primary_key=True)  # Marca en mayúsculas
+    rank = db.Column(db.SmallInteger, primary_key=True)  # 1 = la más parecida
+    equivalent_id = db.Column(db.Integer, nullable=False)
+    distance = db.Column(db.Float, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # La clave primaria (paint_id, equivalent_brand, rank) resuelve /api/paints/<id>/equivalents;
+    # equivalent_id se usa para recalcular quién apuntaba a una pintura que ha cambiado
+    __table_args__ = (
+        db.Index('idx_paint_equivalents_equivalent_id', 'equivalent_id'),
+    )
+    
+    def __repr__(self):
+        return f'<PaintEquivalent {self.paint_id} -> {self.equivalent_id} ({self.equivalent_brand} #{self.rank})>'
+
+class NotificationOutbox(db.Model):
+    """Notificaciones pendientes (web y Android), guardadas en la misma transacción que el cambio"""
+    __tablename__ = 'notification_outbox'
+    
+    id = db.Column(db.BigInteger, primary_key=True)
+    channel = db.Column(db.String(20), nullable=False)  # 'web' o 'android'
+    paint_id = db.Column(db.Integer)
+    payload = db.Column(JSONB, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime)  # Último envío (Android: se reenvía si no se confirma)
+    acked_at = db.Column(db.DateTime)  # Confirmada: ya no se vuelve a enviar
+    
+    # Lecturas por rango (channel, id); el índice parcial solo contiene las pendientes
+    __table_args__ = (
+        db.Index('idx_notification_outbox_channel_id', 'channel', 'id'),
+        db.Index('idx_notification_outbox_pending', 'channel', 'id', postgresql_where=db.text('acked_at IS NULL')),
+    )
+    
+    def __repr__(self):
+        return f'<NotificationOutbox {self.id} {self.channel} paint:{self.paint_id}>'
+
+class NotificationDeviceCursor(db.Model):
+    """Última notificación Android confirmada por cada dispositivo (long-poll)"""
+    __tablename__ = 'notification_device_cursors'
+    
+    device_id = db.Column(db.String(100), primary_key=True)
+    last_acked_id = db.Column(db.BigInteger, nullable=False, default=0)
+    last_seen_at = db.Column(db.DateTime)
+    needs_resync = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # Recargar el catálogo entero
+    
+    def __repr__(self):
+        return f'<NotificationDeviceCursor {self.device_id} @{self.last_acked_id}>'
+
 class PriceSource(db.Model):
     __tablename__ = 'price_sources'
     
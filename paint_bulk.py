@@ -0,0 +1,435 @@
+"""
+Escrituras masivas sobre la tabla paints basadas en conjuntos
+
+Los datos de entrada (CSV) se vuelcan con COPY a una tabla temporal y se
+aplican con una sola sentencia UPDATE ... FROM, dentro de la transacción de
+db.session. El llamador hace commit e invalida el catálogo.
+"""
+
+import csv
+import io
+
+from models import db, normalize_paint_code
+
+# Mismo criterio que el ORM (datetime.utcnow) para updated_at; clock_timestamp() y no NOW()
+# para que el instante sea el de la escritura y no el del inicio de la transacción
+UTC_NOW_SQL = "(clock_timestamp() AT TIME ZONE 'UTC')"
+
+CODE_COLUMNS = ('codigo', 'código', 'code', 'color_code')
+STOCK_COLUMNS = ('stock', 'existencias', 'inventario')
+BRAND_COLUMNS = ('brand', 'marca')
+
+UNMATCHED_SAMPLE_SIZE = 100
+# Rango de las columnas INTEGER: un valor mayor haría fallar el COPY de todo el CSV
+INTEGER_MIN = -2147483648
+INTEGER_MAX = 2147483647
+
+
+class CopyStream(io.TextIOBase):
+    """Objeto tipo fichero que entrega a COPY las líneas de un iterador sin acumularlas"""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            chunk, self._buffer = self._buffer, ''
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def csv_lines(rows):
+    """Filas (tuplas) -> líneas CSV para COPY ... WITH (FORMAT csv)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def copy_rows(table, columns, rows):
+    """COPY de las filas a una tabla (normalmente temporal) por la conexión de db.session"""
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            CopyStream(csv_lines(rows))
+        )
+    finally:
+        cursor.close()
+
+
+def decode_csv(data):
+    """Bytes del CSV -> texto (UTF-8 con o sin BOM; si no, Windows-1252 como exporta Excel)"""
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return data.decode('cp1252', errors='replace')
+
+
+def read_csv(text):
+    """Lector CSV detectando el separador (',', ';' o tabulador)"""
+    sample = text[:4096]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(io.StringIO(text), dialect)
+
+
+def find_column(header, variants):
+    """Posición de la primera columna cuyo nombre coincide con alguna variante, o None"""
+    names = [name.strip().lower() for name in header]
+    for variant in variants:
+        if variant in names:
+            return names.index(variant)
+    return None
+
+
+def parse_integer(value):
+    """'12', '12.0' o '12,0' -> int; ValueError si no es un número o no cabe en INTEGER"""
+    number = float(value.replace(',', '.'))
+    if not INTEGER_MIN <= number <= INTEGER_MAX:  # También descarta nan e inf
+        raise ValueError(f"number out of range {value}")
+    return int(number)
+
+
+def parse_stock(value):
+    """'12', '12.0' o '' (= 0) -> int; ValueError si no es un número entero no negativo"""
+    value = (value or '').strip()
+    stock = parse_integer(value) if value else 0
+    if stock < 0:
+        raise ValueError(f"negative stock {value}")
+    return stock
+
+
+def import_stock_csv(data, default_brand=None):
+    """
+    Actualizar el stock desde un CSV con columnas de código y stock (y opcionalmente marca).
+    Las filas se cruzan con paints por (marca, código normalizado); si el CSV no trae
+    columna de marca se usa default_brand para todas.
+
+    Devuelve (resultado, cambios): resultado con los contadores y una muestra de filas
+    sin coincidencia, cambios con (id, name, color_code, brand, old_stock, new_stock)
+    de las pinturas cuyo stock ha cambiado. No hace commit.
+    """
+    from sqlalchemy import text
+
+    reader = read_csv(decode_csv(data))
+    header = next(reader, None)
+    if not header:
+        raise ValueError("Empty CSV file")
+
+    code_column = find_column(header, CODE_COLUMNS)
+    stock_column = find_column(header, STOCK_COLUMNS)
+    brand_column = find_column(header, BRAND_COLUMNS)
+    if code_column is None or stock_column is None:
+        raise ValueError(f"CSV must have code and stock columns (found: {header})")
+    if brand_column is None and not default_brand:
+        raise ValueError("CSV has no brand column: brand parameter is required")
+
+    counters = {'rows': 0, 'invalid': 0}
+    invalid_rows = []
+
+    def import_rows():
+        for line_no, row in enumerate(reader, start=2):
+            if not any(value.strip() for value in row):
+                continue
+            counters['rows'] += 1
+            try:
+                code = row[code_column].strip()
+                brand = (row[brand_column].strip() if brand_column is not None else '') or default_brand
+                normalized_code = normalize_paint_code(code, brand)
+                if not normalized_code or not brand:
+                    raise ValueError("missing code or brand")
+                stock = parse_stock(row[stock_column])
+            except (IndexError, ValueError) as e:
+                counters['invalid'] += 1
+                if len(invalid_rows) < UNMATCHED_SAMPLE_SIZE:
+                    invalid_rows.append({'line': line_no, 'error': str(e)})
+                continue
+            yield line_no, brand, code, normalized_code, stock
+
+    db.session.execute(text("""
+        CREATE TEMP TABLE stock_import (
+            line_no INTEGER,
+            brand TEXT,
+            code TEXT,
+            normalized_code TEXT,
+            stock INTEGER
+        ) ON COMMIT DROP
+    """))
+    copy_rows('stock_import', ('line_no', 'brand', 'code', 'normalized_code', 'stock'), import_rows())
+
+    # Si el CSV repite una pintura, gana la última fila
+    db.session.execute(text("""
+        CREATE TEMP TABLE stock_import_latest ON COMMIT DROP AS
+        SELECT DISTINCT ON (upper(trim(brand)), normalized_code) line_no, brand, code, normalized_code, stock
+        FROM stock_import
+        ORDER BY upper(trim(brand)), normalized_code, line_no DESC
+    """))
+
+    unmatched = db.session.execute(text("""
+        SELECT line_no, brand, code, count(*) OVER () AS total FROM stock_import_latest i
+        WHERE NOT EXISTS (
+            SELECT 1 FROM paints p
+            WHERE p.normalized_code = i.normalized_code AND upper(trim(p.brand)) = upper(trim(i.brand))
+        )
+        ORDER BY line_no
+        LIMIT :limit
+    """), {'limit': UNMATCHED_SAMPLE_SIZE}).fetchall()
+
+    changes = db.session.execute(text(f"""
+        UPDATE paints p
+        SET stock = src.new_stock, updated_at = {UTC_NOW_SQL}
+        FROM (
+            SELECT p2.id, p2.stock AS old_stock, i.stock AS new_stock
+            FROM stock_import_latest i
+            JOIN paints p2
+              ON p2.normalized_code = i.normalized_code AND upper(trim(p2.brand)) = upper(trim(i.brand))
+        ) src
+        WHERE p.id = src.id AND p.stock IS DISTINCT FROM src.new_stock
+        RETURNING p.id, p.name, p.color_code, p.brand, src.old_stock, src.new_stock
+    """)).fetchall()
+
+    unique_rows = db.session.execute(text("SELECT count(*) FROM stock_import_latest")).scalar()
+    unmatched_count = unmatched[0].total if unmatched else 0
+    result = {
+        'rows': counters['rows'],
+        'invalid': counters['invalid'],
+        'duplicates': counters['rows'] - counters['invalid'] - unique_rows,
+        'matched': unique_rows - unmatched_count,
+        'unmatched': unmatched_count,
+        'updated': len(changes),
+        'unmatched_rows': [{'line': row.line_no, 'brand': row.brand, 'code': row.code} for row in unmatched],
+        'invalid_rows': invalid_rows,
+    }
+    return result, changes
+
+
+# Importación de catálogos: INSERT ... ON CONFLICT (brand, color_code) sobre unique_brand_code.
+# Columnas del CSV: los nombres de PAINT_IMPORT_COLUMNS o sus alias en castellano
+PAINT_IMPORT_COLUMNS = {
+    'name': ('name', 'nombre'),
+    'brand': ('brand', 'marca'),
+    'color_code': ('color_code', 'codigo', 'código', 'code'),
+    'color_type': ('color_type', 'tipo'),
+    'color_family': ('color_family', 'familia'),
+    'image_url': ('image_url', 'imagen'),
+    'stock': ('stock', 'existencias'),
+    'price': ('price', 'precio'),
+    'description': ('description', 'descripcion', 'descripción'),
+    'color_preview': ('color_preview', 'color', 'hex'),
+    'ean': ('ean',),
+    'shelf_position': ('shelf_position', 'estanteria', 'estantería'),
+}
+PAINT_IMPORT_TYPES = {'stock': 'INTEGER', 'price': 'DOUBLE PRECISION', 'shelf_position': 'INTEGER'}
+
+
+def parse_import_value(field, value):
+    """Valor de una celda -> valor para la columna (None si está vacía)"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    if field in ('stock', 'shelf_position'):
+        return parse_integer(value)
+    if field == 'price':
+        return float(value.replace(',', '.'))
+    if field == 'ean' and (len(value) > 13 or not value.isdigit()):
+        raise ValueError(f"invalid EAN {value}")
+    return value
+
+
+def upsert_paints_csv(data, default_brand=None):
+    """
+    Alta o actualización de pinturas desde un CSV de catálogo, cruzando por (marca, código).
+
+    Antes del upsert, las filas cuyo código normalizado ya existe en la marca adoptan la
+    marca y el código tal como están guardados, así '70.950' actualiza la pintura '70950'.
+    Las celdas vacías no borran datos existentes. Devuelve (resultado, pinturas) con los
+    contadores inserted/updated/skipped y (id, inserted, color_changed) de cada pintura escrita.
+    No hace commit.
+    """
+    from sqlalchemy import text
+
+    reader = read_csv(decode_csv(data))
+    header = next(reader, None)
+    if not header:
+        raise ValueError("Empty CSV file")
+
+    columns = {}
+    for field, variants in PAINT_IMPORT_COLUMNS.items():
+        position = find_column(header, variants)
+        if position is not None:
+            columns[field] = position
+    if 'color_code' not in columns:
+        raise ValueError(f"CSV must have a color_code column (found: {header})")
+    if 'brand' not in columns and not default_brand:
+        raise ValueError("CSV has no brand column: brand parameter is required")
+    fields = [field for field in PAINT_IMPORT_COLUMNS if field in columns or field in ('name', 'brand')]
+
+    counters = {'rows': 0, 'invalid': 0}
+    invalid_rows = []
+
+    def import_rows():
+        for line_no, row in enumerate(reader, start=2):
+            if not any(value.strip() for value in row):
+                continue
+            counters['rows'] += 1
+            try:
+                values = {field: parse_import_value(field, row[position]) for field, position in columns.items()}
+                values['brand'] = values.get('brand') or default_brand
+                normalized_code = normalize_paint_code(values['color_code'], values['brand'])
+                # brand es NOT NULL: sin marca en la fila ni por defecto la fila no se puede dar de alta
+                if not normalized_code or not values['brand']:
+                    raise ValueError("missing code or brand")
+            except (IndexError, ValueError) as e:
+                counters['invalid'] += 1
+                if len(invalid_rows) < UNMATCHED_SAMPLE_SIZE:
+                    invalid_rows.append({'line': line_no, 'error': str(e)})
+                continue
+            yield [line_no, normalized_code] + [values.get(field) for field in fields]
+
+    staging_columns = ', '.join(f"{field} {PAINT_IMPORT_TYPES.get(field, 'TEXT')}" for field in fields)
+    db.session.execute(text(f"""
+        CREATE TEMP TABLE paint_import (line_no INTEGER, normalized_code TEXT, {staging_columns}) ON COMMIT DROP
+    """))
+    copy_rows('paint_import', ['line_no', 'normalized_code'] + fields, import_rows())
+
+    # Misma pintura con otra grafía de marca o código: usar la guardada para que ON CONFLICT la encuentre
+    db.session.execute(text("""
+        UPDATE paint_import i
+        SET brand = p.brand, color_code = p.color_code
+        FROM paints p
+        WHERE p.normalized_code = i.normalized_code AND upper(trim(p.brand)) = upper(trim(i.brand))
+          AND (p.brand, p.color_code) IS DISTINCT FROM (i.brand, i.color_code)
+    """))
+
+    # Si el CSV repite una pintura, gana la última fila (ON CONFLICT no admite la misma fila dos veces)
+    db.session.execute(text(f"""
+        CREATE TEMP TABLE paint_import_latest ON COMMIT DROP AS
+        SELECT DISTINCT ON (brand, color_code) normalized_code, {', '.join(fields)}
+        FROM paint_import
+        ORDER BY brand, color_code, line_no DESC
+    """))
+    unique_rows = db.session.execute(text("SELECT count(*) FROM paint_import_latest")).scalar()
+
+    # Un EAN que ya tiene otra pintura (o repetido en el CSV) violaría la restricción unique: se descarta
+    ean_conflicts = 0
+    if 'ean' in fields:
+        ean_conflicts = db.session.execute(text("""
+            UPDATE paint_import_latest i
+            SET ean = NULL
+            WHERE i.ean IS NOT NULL AND (
+                EXISTS (
+                    SELECT 1 FROM paints p
+                    WHERE p.ean = i.ean AND (p.brand, p.color_code) IS DISTINCT FROM (i.brand, i.color_code)
+                )
+                OR i.ean IN (SELECT ean FROM paint_import_latest GROUP BY ean HAVING count(*) > 1)
+            )
+        """)).rowcount
+
+    # name es NOT NULL y Postgres lo comprueba antes de detectar el conflicto: las filas sin
+    # nombre toman el de la pintura existente, y si es nueva no se puede dar de alta
+    db.session.execute(text("""
+        UPDATE paint_import_latest i
+        SET name = p.name
+        FROM paints p
+        WHERE i.name IS NULL AND p.brand = i.brand AND p.color_code = i.color_code
+    """))
+    missing_name = db.session.execute(text("DELETE FROM paint_import_latest WHERE name IS NULL")).rowcount
+
+    insert_fields = list(fields)
+    insert_values = [f"i.{field}" for field in fields]
+    if 'stock' in fields:
+        insert_values[insert_fields.index('stock')] = 'COALESCE(i.stock, 0)'
+    else:
+        insert_fields.append('stock')
+        insert_values.append('0')
+    update_fields = [field for field in fields if field not in ('brand', 'color_code')]
+    targets = ', '.join(update_fields)
+    current = ', '.join(f"paints.{field}" for field in update_fields)
+    incoming = ', '.join(f"COALESCE(EXCLUDED.{field}, paints.{field})" for field in update_fields)
+
+    # previous ve las filas antes del upsert (mismo snapshot): así se sabe a qué pinturas
+    # les cambió el color, las únicas cuyas equivalencias hay que recalcular
+    color_changed = "w.inserted"
+    if 'color_preview' in fields:
+        color_changed += " OR w.color_preview IS DISTINCT FROM previous.color_preview"
+    written = db.session.execute(text(f"""
+        WITH previous AS (
+            SELECT p.id, p.color_preview
+            FROM paints p
+            JOIN paint_import_latest i ON i.brand = p.brand AND i.color_code = p.color_code
+        ), written AS (
+            INSERT INTO paints ({', '.join(insert_fields)}, normalized_code, sync_status, created_at, updated_at)
+            SELECT {', '.join(insert_values)}, i.normalized_code, 'synced', {UTC_NOW_SQL}, {UTC_NOW_SQL}
+            FROM paint_import_latest i
+            ON CONFLICT ON CONSTRAINT unique_brand_code DO UPDATE
+            SET ({targets}, updated_at) = ({incoming}, {UTC_NOW_SQL})
+            WHERE ({current}) IS DISTINCT FROM ({incoming})
+            RETURNING paints.id, paints.color_preview, (xmax = 0) AS inserted
+        )
+        SELECT w.id, w.inserted, ({color_changed}) AS color_changed
+        FROM written w
+        LEFT JOIN previous ON previous.id = w.id
+    """)).fetchall()
+
+    inserted = sum(1 for row in written if row.inserted)
+    result = {
+        'rows': counters['rows'],
+        'inserted': inserted,
+        'updated': len(written) - inserted,
+        'skipped': counters['rows'] - len(written),
+        'unchanged': unique_rows - missing_name - len(written),
+        'invalid': counters['invalid'],
+        'duplicates': counters['rows'] - counters['invalid'] - unique_rows,
+        'missing_name': missing_name,
+        'ean_conflicts': ean_conflicts,
+        'invalid_rows': invalid_rows,
+    }
+    return result, written
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Importar un catálogo de pinturas (CSV) con upsert por marca y código')
+    parser.add_argument('csv_path', help='Archivo CSV del catálogo')
+    parser.add_argument('--brand', help='Marca de las pinturas si el CSV no tiene columna de marca')
+    parser.add_argument('--dry-run', action='store_true', help='Calcular el resultado sin guardar cambios')
+    args = parser.parse_args()
+
+    from app import app, finish_paint_upsert
+
+    with open(args.csv_path, 'rb') as csv_file:
+        data = csv_file.read()
+
+    with app.app_context():
+        started = time.time()
+        result, written = upsert_paints_csv(data, default_brand=args.brand)
+        if args.dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+            finish_paint_upsert(written)
+        print(f"{'🧪 Simulación' if args.dry_run else '✅ Importación'} de {args.csv_path} "
+              f"en {time.time() - started:.1f}s:")
+        for key in ('rows', 'inserted', 'updated', 'skipped', 'unchanged', 'invalid', 'duplicates',
+                    'missing_name', 'ean_conflicts'):
+            print(f"- {key}: {result[key]}")
+        for row in result['invalid_rows']:
+            print(f"Fila {row['line']}: {row['error']}")
@@ -0,0 +1,167 @@
+"""
+Equivalencias entre marcas precalculadas en la tabla paint_equivalents
+
+Para cada pintura se guardan las k pinturas más parecidas (CIEDE2000 sobre
+color_preview) de cada una de las otras marcas. Los cálculos trabajan sobre
+una copia del índice de colores (PaintColorIndex.snapshot()).
+
+Uso como proceso batch (recalcula la tabla entera):
+    python paint_equivalents.py [--k 3]
+"""
+
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, text
+
+from color_matching import ciede2000
+from models import db, PaintEquivalent
+
+EQUIVALENTS_PER_BRAND = 3
+# Con más de esta fracción del catálogo cambiada (p. ej. una importación) sale más barato recalcular todo
+FULL_REBUILD_FRACTION = 0.25
+INSERT_BATCH_SIZE = 5000
+# Pinturas por bloque: matrices de distancias (bloque x marca) de unos pocos MB
+COMPUTE_BLOCK_SIZE = 64
+# Clave de pg_advisory_xact_lock: cada worker de gunicorn refresca en su propio hilo y dos
+# recálculos a la vez chocarían en la clave primaria de paint_equivalents
+EQUIVALENTS_LOCK = 5_180_013
+
+
+def brand_groups(brands):
+    """{marca: posiciones} de las pinturas con marca"""
+    return {brand: np.flatnonzero(brands == brand) for brand in set(brands.tolist()) if brand}
+
+
+def compute_equivalents(snapshot, positions, k=EQUIVALENTS_PER_BRAND, groups=None):
+    """
+    Filas de paint_equivalents para las pinturas en esas posiciones del snapshot.
+    CIEDE2000 exacto contra todas las pinturas de cada marca, por bloques de pinturas
+    (una matriz de distancias por bloque y marca en vez de una llamada por pintura)
+    """
+    ids, labs, brands = snapshot
+    groups = groups if groups is not None else brand_groups(brands)
+    positions = np.asarray(list(positions), dtype=np.int64)
+    computed_at = datetime.utcnow()
+    rows = []
+    for start in range(0, len(positions), COMPUTE_BLOCK_SIZE):
+        block = positions[start:start + COMPUTE_BLOCK_SIZE]
+        block_labs = labs[block]
+        for brand, members in groups.items():
+            sources = np.flatnonzero(brands[block] != brand)
+            if not len(sources):
+                continue
+            # Distancias (B, M): cada pintura del bloque contra todas las de la marca
+            distances = ciede2000(block_labs[sources].T[:, :, np.newaxis], labs[members][np.newaxis, :, :])
+            count = min(k, len(members))
+            nearest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+            nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+            order = np.lexsort((ids[members[nearest]], nearest_distances), axis=1)
+            for row_index, source in enumerate(sources):
+                paint_id = int(ids[block[source]])
+                for rank, column in enumerate(order[row_index], start=1):
+                    rows.append({
+                        'paint_id': paint_id,
+                        'equivalent_brand': brand,
+                        'rank': rank,
+                        'equivalent_id': int(ids[members[nearest[row_index, column]]]),
+                        'distance': round(float(nearest_distances[row_index, column]), 4),
+                        'computed_at': computed_at,
+                    })
+    return rows
+
+
+def _lock_equivalents():
+    """Esperar a que termine cualquier otro recálculo (el lock se libera con el commit)"""
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': EQUIVALENTS_LOCK})
+
+
+def _insert_rows(rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(PaintEquivalent.__table__.insert(), rows[start:start + INSERT_BATCH_SIZE])
+
+
+def rebuild_paint_equivalents(snapshot, k=EQUIVALENTS_PER_BRAND):
+    """Recalcular la tabla entera en una transacción. Devuelve estadísticas"""
+    ids, _, brands = snapshot
+    rows = compute_equivalents(snapshot, range(len(ids)), k=k)
+    _lock_equivalents()
+    db.session.query(PaintEquivalent).delete(synchronize_session=False)
+    _insert_rows(rows)
+    db.session.commit()
+    return {'paints': len(ids), 'brands': len(brand_groups(brands)), 'rows': len(rows)}
+
+
+def find_affected_paints(snapshot, paint_ids, k=EQUIVALENTS_PER_BRAND):
+    """
+    Pinturas cuyas equivalencias pueden cambiar al cambiar (o borrarse) paint_ids:
+    las propias, las que las tenían como equivalente y las que ahora las tendrían
+    entre sus k más cercanas de su marca (o aún no tienen k de esa marca)
+    """
+    ids, labs, brands = snapshot
+    position_by_id = {paint_id: position for position, paint_id in enumerate(ids.tolist())}
+    affected = set(paint_ids)
+    affected.update(
+        row.paint_id for row in db.session.query(PaintEquivalent.paint_id).filter(
+            PaintEquivalent.equivalent_id.in_(list(paint_ids))
+        ).distinct()
+    )
+
+    worst_by_brand = {}
+    for paint_id in paint_ids:
+        position = position_by_id.get(paint_id)
+        if position is None or not brands[position]:
+            continue
+        brand = brands[position]
+        if brand not in worst_by_brand:
+            # Distancia de la k-ésima equivalente de esa marca (infinito si hay menos de k)
+            worst = np.full(len(ids), np.inf)
+            for row in db.session.query(
+                PaintEquivalent.paint_id, func.count(), func.max(PaintEquivalent.distance)
+            ).filter(PaintEquivalent.equivalent_brand == brand).group_by(PaintEquivalent.paint_id):
+                other_position = position_by_id.get(row[0])
+                if other_position is not None and row[1] >= k:
+                    worst[other_position] = row[2]
+            worst_by_brand[brand] = worst
+        distances = ciede2000(labs[position], labs)
+        closer = (brands != brand) & (distances < worst_by_brand[brand])
+        affected.update(ids[closer].tolist())
+    return affected
+
+
+def refresh_paint_equivalents(snapshot, paint_ids, k=EQUIVALENTS_PER_BRAND):
+    """Recalcular solo las filas afectadas por cambios en paint_ids. Devuelve estadísticas"""
+    ids, _, brands = snapshot
+    if len(paint_ids) > FULL_REBUILD_FRACTION * len(ids):
+        result = rebuild_paint_equivalents(snapshot, k=k)
+        return {'changed': len(paint_ids), 'recomputed': result['paints'], 'rows': result['rows']}
+    # Antes de leer la tabla: las filas afectadas se calculan sobre lo que confirmó el recálculo anterior
+    _lock_equivalents()
+    affected = find_affected_paints(snapshot, paint_ids, k=k)
+    position_by_id = {paint_id: position for position, paint_id in enumerate(ids.tolist())}
+    positions = [position_by_id[paint_id] for paint_id in affected if paint_id in position_by_id]
+    rows = compute_equivalents(snapshot, positions, k=k, groups=brand_groups(brands))
+    db.session.query(PaintEquivalent).filter(
+        PaintEquivalent.paint_id.in_(list(affected))
+    ).delete(synchronize_session=False)
+    _insert_rows(rows)
+    db.session.commit()
+    return {'changed': len(paint_ids), 'recomputed': len(affected), 'rows': len(rows)}
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Recalcular la tabla paint_equivalents')
+    parser.add_argument('--k', type=int, default=EQUIVALENTS_PER_BRAND, help='Equivalencias por marca')
+    args = parser.parse_args()
+
+    from app import app, refresh_paint_color_index
+
+    with app.app_context():
+        started = time.time()
+        result = rebuild_paint_equivalents(refresh_paint_color_index().snapshot(), k=args.k)
+        print(f"✅ paint_equivalents: {result['rows']} filas para {result['paints']} pinturas "
+              f"y {result['brands']} marcas en {time.time() - started:.1f}s")
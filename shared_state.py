@@ -0,0 +1,431 @@
+"""
+Estado compartido entre los workers de gunicorn (caché, contadores, snapshots, listas)
+
+Backends (se elige con SHARED_STATE_URL, o REDIS_URL si solo existe esa):
+- redis://...               Redis (recomendado con varias réplicas)
+- sqlite:///ruta/estado.db  Fichero SQLite compartido por los workers de una misma máquina
+- memory://                 Solo en el proceso actual (tests y desarrollo)
+
+Sin configuración se usa un fichero SQLite en el directorio temporal, de modo que
+todos los workers de la máquina comparten caché y versión del catálogo.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+
+from ttl_cache import TTLLRUCache
+
+
+class SharedStateBackend:
+    """Operaciones comunes; los valores se guardan como bytes"""
+    name = 'base'
+
+    def get_json(self, key):
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key, value, ttl=None):
+        self.set(key, json.dumps(value, separators=(',', ':')).encode('utf-8'), ttl=ttl)
+
+    def get_int(self, key):
+        value = self.get(key)
+        return int(value) if value is not None else 0
+
+    def track_key(self, prefix, key):
+        """Registrar una escritura en el espacio de nombres prefix (backends que lo necesitan para prune_prefix)"""
+
+
+class RedisStateBackend(SharedStateBackend):
+    name = 'redis'
+    # Índice por espacio de nombres (sorted set clave -> instante de escritura) para prune_prefix:
+    # no depende de que el servidor tenga configurada una política maxmemory
+    INDEX_KEY = '__index__:{prefix}'
+
+    def __init__(self, url):
+        import redis  # Dependencia opcional: solo necesaria con SHARED_STATE_URL/REDIS_URL redis://
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=max(1, int(ttl)) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        """Guardar solo si la clave no existe. Devuelve True si se guardó"""
+        return bool(self.client.set(key, value, ex=max(1, int(ttl)) if ttl else None, nx=True))
+
+    def delete(self, key):
+        return bool(self.client.delete(key))
+
+    def delete_prefix(self, prefix):
+        deleted = 0
+        keys = list(self.client.scan_iter(match=f"{prefix}*", count=500))
+        for start in range(0, len(keys), 500):
+            deleted += self.client.delete(*keys[start:start + 500])
+        self.client.delete(self.INDEX_KEY.format(prefix=prefix))
+        return deleted
+
+    def count_prefix(self, prefix):
+        return sum(1 for _ in self.client.scan_iter(match=f"{prefix}*", count=500))
+
+    def track_key(self, prefix, key):
+        self.client.zadd(self.INDEX_KEY.format(prefix=prefix), {key: time.time()})
+
+    def prune_prefix(self, prefix, max_entries):
+        """Borrar las claves escritas hace más tiempo hasta dejar max_entries. Devuelve cuántas se expulsaron"""
+        index_key = self.INDEX_KEY.format(prefix=prefix)
+        excess = int(self.client.zcard(index_key)) - max_entries
+        if excess <= 0:
+            return 0
+        # Con TTL fijo las más antiguas son también las caducadas (ya no existen: no cuentan)
+        keys = self.client.zrange(index_key, 0, excess - 1)
+        pipeline = self.client.pipeline()
+        pipeline.delete(*keys)
+        pipeline.zrem(index_key, *keys)
+        return int(pipeline.execute()[0])
+
+    def incr(self, key):
+        return int(self.client.incr(key))
+
+    def list_push(self, key, value, max_length):
+        pipeline = self.client.pipeline()
+        pipeline.rpush(key, value)
+        pipeline.ltrim(key, -max_length, -1)
+        pipeline.execute()
+
+    def list_range(self, key, count):
+        """Últimos count elementos, del más antiguo al más reciente"""
+        return self.client.lrange(key, -count, -1)
+
+    def list_length(self, key):
+        return int(self.client.llen(key))
+
+
+class SQLiteStateBackend(SharedStateBackend):
+    name = 'sqlite'
+    # Las claves caducadas que nadie vuelve a leer se borran en un barrido periódico
+    SWEEP_INTERVAL_SECONDS = 60
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._next_sweep = time.time() + self.SWEEP_INTERVAL_SECONDS
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state ("
+            " key TEXT PRIMARY KEY, value BLOB, expires_at REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_lists ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, value BLOB)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_shared_lists_key_id ON shared_lists (key, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_shared_state_expires_at ON shared_state (expires_at)")
+
+    def _connection(self):
+        # Una conexión por hilo (y por proceso: cada worker importa la app después del fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires_at FROM shared_state WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            conn.execute("DELETE FROM shared_state WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            return None
+        return bytes(value) if isinstance(value, memoryview) else value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connection().execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at)
+        )
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.SWEEP_INTERVAL_SECONDS
+        self.sweep_expired()
+
+    def sweep_expired(self):
+        """Borrar todas las claves caducadas. Devuelve cuántas se borraron"""
+        return self._connection().execute(
+            "DELETE FROM shared_state WHERE expires_at <= ?", (time.time(),)
+        ).rowcount
+
+    def add(self, key, value, ttl=None):
+        conn = self._connection()
+        now = time.time()
+        conn.execute("DELETE FROM shared_state WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, now + ttl if ttl else None)
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        return self._connection().execute("DELETE FROM shared_state WHERE key = ?", (key,)).rowcount > 0
+
+    def delete_prefix(self, prefix):
+        return self._connection().execute(
+            "DELETE FROM shared_state WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+        ).rowcount
+
+    def count_prefix(self, prefix):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM shared_state WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (len(prefix), prefix, time.time())
+        ).fetchone()[0]
+
+    def prune_prefix(self, prefix, max_entries):
+        """
+        Borrar caducadas y, si sobran, las que antes caducan (con TTL fijo, las escritas hace más
+        tiempo; las que no caducan, las últimas). No es LRU: las lecturas no se registran.
+        Devuelve cuántas se expulsaron
+        """
+        conn = self._connection()
+        conn.execute(
+            "DELETE FROM shared_state WHERE substr(key, 1, ?) = ? AND expires_at <= ?",
+            (len(prefix), prefix, time.time())
+        )
+        return conn.execute(
+            "DELETE FROM shared_state WHERE key IN ("
+            " SELECT key FROM shared_state WHERE substr(key, 1, ?) = ?"
+            " ORDER BY expires_at IS NULL DESC, expires_at DESC LIMIT -1 OFFSET ?)",
+            (len(prefix), prefix, max_entries)
+        ).rowcount
+
+    def incr(self, key):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO shared_state (key, value, expires_at) VALUES (?, '1', NULL) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(CAST(value AS INTEGER) + 1 AS TEXT)",
+                (key,)
+            )
+            value = conn.execute("SELECT value FROM shared_state WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return int(value)
+
+    def list_push(self, key, value, max_length):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO shared_lists (key, value) VALUES (?, ?)", (key, value))
+            conn.execute(
+                "DELETE FROM shared_lists WHERE key = ? AND id NOT IN ("
+                " SELECT id FROM shared_lists WHERE key = ? ORDER BY id DESC LIMIT ?)",
+                (key, key, max_length)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def list_range(self, key, count):
+        rows = self._connection().execute(
+            "SELECT value FROM shared_lists WHERE key = ? ORDER BY id DESC LIMIT ?", (key, count)
+        ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def list_length(self, key):
+        return self._connection().execute("SELECT COUNT(*) FROM shared_lists WHERE key = ?", (key,)).fetchone()[0]
+
+
+class MemoryStateBackend(SharedStateBackend):
+    """Solo dentro del proceso: útil en tests o con un único worker"""
+    name = 'memory'
+
+    def __init__(self, max_entries=100000):
+        self._cache = TTLLRUCache(max_entries=max_entries, ttl=None)
+        self._lists = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(key, value, ttl=ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            if self._cache.get(key) is not None:
+                return False
+            self._cache.set(key, value, ttl=ttl)
+            return True
+
+    def delete(self, key):
+        return self._cache.delete(key)
+
+    def delete_prefix(self, prefix):
+        keys = [key for key in self._cache.keys() if key.startswith(prefix)]
+        return sum(1 for key in keys if self._cache.delete(key))
+
+    def count_prefix(self, prefix):
+        return sum(1 for key in self._cache.keys() if key.startswith(prefix))
+
+    def prune_prefix(self, prefix, max_entries):
+        """Expulsar las menos usadas recientemente del espacio de nombres hasta dejar max_entries"""
+        keys = [key for key in self._cache.keys() if key.startswith(prefix)]  # De menos a más reciente
+        return sum(1 for key in keys[:max(0, len(keys) - max_entries)] if self._cache.delete(key))
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._cache.get(key) or 0) + 1
+            self._cache.set(key, str(value).encode('ascii'))
+            return value
+
+    def list_push(self, key, value, max_length):
+        with self._lock:
+            items = self._lists.setdefault(key, deque())
+            items.append(value)
+            while len(items) > max_length:
+                items.popleft()
+
+    def list_range(self, key, count):
+        with self._lock:
+            return list(self._lists.get(key, ()))[-count:]
+
+    def list_length(self, key):
+        return len(self._lists.get(key, ()))
+
+
+class SharedTTLCache:
+    """
+    Caché de valores JSON sobre un backend compartido, con la misma interfaz que
+    TTLLRUCache (get/set/delete/clear/stats). Las estadísticas son del proceso actual.
+    Cada PRUNE_EVERY escrituras del proceso se recorta el espacio de nombres a max_entries:
+    LRU en memory://, por antigüedad de escritura en Redis (índice del espacio de nombres)
+    y por caducidad en SQLite (SQLiteStateBackend.prune_prefix).
+    Los errores del backend se registran y no se propagan: delete/clear se llaman tras
+    confirmar escrituras en la base de datos, que no deben acabar en un 500.
+    """
+    # Cada cuántas escrituras se purga el espacio de nombres
+    PRUNE_EVERY = 100
+
+    def __init__(self, backend, namespace, max_entries=1000, ttl=300):
+        self.backend = backend
+        self.prefix = f"{namespace}:"
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'errors': 0,
+        }
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def get(self, key, default=None):
+        try:
+            value = self.backend.get_json(self.prefix + key)
+        except Exception as e:
+            print(f"⚠️ Shared cache get error ({key}): {str(e)}")
+            self._count('errors')
+            value = None
+        if value is None:
+            self._count('misses')
+            return default
+        self._count('hits')
+        return value
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.backend.set_json(self.prefix + key, value, ttl=self.ttl if ttl is None else ttl)
+            self.backend.track_key(self.prefix, self.prefix + key)
+            self._count('sets')
+            if self._stats['sets'] % self.PRUNE_EVERY == 0:
+                self._count('evictions', self.backend.prune_prefix(self.prefix, self.max_entries))
+        except Exception as e:
+            print(f"⚠️ Shared cache set error ({key}): {str(e)}")
+            self._count('errors')
+
+    def delete(self, key):
+        try:
+            deleted = self.backend.delete(self.prefix + key)
+        except Exception as e:
+            print(f"⚠️ Shared cache delete error ({key}): {str(e)}")
+            self._count('errors')
+            return False
+        if deleted:
+            self._count('invalidations')
+        return deleted
+
+    def clear(self):
+        try:
+            count = self.backend.delete_prefix(self.prefix)
+        except Exception as e:
+            print(f"⚠️ Shared cache clear error: {str(e)}")
+            self._count('errors')
+            return 0
+        self._count('invalidations', count)
+        return count
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['size'] = self.backend.count_prefix(self.prefix)
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+        stats['backend'] = self.backend.name
+        return stats
+
+
+_shared_state = None
+_shared_state_lock = threading.Lock()
+
+def create_shared_state(url=None):
+    """Crear el backend indicado por la URL (o por SHARED_STATE_URL / REDIS_URL)"""
+    url = url or os.environ.get('SHARED_STATE_URL') or os.environ.get('REDIS_URL')
+    if not url:
+        url = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'print_and_paint_shared_state.db')
+
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStateBackend(url)
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        # ':memory:' sería una base vacía distinta en cada hilo (conexión por hilo) y sin compartir entre workers
+        if not path or path == ':memory:':
+            raise ValueError(f"SHARED_STATE_URL needs a file path (sqlite:///ruta/estado.db) or memory://: {url}")
+        return SQLiteStateBackend(path)
+    if url.startswith('memory://'):
+        return MemoryStateBackend()
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+def get_shared_state():
+    """Backend compartido del proceso (se crea la primera vez que se pide)"""
+    global _shared_state
+    if _shared_state is None:
+        with _shared_state_lock:
+            if _shared_state is None:
+                _shared_state = create_shared_state()
+    return _shared_state
@@ -0,0 +1,92 @@
+"""
+Caché en memoria acotada (LRU + TTL) con estadísticas
+
+- Como máximo max_entries claves: al superarlo se expulsa la menos usada recientemente
+- Cada entrada caduca ttl segundos después de guardarse (ttl=None: sin caducidad)
+- Segura entre hilos (un lock por caché)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLLRUCache:
+    def __init__(self, max_entries=1000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # clave -> (valor, instante de caducidad)
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, key, default=None):
+        """Valor de la clave si existe y no ha caducado; default en otro caso"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self._stats['misses'] += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Guardar un valor; expulsa las entradas menos usadas si se supera max_entries"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            self._stats['sets'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def delete(self, key):
+        """Invalidar una clave. Devuelve True si existía"""
+        with self._lock:
+            if self._entries.pop(key, _MISSING) is _MISSING:
+                return False
+            self._stats['invalidations'] += 1
+            return True
+
+    def clear(self):
+        """Invalidar todas las claves. Devuelve cuántas había"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._stats['invalidations'] += count
+            return count
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+        return stats